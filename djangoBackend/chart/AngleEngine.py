@@ -0,0 +1,79 @@
+# Imports
+import numpy as np
+
+
+# Components (x, y, z) of the vectors used for each kind of angle: roll (x, y), pitch (z, y), yaw (x, z) and 3D (x, y, z)
+PLANE_MASKS = np.array([
+    [1, 1, 0],
+    [0, 1, 1],
+    [1, 0, 1],
+    [1, 1, 1],
+], dtype=np.float64)
+
+# Order of the angle series returned by calculate, as indexes into the left then right (roll, pitch, yaw, 3D) series
+SERIES_ORDER = [0, 1, 2, 4, 5, 6, 3, 7]
+
+# Version of the engine, to be increased whenever a change to it changes the angles it calculates,
+# so that angles stored before the change are no longer used
+ENGINE_VERSION = 1
+
+# Names of the angle series, in the order they are returned by calculate
+SERIES_NAMES = ['leftRoll', 'leftPitch', 'leftYaw', 'rightRoll', 'rightPitch', 'rightYaw', 'left3d', 'right3d']
+
+
+# Batch joint angle engine, computes the same angles as Calculator.Calculate for all frames at once
+class AngleEngine:
+    # Calculate angles
+    # Points are arrays of shape (frames, 3) holding the x, y and z coordinates of each point in each frame
+    # Returns the series leftJointRoll, leftJointPitch, leftJointYaw, rightJointRoll, rightJointPitch, rightJointYaw, left3d, right3d
+    # as arrays of shape (frames,), with NaN for frames where one of the vectors has zero length
+    @staticmethod
+    def calculate(leftUpperPoints, leftMiddlePoints, leftLowerPoints, rightUpperPoints, rightMiddlePoints, rightLowerPoints):
+        leftUpperPoints, leftMiddlePoints, leftLowerPoints, rightUpperPoints, rightMiddlePoints, rightLowerPoints = (
+            np.asarray(points, dtype=np.float64).reshape(-1, 3) for points in (
+                leftUpperPoints, leftMiddlePoints, leftLowerPoints, rightUpperPoints, rightMiddlePoints, rightLowerPoints
+            )
+        )
+
+        # Vectors from Upper to Middle and from Middle to Lower, for each side
+        leftUpperMiddle = leftMiddlePoints - leftUpperPoints
+        leftMiddleLower = leftLowerPoints - leftMiddlePoints
+        rightUpperMiddle = rightMiddlePoints - rightUpperPoints
+        rightMiddleLower = rightLowerPoints - rightMiddlePoints
+
+        # Project each vector onto the plane of each kind of angle, giving arrays of shape (8, frames, 3)
+        upperMiddle = np.concatenate([PLANE_MASKS[:, None] * leftUpperMiddle, PLANE_MASKS[:, None] * rightUpperMiddle])
+        middleLower = np.concatenate([PLANE_MASKS[:, None] * leftMiddleLower, PLANE_MASKS[:, None] * rightMiddleLower])
+
+        # Right roll has always been measured from Middle to Upper rather than Upper to Middle, keep it that way
+        upperMiddle[4] = -upperMiddle[4]
+
+        angles = AngleEngine.calculateAngles(upperMiddle, middleLower)
+        return tuple(angles[SERIES_ORDER])
+
+
+    # Calculate angles for several joints in one pass
+    # Points is an array of shape (frames, joints, 6, 3) holding the left upper, middle and lower, then right
+    # upper, middle and lower points of each joint, as returned by Parser.parseJoints
+    # Returns an array of shape (8, joints, frames), with the series in the same order as calculate
+    @staticmethod
+    def calculateAll(points):
+        points = np.asarray(points, dtype=np.float64)
+        frames, joints = points.shape[:2]
+
+        # Every joint is treated as further frames of a single joint, so all of them are calculated together
+        points = points.transpose(2, 1, 0, 3).reshape(6, joints * frames, 3)
+        angles = AngleEngine.calculate(*points)
+        return np.stack(angles).reshape(8, joints, frames)
+
+
+    # Calculate the angles between pairs of vectors, as Calculator.calculateAngle does for a single pair
+    # Vectors are arrays of shape (..., components), angles of zero length vectors are NaN
+    @staticmethod
+    def calculateAngles(lowerVectors, upperVectors):
+        dotProducts = np.einsum('...i,...i->...', lowerVectors, upperVectors)
+        magnitudes = np.linalg.norm(lowerVectors, axis=-1) * np.linalg.norm(upperVectors, axis=-1)
+
+        # Divide only where both vectors have a length, and keep rounding errors from taking cosines out of [-1, 1]
+        cosines = np.divide(dotProducts, magnitudes, out=np.full_like(dotProducts, np.nan), where=magnitudes > 0)
+        return 180 - np.rad2deg(np.arccos(np.clip(cosines, -1, 1)))
@@ -0,0 +1,111 @@
+# Imports
+import numpy as np
+
+
+# Downsample a series with Largest-Triangle-Three-Buckets, which keeps the points that most change its shape
+# x and y are arrays of shape (n,) without NaN, returns the (sorted) indexes of at most threshold points to keep
+def lttb(x, y, threshold):
+    n = len(x)
+    if threshold >= n:
+        return np.arange(n)
+    if threshold < 3:
+        return np.array([0, n - 1])[:max(threshold, 1)]
+
+    # The first and last points are always kept, the others are split into threshold - 2 buckets
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    indexes = np.empty(threshold, dtype=int)
+    indexes[0] = 0
+    indexes[-1] = n - 1
+
+    selected = 0
+    for bucket in range(threshold - 2):
+        start, stop = edges[bucket], edges[bucket + 1]
+        # The triangle's third point is the average of the next bucket, or the last point
+        nextStart, nextStop = (edges[bucket + 1], edges[bucket + 2]) if bucket + 2 < len(edges) else (n - 1, n)
+        nextX = x[nextStart:nextStop].mean()
+        nextY = y[nextStart:nextStop].mean()
+
+        # Keep the point of the bucket making the largest triangle with the last kept point and the next bucket
+        areas = np.abs(
+            (x[selected] - nextX) * (y[start:stop] - y[selected]) - (x[selected] - x[start:stop]) * (nextY - y[selected])
+        )
+        selected = start + int(np.argmax(areas))
+        indexes[bucket + 1] = selected
+    return indexes
+
+
+# Split total points between segments of the given lengths, in proportion to their lengths, with at least 2
+# (or the whole segment, if shorter) and at most every frame of each segment
+# The shares add up to total, unless the segments have fewer frames than that altogether
+def allocate(lengths, total):
+    lengths = np.asarray(lengths, dtype=int)
+    shares = np.minimum(lengths, min(2, total))
+    remaining = total - int(shares.sum())
+    while remaining > 0:
+        room = lengths - shares
+        if remaining >= room.sum():
+            return lengths
+        # Largest remainder, so the shares add up exactly
+        ideal = remaining * room / room.sum()
+        extra = np.floor(ideal).astype(int)
+        leftover = remaining - int(extra.sum())
+        extra[np.argsort(extra - ideal, kind='stable')[:leftover]] += 1
+        extra = np.minimum(extra, room)
+        shares += extra
+        remaining -= int(extra.sum())
+    return shares
+
+
+# Downsample an angle series to at most the given number of points, as a list of {x, y} points for the chart
+# Without points (or with at least as many points as frames), every frame is returned, with a null y for frames
+# without an angle (NaN)
+# Otherwise, gaps of frames without an angle split the series into segments, which are downsampled separately and
+# kept apart by a point with a null y, so that the chart still shows the gap. Each point stands for about a bucket
+# of len(series) / points frames, so gaps shorter than a bucket aren't shown, and only the longest gaps are shown
+# if there are too many to leave each segment 2 points; the frames without an angle are left out of a segment
+# Angles are rounded to precision decimal places, if given
+def downsample_series(times, series, points=None, precision=None):
+    times = np.asarray(times, dtype=np.float64)
+    series = np.asarray(series, dtype=np.float64)
+    if precision is not None:
+        series = np.round(series, precision)
+    # Times are in seconds, so milliseconds are enough
+    times = np.round(times, 3)
+
+    if points is None or points >= len(series):
+        return [{'x': x, 'y': None if np.isnan(y) else y} for x, y in zip(times.tolist(), series.tolist())]
+
+    # Runs of frames with an angle, as [start, stop) pairs
+    isValid = ~np.isnan(series)
+    valid = np.concatenate([[False], isValid, [False]])
+    runs = np.flatnonzero(valid[1:] != valid[:-1]).reshape(-1, 2)
+    if len(runs) == 0:
+        return []
+
+    # Gaps between runs to show, by the index of the run before them: those at least a bucket long, and of those
+    # only the longest if there are too many (each gap costs a point, and each segment at least 2)
+    gapLengths = runs[1:, 0] - runs[:-1, 1]
+    shown = np.flatnonzero(gapLengths >= len(series) / points)
+    maxGaps = max(0, (points - 2) // 3)
+    if len(shown) > maxGaps:
+        longest = np.argsort(-gapLengths[shown], kind='stable')[:maxGaps]
+        shown = np.sort(shown[longest])
+
+    # Segments of runs, split at the gaps shown, as [start, stop) pairs from the start of their first run to the
+    # end of their last run
+    segments = np.stack([
+        np.concatenate([[runs[0, 0]], runs[shown + 1, 0]]),
+        np.concatenate([runs[shown, 1], [runs[-1, 1]]]),
+    ], axis=1)
+    frames = [start + np.flatnonzero(isValid[start:stop]) for start, stop in segments]
+    shares = allocate([len(indexes) for indexes in frames], points - len(shown))
+
+    downsampled = []
+    for (start, stop), indexes, share in zip(segments, frames, shares):
+        if downsampled:
+            # Gap between segments, at the first frame without an angle
+            downsampled.append({'x': times[previousStop].item(), 'y': None})
+        kept = indexes[lttb(times[indexes], series[indexes], int(share))]
+        downsampled.extend({'x': x, 'y': y} for x, y in zip(times[kept].tolist(), series[kept].tolist()))
+        previousStop = stop
+    return downsampled
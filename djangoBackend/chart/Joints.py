@@ -0,0 +1,45 @@
+# Imports
+from data.datastore.posereader import KEYPOINT_INDEXES
+
+
+# Registry of joints, as the upper, middle and lower keypoints whose segments meet at the joint
+# Keypoint names are without their 'left_' or 'right_' prefix, and must be in KEYPOINT_MAPPINGS
+# Add a joint here to have its angles calculated, charted and served by the angles endpoint
+JOINTS = {
+    'Elbow': ('shoulder', 'elbow', 'wrist'),
+    'Shoulder': ('elbow', 'shoulder', 'hip'),
+    'Hip': ('shoulder', 'hip', 'knee'),
+    'Knee': ('hip', 'knee', 'ankle'),
+    'Ankle': ('knee', 'ankle', 'foot'),
+    'Wrist': ('elbow', 'wrist', 'index'),
+    # Head position relative to the torso
+    'Neck': ('ear', 'shoulder', 'hip'),
+    # Torso position relative to the whole leg
+    'Trunk': ('shoulder', 'hip', 'ankle'),
+}
+
+# Sides of the body, in the order their keypoints are returned
+SIDES = ('left', 'right')
+
+
+# Names of the left upper, middle and lower, then right upper, middle and lower keypoints of a joint
+def jointKeypointNames(joint):
+    return [f"{side}_{name}" for side in SIDES for name in JOINTS[joint]]
+
+
+# Indexes (in the pose estimation model's output) of the keypoints of a joint, in the order of jointKeypointNames
+def jointKeypointIndexes(joint):
+    return [KEYPOINT_INDEXES[name] for name in jointKeypointNames(joint)]
+
+
+# Return the registered name of a joint, ignoring case, or None if it isn't registered
+def findJoint(name):
+    for joint in JOINTS:
+        if joint.lower() == str(name).lower():
+            return joint
+    return None
+
+
+# Check the registry when it is loaded, so that a misspelt keypoint fails at startup rather than on a request
+for _joint in JOINTS:
+    jointKeypointIndexes(_joint)
@@ -0,0 +1,143 @@
+# Imports
+import os
+import json
+import fcntl
+import threading
+import numpy as np
+from data.datastore.posestore import PoseStore
+from .AngleEngine import ENGINE_VERSION, SERIES_NAMES
+from .Joints import JOINTS
+from .Visualise import compute_angles
+
+# Extensions of the local files holding a clip's live angles, next to its local pose data
+# Angles are appended as float32 values of shape (frames, joints, 8), in the order chunks are received
+ANGLES_EXT = ".angles"
+STATS_EXT = ".angles.json"
+ANGLE_DTYPE = np.dtype('<f4')
+
+
+# Joint angles of a clip calculated while it is being recorded, one chunk of pose data at a time
+# Each chunk only costs as much as its own frames: its angles are appended to the clip's angle series, and
+# merged into running statistics (count, sum, min, max and latest value of each series) kept in a sidecar file
+# Chunks of the same clip received at the same time, in any process, update its files in turn, holding a lock
+# on its angles file
+class LiveAngles:
+    # Instantiate class
+    def __init__(self, sid, clipNum) -> None:
+        self.sid = sid
+        self.clipNum = clipNum
+        self.joints = list(JOINTS)
+        self.poseStore = PoseStore(sid, clipNum)
+
+
+    # Add a chunk of pose data, as the (timestamps, keypoints) arrays appended to the clip's local pose data
+    def update(self, timestamps, keypoints):
+        if len(timestamps) == 0:
+            return
+
+        # Angles of the chunk, as an array of shape (frames, joints, 8)
+        angles = compute_angles(keypoints, self.joints).transpose(2, 1, 0)
+        valid = ~np.isnan(angles)
+
+        # Latest angle of each series, at the last frame of the chunk where it has one
+        lastValid = len(angles) - 1 - np.argmax(valid[::-1], axis=0)
+        latest = np.take_along_axis(angles, lastValid[None], axis=0)[0]
+        latestTimes = np.where(valid.any(axis=0), np.asarray(timestamps)[lastValid], -1)
+
+        with open(self.poseStore.get_path(ANGLES_EXT), "ab") as f:
+            # Released when the file is closed
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.write(angles.astype(ANGLE_DTYPE).tobytes())
+            f.flush()
+
+            stats = self.loadStats()
+            stats['frames'] += len(angles)
+            stats['count'] += valid.sum(axis=0)
+            stats['sum'] += np.where(valid, angles, 0).sum(axis=0)
+            # fmin and fmax ignore NaN, unless every value is NaN
+            stats['min'] = np.fmin(stats['min'], np.fmin.reduce(angles, axis=0))
+            stats['max'] = np.fmax(stats['max'], np.fmax.reduce(angles, axis=0))
+
+            # Chunks may arrive out of order, so only take values newer than the latest seen
+            newer = latestTimes > stats['latestTime']
+            stats['latest'] = np.where(newer, latest, stats['latest'])
+            stats['latestTime'] = np.where(newer, latestTimes, stats['latestTime'])
+            self.saveStats(stats)
+
+
+    # Load the running statistics, as arrays of shape (joints, 8), empty if there are none yet
+    def loadStats(self):
+        path = self.poseStore.get_path(STATS_EXT)
+        if os.path.exists(path):
+            with open(path) as f:
+                saved = json.load(f)
+            if saved['version'] == ENGINE_VERSION and saved['joints'] == self.joints:
+                return {
+                    'frames': saved['frames'],
+                    **{key: np.array(saved[key], dtype=np.float64) for key in ('count', 'sum', 'min', 'max', 'latest', 'latestTime')}
+                }
+
+        shape = (len(self.joints), len(SERIES_NAMES))
+        return {
+            'frames': 0,
+            'count': np.zeros(shape),
+            'sum': np.zeros(shape),
+            'min': np.full(shape, np.nan),
+            'max': np.full(shape, np.nan),
+            'latest': np.full(shape, np.nan),
+            'latestTime': np.full(shape, -1.0),
+        }
+
+
+    # Save the running statistics, replacing the sidecar file at once so that readers never see part of it
+    def saveStats(self, stats):
+        path = self.poseStore.get_path(STATS_EXT)
+        saved = {'version': ENGINE_VERSION, 'joints': self.joints, 'frames': stats['frames']}
+        for key in ('count', 'sum', 'min', 'max', 'latest', 'latestTime'):
+            # NaN isn't valid JSON, so is saved as None
+            saved[key] = [[None if np.isnan(value) else value for value in row] for row in stats[key].tolist()]
+
+        tmpPath = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmpPath, "w") as f:
+            json.dump(saved, f)
+        os.replace(tmpPath, path)
+
+
+    # Summarise the running statistics of each joint's angle series: min, max, range of motion, mean and latest value
+    # Only reads the sidecar file, so costs the same however long the clip is
+    def summary(self):
+        stats = self.loadStats()
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = stats['sum'] / stats['count']
+
+        def value(array, i, j):
+            return None if stats['count'][i, j] == 0 or np.isnan(array[i, j]) else float(array[i, j])
+
+        joints = {}
+        for i, joint in enumerate(self.joints):
+            joints[joint] = {
+                series: {
+                    'min': value(stats['min'], i, j),
+                    'max': value(stats['max'], i, j),
+                    'range': value(stats['max'] - stats['min'], i, j),
+                    'mean': value(mean, i, j),
+                    'latest': value(stats['latest'], i, j),
+                    'count': int(stats['count'][i, j]),
+                }
+                for j, series in enumerate(SERIES_NAMES)
+            }
+        return {'frames': stats['frames'], 'joints': joints}
+
+
+    # Angle series received since a frame, as an array of shape (frames, joints, 8), in the order chunks were received
+    # Only the requested frames are read, so a client polling for new angles only pays for the new ones
+    def series(self, since=0):
+        path = self.poseStore.get_path(ANGLES_EXT)
+        if not os.path.exists(path):
+            return np.empty((0, len(self.joints), len(SERIES_NAMES)), dtype=ANGLE_DTYPE)
+
+        frameSize = len(self.joints) * len(SERIES_NAMES)
+        frames = os.path.getsize(path) // (frameSize * ANGLE_DTYPE.itemsize)
+        since = min(max(since, 0), frames)
+        angles = np.fromfile(path, dtype=ANGLE_DTYPE, count=(frames - since) * frameSize, offset=since * frameSize * ANGLE_DTYPE.itemsize)
+        return angles.reshape(-1, len(self.joints), len(SERIES_NAMES))
@@ -1,112 +1,64 @@
+# Imports
+import numpy as np
+from data.datastore.posereader import PoseReader, KEYPOINT_INDEXES
+from .Joints import JOINTS, jointKeypointNames
+
+
 # Parser class
 class Parser:
+    # Keypoints used by the parser, any others in the pose data are ignored
+    KEYPOINTS = sorted({name for joint in JOINTS for name in jointKeypointNames(joint)})
+
     # Instantiate class
+    # Pose data is either a PoseReader, an array of shape (frames, keypoints, 5) indexed as in the
+    # pose estimation model's output, or (legacy) a list of frames in the format of PoseStore.format_poses
     def __init__(self, joint, poseData) -> None:
-        # Get joint, keypoint and frame data
         self.joint = joint
-        self.leftWristPoints = []
-        self.leftElbowPoints = []
-        self.leftShoulderPoints = []
-        self.leftHipPoints = []
-        self.leftKneePoints = []
-        self.leftAnklePoints = []
-        self.rightWristPoints = []
-        self.rightElbowPoints = []
-        self.rightShoulderPoints = []
-        self.rightHipPoints = []
-        self.rightKneePoints = []
-        self.rightAnklePoints = []  
         self.data = poseData
-        self.loadPoints()
-
-
-    # Load points
-    def loadPoints(self):
-        # Get all joint points by looping through frames
-        for current_frame in self.data:
-            # Add joint points to respective arrays
-            for points in current_frame["keypoints"]:
-                if (points['name'] == 'left_wrist'):
-                    self.leftWristPoints.append(points)
-
-                if (points['name'] == 'left_elbow'):
-                    self.leftElbowPoints.append(points)
 
-                if (points['name'] == 'left_shoulder'):
-                    self.leftShoulderPoints.append(points)
 
-                if (points['name'] == 'left_hip'):
-                    self.leftHipPoints.append(points)
+    # Names of the left upper, middle and lower, then right upper, middle and lower keypoints of the joint
+    def keypointNames(self):
+        return jointKeypointNames(self.joint) if self.joint in JOINTS else []
 
-                if (points['name'] == 'left_knee'):
-                    self.leftKneePoints.append(points)
 
-                if (points['name'] == 'left_ankle'):
-                    self.leftAnklePoints.append(points)
+    # Load points, as an array of shape (frames, keypoints, 3) of the x, y and z coordinates of the named keypoints
+    def loadPoints(self, names):
+        if isinstance(self.data, PoseReader):
+            # Only the joint's keypoints are read, in a single gather
+            return self.data.keypoints(names)[:, :, :3].astype(np.float64)
 
-                if (points['name'] == 'right_wrist'):
-                    self.rightWristPoints.append(points)
+        if isinstance(self.data, np.ndarray):
+            return self.data[:, [KEYPOINT_INDEXES[name] for name in names], :3].astype(np.float64)
 
-                if (points['name'] == 'right_elbow'):
-                    self.rightElbowPoints.append(points)
-
-                if (points['name'] == 'right_shoulder'):
-                    self.rightShoulderPoints.append(points)
-
-                if (points['name'] == 'right_hip'):
-                    self.rightHipPoints.append(points)
-
-                if (points['name'] == 'right_knee'):
-                    self.rightKneePoints.append(points)
-
-                if (points['name'] == 'right_ankle'):
-                    self.rightAnklePoints.append(points)
+        # Legacy format, keypoints are found by name, missing keypoints have NaN coordinates
+        points = np.full((len(self.data), len(names), 3), np.nan)
+        for frame, currentFrame in enumerate(self.data):
+            keypoints = {point['name']: point for point in currentFrame['keypoints']}
+            for i, name in enumerate(names):
+                point = keypoints.get(name)
+                if point is not None:
+                    points[frame, i] = (point['x'], point['y'], point['z'])
+        return points
 
 
     # Parse points
+    # Returns a tuple with the left and right, upper, middle and lower points, as arrays of shape (frames, 3)
+    # Unknown joints have no points
     def parse(self):
-        leftUpper = []
-        leftMiddle = []
-        leftLower = []
-        rightUpper = []
-        rightMiddle = []
-        rightLower = []
-
-        # Elbow joint
-        if self.joint == 'Elbow':
-            leftUpper = self.leftShoulderPoints
-            leftMiddle = self.leftElbowPoints
-            leftLower = self.leftWristPoints
-            rightUpper = self.rightShoulderPoints
-            rightMiddle = self.rightElbowPoints
-            rightLower = self.rightWristPoints
-
-        # Shoulder joint
-        if self.joint == 'Shoulder':
-            leftUpper = self.leftElbowPoints
-            leftMiddle = self.leftShoulderPoints
-            leftLower = self.leftHipPoints
-            rightUpper = self.rightElbowPoints
-            rightMiddle = self.rightShoulderPoints
-            rightLower = self.rightHipPoints
-                
-        # Hip joint
-        if self.joint == 'Hip':
-            leftUpper = self.leftShoulderPoints
-            leftMiddle = self.leftHipPoints
-            leftLower = self.leftKneePoints
-            rightUpper = self.rightShoulderPoints
-            rightMiddle = self.rightHipPoints
-            rightLower = self.rightKneePoints
-        
-        # Knee joint
-        if self.joint == 'Knee':
-            leftUpper = self.leftHipPoints
-            leftMiddle = self.leftKneePoints
-            leftLower = self.leftAnklePoints
-            rightUpper = self.rightHipPoints
-            rightMiddle = self.rightKneePoints
-            rightLower = self.rightAnklePoints
-        
-        # Return a tuple with the left and right, upper, middle and lower points
-        return leftUpper, leftMiddle, leftLower, rightUpper, rightMiddle, rightLower
+        names = self.keypointNames()
+        if not names:
+            empty = np.empty((0, 3))
+            return empty, empty, empty, empty, empty, empty
+
+        points = self.loadPoints(names)
+        return tuple(points[:, i] for i in range(len(names)))
+
+
+    # Parse the points of several joints at once, reading all of their keypoints in a single gather
+    # Returns an array of shape (frames, joints, 6, 3) with the left upper, middle and lower, then right upper,
+    # middle and lower points of each joint, in the order of the joints given
+    def parseJoints(self, joints):
+        names = [name for joint in joints for name in jointKeypointNames(joint)]
+        points = self.loadPoints(names)
+        return points.reshape(len(points), len(joints), 6, 3)
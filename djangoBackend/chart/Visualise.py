@@ -1,19 +1,107 @@
 # Imports
-import time
+import hashlib
+import numpy as np
+import data.datastore.sessionmeta as sm
+from data.datastore.anglestore import AngleStore
+from data.datastore.posestore import PoseStore
 from . import Parser
-from . import Calculator
+from .AngleEngine import AngleEngine, ENGINE_VERSION, SERIES_NAMES
+from .Joints import JOINTS
+from .Downsample import downsample_series
 
 
 # Calculate angles
+# Pose data is in any of the formats accepted by Parser
 def calculate_angles(joint, dimension, poseData):
-    numFrames = len(poseData)
+    return calculate_all_angles(poseData, [joint])[joint]
 
-    # Parse pose data
-    parser = Parser.Parser(joint, poseData)
-    leftUpperPoints, leftMiddlePoints, leftLowerPoints, rightUpperPoints, rightMiddlePoints, rightLowerPoints = parser.parse()
 
-    # Calculate angles
-    calculator = Calculator.Calculator(numFrames, leftUpperPoints, leftMiddlePoints, leftLowerPoints, rightUpperPoints, rightMiddlePoints, rightLowerPoints)
-    leftJointRoll, leftJointPitch, leftJointYaw, rightJointRoll, rightJointPitch, rightJointYaw, left3d, right3d = calculator.Calculate()
+# Calculate angles for several joints in one pass, all registered joints if none are given
+# Returns a dictionary from each joint's name to its 8 angle series, in the order of SERIES_NAMES
+def calculate_all_angles(poseData, joints=None):
+    joints = list(JOINTS) if joints is None else list(joints)
+    return format_angles(compute_angles(poseData, joints), joints)
 
-    return [leftJointRoll, leftJointPitch, leftJointYaw, rightJointRoll, rightJointPitch, rightJointYaw, left3d, right3d]
+
+# Calculate angles for several joints in one pass, as an array of shape (8, joints, frames)
+def compute_angles(poseData, joints):
+    # Parse pose data into a (frames, joints, 6, 3) array of the x, y and z coordinates of each joint's points
+    parser = Parser.Parser(None, poseData)
+    points = parser.parseJoints(joints)
+    return AngleEngine.calculateAll(points)
+
+
+# Format an array of angles returned by compute_angles as a dictionary from each joint's name to its angle series
+def format_angles(angles, joints):
+    # NaN (no angle) isn't valid JSON, so is returned as None
+    return {
+        joint: [[None if np.isnan(angle) else angle for angle in series.tolist()] for series in angles[:, i]]
+        for i, joint in enumerate(joints)
+    }
+
+
+# Format an array of angles returned by compute_angles as a dictionary from each joint's name to its angle series,
+# each a list of {x, y} points with the time (in seconds) and angle, downsampled to at most points points if given
+def format_points(times, angles, joints, points=None, precision=None):
+    return {
+        joint: [downsample_series(times, series, points, precision) for series in angles[:, i]]
+        for i, joint in enumerate(joints)
+    }
+
+
+# Tag identifying angles calculated for a set of joints by the current engine, for use with AngleStore
+# Angles stored with any other tag are stale, including those stored before frames were put in capture order
+def get_angles_tag(joints):
+    engine = (ENGINE_VERSION, 'capture order', [(joint, JOINTS[joint]) for joint in joints])
+    return f"v{ENGINE_VERSION}_{hashlib.sha1(repr(engine).encode()).hexdigest()[:8]}"
+
+
+# Get the angles of a clip's joints (all registered joints if none are given), in the format of calculate_all_angles
+# Pose data is opened if it isn't given, and only if the angles have to be calculated
+def get_clip_angles(sid, clipNum, joints=None, poseData=None):
+    joints = list(JOINTS) if joints is None else list(joints)
+    return format_angles(get_clip_angle_array(sid, clipNum, joints, poseData), joints)
+
+
+# Get the angles of a clip's joints (all registered joints if none are given), as an array of shape (8, joints, frames)
+# Angles of every registered joint are calculated together, once per clip and engine version, and stored
+# for later requests once the clip is closed (a clip still recording can receive more pose data).
+# Pose data is opened if it isn't given, and only if the angles have to be calculated
+def get_clip_angle_array(sid, clipNum, joints=None, poseData=None):
+    registered = list(JOINTS)
+    store = AngleStore(sid, clipNum, get_angles_tag(registered))
+    try:
+        angles = store.get()
+    except ValueError:
+        if poseData is None:
+            poseData = PoseStore.open(sid, clipNum)
+        angles = compute_angles(poseData, registered)
+
+        # Store the angles for next time, they can always be calculated again if this fails
+        try:
+            if sm.is_clip_closed(sid, clipNum):
+                store.write(angles)
+        except Exception as e:
+            print(f"could not store angles for clip with sid '{sid}' and clip number '{clipNum}': {e}")
+
+    if joints is None:
+        return angles
+    return angles[:, [registered.index(joint) for joint in joints]]
+
+
+# Calculate and store the angles of all of a clip's registered joints, so that they don't have to be
+# calculated when the clip is viewed
+# Returns whether the angles were calculated, rather than already stored
+def store_clip_angles(sid, clipNum, force=False):
+    joints = list(JOINTS)
+    store = AngleStore(sid, clipNum, get_angles_tag(joints))
+    if not force and store.exists():
+        return False
+
+    store.write(compute_angles(PoseStore.open(sid, clipNum), joints))
+    return True
+
+
+# Name each of a joint's angle series, e.g. for returning them as JSON
+def name_series(angles):
+    return dict(zip(SERIES_NAMES, angles))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from data.models import Session
+from chart.Visualise import store_clip_angles
+
+
+class Command(BaseCommand):
+    help = 'Calculate and store the joint angles of existing clips, so that they are not calculated when viewed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sid', nargs='+', help='sessions to backfill (default all sessions)')
+        parser.add_argument('--force', action='store_true', help='recalculate angles that are already stored')
+
+    def handle(self, *args, **options):
+        sessions = Session.objects.order_by('id')
+        if options['sid']:
+            sessions = sessions.filter(id__in=options['sid'])
+
+        stored = skipped = missing = 0
+        for session in sessions:
+            # A session's clip number is the number of its next clip, so its uploaded clips are numbered below it
+            for clip_num in range(1, session.clip_num):
+                try:
+                    calculated = store_clip_angles(session.id, str(clip_num), options['force'])
+                except ValueError as e:
+                    missing += 1
+                    self.stdout.write(f"skipped {session.id}_{clip_num}, {e}")
+                    continue
+                if calculated:
+                    stored += 1
+                    self.stdout.write(f"stored {session.id}_{clip_num}")
+                else:
+                    skipped += 1
+        self.stdout.write(self.style.SUCCESS(
+            f"stored angles for {stored} clip(s), {skipped} already stored, {missing} without pose data"
+        ))
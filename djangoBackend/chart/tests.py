@@ -1,3 +1,323 @@
-from django.test import TestCase
+import io
+import uuid
+import tempfile
+import threading
+import warnings
+import numpy as np
+from datetime import datetime
+from unittest import mock
+from django.core.management import call_command
+from django.test import Client, SimpleTestCase, TestCase, override_settings
+from chart.AngleEngine import AngleEngine, ENGINE_VERSION
+from chart.Downsample import allocate, lttb, downsample_series
+from chart.Joints import JOINTS
+from chart.LiveAngles import LiveAngles
+from chart.Calculator import Calculator
+from chart.Parser import Parser
+from chart.Visualise import calculate_angles, calculate_all_angles, compute_angles, get_angles_tag, get_clip_angle_array
+import data.datastore.sessionmeta as sm
+from data.models import Session
+from data.datastore.anglestore import AngleStore
+from data.datastore.posereader import PoseReader
+from data.datastore.posestore import PoseStore
+from data.datastore.storage import MemoryStorage
 
-# Create your tests here.
+
+def to_points(points):
+    # Points as Calculator expects them, one dictionary per frame
+    return [{'x': x, 'y': y, 'z': z} for x, y, z in points.tolist()]
+
+
+class AngleEngineTests(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        # Left and right upper, middle and lower points, for 500 frames
+        self.points = [rng.normal(size=(500, 3)) for _ in range(6)]
+
+    def test_matches_calculator(self):
+        expected = Calculator(500, *map(to_points, self.points)).Calculate()
+        actual = AngleEngine.calculate(*self.points)
+
+        self.assertEqual(len(actual), 8)
+        for expectedSeries, actualSeries in zip(expected, actual):
+            np.testing.assert_allclose(actualSeries, expectedSeries, rtol=0, atol=1e-9)
+
+    def test_zero_length_vectors_are_nan_without_warnings(self):
+        # Upper and middle points in the same place on the left side in the first 10 frames
+        self.points[1][:10] = self.points[0][:10]
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            angles = AngleEngine.calculate(*self.points)
+
+        for series in (angles[0], angles[1], angles[2], angles[6]):
+            self.assertTrue(np.isnan(series[:10]).all())
+            self.assertFalse(np.isnan(series[10:]).any())
+        for series in (angles[3], angles[4], angles[5], angles[7]):
+            self.assertFalse(np.isnan(series).any())
+
+    def test_calculate_angles_returns_none_for_nan(self):
+        names = ['left_hip', 'left_knee', 'left_ankle', 'right_hip', 'right_knee', 'right_ankle']
+        self.points[1][:1] = self.points[0][:1]
+        poseData = [
+            {'keypoints': [{'name': name, 'x': x, 'y': y, 'z': z} for name, (x, y, z) in zip(names, frame)]}
+            for frame in np.stack(self.points, axis=1).tolist()
+        ]
+
+        angles = calculate_angles('Knee', '2d', poseData)
+        self.assertIsNone(angles[0][0])
+        self.assertIsInstance(angles[0][1], float)
+        np.testing.assert_allclose(angles[3], AngleEngine.calculate(*self.points)[3])
+
+    def test_calculate_all_matches_each_joint(self):
+        rng = np.random.default_rng(2)
+        keypoints = rng.normal(size=(50, 39, 5))
+
+        angles = calculate_all_angles(keypoints)
+        self.assertEqual(list(angles), list(JOINTS))
+        for joint, series in angles.items():
+            expected = AngleEngine.calculate(*Parser(joint, keypoints).parse())
+            np.testing.assert_allclose(np.array(series, dtype=np.float64), expected, rtol=0, atol=1e-12)
+
+
+class ParserTests(SimpleTestCase):
+    def test_formats_parse_the_same(self):
+        rng = np.random.default_rng(1)
+        keypoints = rng.normal(size=(20, 39, 5)).astype(np.float32)
+        timestamps = np.arange(20, dtype=np.int64)
+        reader = PoseReader(timestamps, keypoints)
+
+        expected = Parser('Elbow', keypoints).parse()
+        for poseData in (reader, reader.to_dicts(Parser.KEYPOINTS)):
+            for expectedPoints, actualPoints in zip(expected, Parser('Elbow', poseData).parse()):
+                np.testing.assert_array_equal(actualPoints, expectedPoints)
+
+        # Left shoulder, elbow and wrist are keypoints 11, 13 and 15
+        np.testing.assert_array_equal(expected[1], keypoints[:, 13, :3])
+
+
+class LiveAnglesTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.settings = override_settings(LOCAL_POSES_DIR=self.directory.name)
+        self.settings.enable()
+        self.live = LiveAngles(f"test-{uuid.uuid4()}", 1)
+
+    def tearDown(self):
+        self.settings.disable()
+        self.directory.cleanup()
+
+    def test_chunks_match_whole_clip(self):
+        rng = np.random.default_rng(3)
+        timestamps = np.arange(90, dtype=np.int64)
+        keypoints = rng.normal(size=(90, 39, 5)).astype(np.float32)
+        # Right elbow's upper and middle points overlap in the last frames, so those have no angles
+        keypoints[80:, 14] = keypoints[80:, 12]
+
+        # Chunks arrive out of order
+        for start in (30, 0, 60):
+            self.live.update(timestamps[start:start + 30], keypoints[start:start + 30])
+
+        expected = np.array(calculate_all_angles(keypoints)['Elbow'], dtype=np.float64)
+        summary = self.live.summary()
+        self.assertEqual(summary['frames'], 90)
+        for j, series in enumerate(summary['joints']['Elbow'].values()):
+            valid = expected[j][~np.isnan(expected[j])]
+            self.assertEqual(series['count'], len(valid))
+            self.assertAlmostEqual(series['min'], valid.min())
+            self.assertAlmostEqual(series['max'], valid.max())
+            self.assertAlmostEqual(series['range'], valid.max() - valid.min())
+            self.assertAlmostEqual(series['mean'], valid.mean())
+            self.assertAlmostEqual(series['latest'], valid[-1])
+
+        # Series are kept in the order chunks were received
+        self.assertEqual(len(self.live.series(60)), 30)
+        np.testing.assert_allclose(self.live.series(30)[:30, 0, 0], expected[0, :30], rtol=1e-6)
+
+    def test_concurrent_updates_are_all_counted(self):
+        rng = np.random.default_rng(4)
+        timestamps = np.arange(160, dtype=np.int64)
+        keypoints = rng.normal(size=(160, 39, 5)).astype(np.float32)
+
+        # Each update uses its own LiveAngles, as concurrent requests do
+        threads = [
+            threading.Thread(target=LiveAngles(self.live.sid, 1).update, args=(timestamps[start:start + 20], keypoints[start:start + 20]))
+            for start in range(0, 160, 20)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.live.summary()['frames'], 160)
+        self.assertEqual(len(self.live.series()), 160)
+
+    def test_live_view_rejects_bad_clip_num(self):
+        client = Client(HTTP_HOST='192.168.0.150')
+        result = client.get('/chart/live/', {'sid': self.live.sid, 'clipNum': 'one'})
+        self.assertEqual(result.status_code, 400)
+
+        self.live.update(np.arange(10, dtype=np.int64), np.random.default_rng(5).normal(size=(10, 39, 5)).astype(np.float32))
+        result = client.get('/chart/live/', {'sid': self.live.sid, 'clipNum': '1'})
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual((result.json()['clipNum'], result.json()['frames']), (1, 10))
+
+
+class DownsampleTests(SimpleTestCase):
+    def test_lttb_keeps_ends_and_peaks(self):
+        x = np.arange(1000, dtype=np.float64)
+        y = np.sin(x / 50)
+        y[537] = 10
+
+        indexes = lttb(x, y, 100)
+        self.assertEqual(len(indexes), 100)
+        self.assertEqual(indexes[0], 0)
+        self.assertEqual(indexes[-1], 999)
+        self.assertIn(537, indexes)
+        self.assertTrue((np.diff(indexes) > 0).all())
+
+    def test_series_keeps_gaps(self):
+        times = np.arange(100) / 30
+        series = np.linspace(0, 180, 100)
+        series[40:50] = np.nan
+
+        points = downsample_series(times, series, 20, 1)
+        gaps = [point for point in points if point['y'] is None]
+        self.assertEqual(gaps, [{'x': round(40 / 30, 3), 'y': None}])
+        self.assertLessEqual(len(points), 21)
+        self.assertEqual(points[-1], {'x': 3.3, 'y': 180.0})
+
+        # Without a number of points, every frame is kept
+        self.assertEqual(len(downsample_series(times, series)), 100)
+
+    def test_series_with_frequent_gaps_keeps_to_points(self):
+        times = np.arange(18000) / 30
+        for every in (2, 50):
+            series = np.sin(np.arange(18000) / 100) * 90
+            series[::every] = np.nan
+
+            points = downsample_series(times, series, 100)
+            self.assertEqual(len(points), 100)
+            xs = [point['x'] for point in points]
+            self.assertEqual(xs, sorted(xs))
+            # Gaps of a frame or two are far shorter than a point, so none are shown
+            self.assertNotIn(None, [point['y'] for point in points])
+
+    def test_series_shows_only_the_longest_gaps(self):
+        times = np.arange(18000) / 30
+        series = np.sin(np.arange(18000) / 100) * 90
+        # 57 gaps at least a point long, one of them longer than the others
+        for start in range(100, 18000, 300):
+            series[start:start + 200] = np.nan
+        series[9100:9700] = np.nan
+
+        points = downsample_series(times, series, 100)
+        self.assertEqual(len(points), 100)
+        gaps = [point['x'] for point in points if point['y'] is None]
+        self.assertEqual(len(gaps), 32)
+        self.assertIn(times[9100].round(3), gaps)
+
+    def test_allocate_adds_up(self):
+        for lengths, total in (([1000, 10, 1], 100), ([7, 7, 7], 10), ([3, 4], 100), ([500], 1)):
+            shares = allocate(lengths, total)
+            self.assertEqual(shares.sum(), min(total, sum(lengths)))
+            self.assertTrue((shares <= lengths).all())
+
+
+class AngleStoreTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        # Blobs are kept in a process-wide MemoryStorage, so each test uses sessions of its own
+        self.settings = override_settings(LOCAL_POSES_DIR=self.directory.name, DATA_STORAGE_BACKEND='memory')
+        self.settings.enable()
+        self.sid = f"test-{uuid.uuid4()}"
+        # Clip 1 is closed, clip 2 is being recorded
+        Session.objects.create(id=self.sid, name='', date=datetime.now(), description='', clip_num=2)
+        self.keypoints = np.random.default_rng(6).normal(size=(40, 39, 5)).astype(np.float32)
+        PoseStore(self.sid, '1').append(np.arange(40, dtype=np.int64), self.keypoints)
+        self.expected = compute_angles(self.keypoints, list(JOINTS))
+
+    def tearDown(self):
+        self.settings.disable()
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        store = AngleStore(self.sid, '1', 'tag', MemoryStorage())
+        self.assertFalse(store.exists())
+        with self.assertRaises(ValueError):
+            store.get()
+
+        store.write(self.expected)
+        self.assertTrue(store.exists())
+        np.testing.assert_array_equal(store.get(), self.expected)
+
+        store.delete()
+        self.assertFalse(store.exists())
+        with self.assertRaises(ValueError):
+            store.get()
+
+    def test_angles_are_calculated_once_then_read_from_the_store(self):
+        with mock.patch('chart.Visualise.compute_angles', wraps=compute_angles) as compute:
+            np.testing.assert_array_equal(get_clip_angle_array(self.sid, '1'), self.expected)
+            self.assertEqual(compute.call_count, 1)
+            self.assertTrue(AngleStore(self.sid, '1', get_angles_tag(list(JOINTS))).exists())
+
+            # Stored angles are used without opening the pose data
+            with mock.patch('chart.Visualise.PoseStore.open') as open_poses:
+                angles = get_clip_angle_array(self.sid, '1', ['Elbow'])
+            open_poses.assert_not_called()
+            self.assertEqual(compute.call_count, 1)
+        np.testing.assert_array_equal(angles, self.expected[:, [list(JOINTS).index('Elbow')]])
+
+    def test_angles_of_an_open_clip_are_not_stored(self):
+        PoseStore(self.sid, '2').append(np.arange(20, dtype=np.int64), self.keypoints[:20])
+        np.testing.assert_array_equal(get_clip_angle_array(self.sid, '2'), self.expected[:, :, :20])
+        self.assertFalse(AngleStore(self.sid, '2', get_angles_tag(list(JOINTS))).exists())
+
+        # More pose data arrives, and the angles are stored once the clip is closed
+        PoseStore(self.sid, '2').append(np.arange(20, 40, dtype=np.int64), self.keypoints[20:])
+        sm.close_clip(self.sid, 2)
+        np.testing.assert_array_equal(get_clip_angle_array(self.sid, '2'), self.expected)
+        np.testing.assert_array_equal(AngleStore(self.sid, '2', get_angles_tag(list(JOINTS))).get(), self.expected)
+
+    def test_angles_view_windows_out_of_order_chunks(self):
+        PoseStore(self.sid, '2').append(np.arange(20, 40, dtype=np.int64), self.keypoints[20:])
+        PoseStore(self.sid, '2').append(np.arange(20, dtype=np.int64), self.keypoints[:20])
+        client = Client(HTTP_HOST='192.168.0.150')
+        result = client.get('/chart/angles/', {'sid': self.sid, 'clipNum': '2', 'joints': 'Elbow', 'start': '0.01', 'end': '0.02'})
+        self.assertEqual(result.status_code, 200)
+
+        # Frames from the last one before start to the first one after end, in the order they were captured
+        self.assertEqual(result.json()['frames'], 11)
+        series = next(iter(result.json()['angles']['Elbow'].values()))
+        np.testing.assert_allclose([point['x'] for point in series], np.arange(10, 21) / 1000)
+
+    def test_new_engine_version_ignores_old_angles(self):
+        tag = get_angles_tag(list(JOINTS))
+        with mock.patch('chart.Visualise.ENGINE_VERSION', ENGINE_VERSION + 1):
+            self.assertNotEqual(get_angles_tag(list(JOINTS)), tag)
+        # Changing which keypoints a joint uses changes the tag too
+        with mock.patch.dict(JOINTS, {'Elbow': JOINTS['Knee']}):
+            self.assertNotEqual(get_angles_tag(list(JOINTS)), tag)
+        self.assertEqual(get_angles_tag(list(JOINTS)), tag)
+
+        # Angles stored by the old version are left alone, and calculated again for the new one
+        AngleStore(self.sid, '1', tag).write(np.zeros_like(self.expected))
+        np.testing.assert_array_equal(get_clip_angle_array(self.sid, '1'), np.zeros_like(self.expected))
+        with mock.patch('chart.Visualise.ENGINE_VERSION', ENGINE_VERSION + 1):
+            np.testing.assert_array_equal(get_clip_angle_array(self.sid, '1'), self.expected)
+            self.assertTrue(AngleStore(self.sid, '1', get_angles_tag(list(JOINTS))).exists())
+
+    def test_backfill_angles(self):
+        # Clips 1 and 2 were uploaded, only clip 1 has pose data
+        Session.objects.filter(id=self.sid).update(clip_num=3)
+
+        def backfill(*args):
+            output = io.StringIO()
+            call_command('backfill_angles', '--sid', self.sid, *args, stdout=output)
+            return output.getvalue().splitlines()[-1]
+
+        self.assertEqual(backfill(), "stored angles for 1 clip(s), 0 already stored, 1 without pose data")
+        np.testing.assert_array_equal(AngleStore(self.sid, '1', get_angles_tag(list(JOINTS))).get(), self.expected)
+        self.assertEqual(backfill(), "stored angles for 0 clip(s), 1 already stored, 1 without pose data")
+        self.assertEqual(backfill('--force'), "stored angles for 1 clip(s), 0 already stored, 1 without pose data")
@@ -4,4 +4,6 @@ from django.urls import path
 urlpatterns = [
     path('', views.input_frame, name='input_frame'),
     path('result/', views.result, name='result'),
+    path('angles/', views.angles, name='angles'),
+    path('live/', views.live, name='live'),
 ]
\ No newline at end of file
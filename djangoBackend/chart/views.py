@@ -1,14 +1,26 @@
-import cv2
 import json
+import numpy as np
 from django.shortcuts import render
+from django.http import HttpResponse as response, JsonResponse
+from rest_framework import status
 from django.views.decorators.csrf import csrf_exempt
+from django.urls import reverse
+from django.conf import settings
+from django.utils.http import urlencode
+from data.models import Session, Clip
 from data.datastore.posestore import PoseStore
-from data.datastore.videostore import VideoStore
-from data.visualise import create_2D_visualisation
-from chart.Visualise import calculate_angles
+import data.datastore.sessionmeta as sm
+from data.visualise import get_2D_visualisation_video, pose_video_times
+from chart.Joints import JOINTS, findJoint
+from chart.LiveAngles import LiveAngles
+from chart.Visualise import get_clip_angle_array, format_points, name_series
 
 def input_frame(request):
-    return render(request, 'chart/input.html')
+    # Sessions with recently stored clips are suggested, from the clip catalog
+    recent = Clip.objects.filter(status=Clip.STORED).order_by('-created_at').values_list('session_id', flat=True)
+    sessions = list(dict.fromkeys(recent[:settings.CLIP_LIST_MAX_LIMIT]))
+    clips_url = json.dumps(reverse('data:list_clips'))
+    return render(request, 'chart/input.html', {'joints': list(JOINTS), 'sessions': sessions, 'clips_url': clips_url})
 
 @csrf_exempt
 def result(request):
@@ -19,6 +31,7 @@ def result(request):
         clip_num = request.POST.get('clipNum')
         joint = request.POST.get('joint')
         dimension = request.POST.get('dimension')
+        points = request.POST.get('points')
 
     # Use sample data on empty request
     if sid == None or clip_num == None or len(sid) == 0 or len(clip_num) == 0:
@@ -29,35 +42,146 @@ def result(request):
         joint = 'shoulder'
         dimension = '2d'
 
-    pose_store = PoseStore(sid, clip_num)
-    video_store = VideoStore(sid, clip_num)
     try:
-        poses = pose_store.get()
-        cap = cv2.VideoCapture(video_store.get())
+        poses = PoseStore.open(sid, clip_num)
     except ValueError as e:
         print(e)
-        return render(request, 'result.html', {'frames': None})
+        return render(request, 'result.html', {'video_url': None})
 
-    if not cap.isOpened():
-        print("Error: Could not open the video file.")
-        return render(request, 'result.html', {'frames': None})
-
-    if joint.lower() not in ['elbow', 'shoulder', 'hip', 'knee']:
+    if findJoint(joint) is None:
         print("Error: invalid joint.")
-        return render(request, 'result.html', {'frames': None})
+        return render(request, 'result.html', {'video_url': None})
     
     if dimension.lower() not in ['2d', '3d']:
         print("Error: invalid dimension.")
-        return render(request, 'result.html', {'frames': None})
+        return render(request, 'result.html', {'video_url': None})
+
+    try:
+        points = int(points) if points else settings.CHART_POINTS
+    except ValueError:
+        print("Error: invalid number of points.")
+        return render(request, 'result.html', {'video_url': None})
 
     # Format parameters
-    joint = joint.lower().capitalize()
+    joint = findJoint(joint)
     dimension = dimension.lower()
-    angleData = calculate_angles(joint, dimension, poses)
+
+    # Every joint is sent, so the page can switch between them without another request
+    # Series are downsampled to about as many points as the chart can show, the page asks for more when zoomed in
+    poseTimes = pose_video_times(poses)
+    angleData = format_points(poseTimes, get_clip_angle_array(sid, clip_num, poseData=poses), list(JOINTS), points, settings.CHART_PRECISION)
 
     joints = json.dumps(joint)
     dimensions = json.dumps(dimension)
     angles = json.dumps(angleData)
-    frames = json.dumps(create_2D_visualisation(poses, cap))
+    times = json.dumps(poseTimes.tolist())
+
+    # Render the video now, so that errors are shown on the page and the video request is a cache hit
+    try:
+        get_2D_visualisation_video(sid, clip_num)
+    except ValueError as e:
+        print(e)
+        return render(request, 'result.html', {'video_url': None})
+    video_url = f"{reverse('data:visualise_2D_video')}?{urlencode({'sid': sid, 'clipNum': clip_num})}"
+    angles_url = json.dumps(f"{reverse('angles')}?{urlencode({'sid': sid, 'clipNum': clip_num})}")
+
+    return render(request, 'result.html', {'video_url': video_url, 'times': times, 'angles': angles, 'joint': joints, 'joints': list(JOINTS), 'dimension': dimensions, 'angles_url': angles_url}, content_type='text/html')
+
+
+def angles(request):
+    '''
+    Return the angles of some (by default all) joints in a clip, as {x, y} points of the video time (in seconds)
+    and angle of each pose.
+
+    Series are downsampled (with Largest-Triangle-Three-Buckets) to at most points points if given, and angles
+    rounded to precision decimal places if given. start and end (in seconds) restrict the series to part of
+    the clip, e.g. the part of the chart that is zoomed in on, so it can be shown at full resolution.
+    '''
+    sid = request.GET.get('sid')
+    clip_num = request.GET.get('clipNum')
+    if not sid or not clip_num:
+        return response("expected sid and clipNum", status=status.HTTP_400_BAD_REQUEST)
+
+    joints = list(JOINTS)
+    if request.GET.get('joints'):
+        joints = [findJoint(joint) for joint in request.GET['joints'].split(',')]
+        if None in joints:
+            return response(f"joints must be some of {', '.join(JOINTS)}", status=status.HTTP_400_BAD_REQUEST)
+        joints = list(dict.fromkeys(joints))
+
+    try:
+        points = int(request.GET['points']) if request.GET.get('points') else None
+        precision = int(request.GET['precision']) if request.GET.get('precision') else None
+        start = float(request.GET['start']) if request.GET.get('start') else None
+        end = float(request.GET['end']) if request.GET.get('end') else None
+    except ValueError:
+        return response("points and precision must be integers, start and end numbers", status=status.HTTP_400_BAD_REQUEST)
+    if points is not None and points < 3:
+        return response("points must be at least 3", status=status.HTTP_400_BAD_REQUEST)
+    if precision is not None and not 0 <= precision <= 10:
+        return response("precision must be between 0 and 10", status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        poses = PoseStore.open(sid, clip_num)
+    except ValueError as e:
+        return response(str(e), status=status.HTTP_404_NOT_FOUND)
+
+    # Frames are read in the order they were captured (see PoseReader.in_capture_order), so times are
+    # sorted for searchsorted, and angles are calculated for the same frames
+    poses = poses.in_capture_order()
+    times = pose_video_times(poses)
+    angleData = get_clip_angle_array(sid, clip_num, joints, poses)
+
+    # Frames from the last one before start to the first one after end, so the series reach the edges of the range
+    first, last = 0, len(times)
+    if start is not None:
+        first = max(0, int(np.searchsorted(times, start, side='right')) - 1)
+    if end is not None:
+        last = min(len(times), int(np.searchsorted(times, end, side='left')) + 1)
+    last = max(first, last)
+
+    angleData = format_points(times[first:last], angleData[:, :, first:last], joints, points, precision)
+    return JsonResponse({
+        'frames': last - first,
+        'angles': {joint: name_series(series) for joint, series in angleData.items()},
+    })
+
+
+def live(request):
+    '''
+    Return the running statistics (min, max, range of motion, mean and latest value) of the joint angles
+    of a clip while it is being recorded, by default the session's current clip.
+
+    With since, also returns the angles received after that many frames, so a client polling for new
+    angles only receives each one once. Pass the returned frames as since in the next poll.
+    '''
+    sid = request.GET.get('sid')
+    if not sid:
+        return response("expected sid", status=status.HTTP_400_BAD_REQUEST)
+
+    clip_num = request.GET.get('clipNum')
+    since = request.GET.get('since')
+    try:
+        clip_num = int(clip_num) if clip_num else None
+        since = None if since is None else int(since)
+    except ValueError:
+        return response("clipNum and since must be integers", status=status.HTTP_400_BAD_REQUEST)
+
+    if clip_num is None:
+        try:
+            clip_num = sm.get_clip_num(sid)
+        except Session.DoesNotExist:
+            return response("session with this id does not exist", status=status.HTTP_404_NOT_FOUND)
 
-    return render(request, 'result.html', {'frames': frames, 'angles': angles, 'joint': joints, 'dimension': dimensions}, content_type='text/html')
+    live_angles = LiveAngles(sid, clip_num)
+    data = {'clipNum': clip_num, **live_angles.summary()}
+    if since is not None:
+        series = live_angles.series(since)
+        data['since'] = min(max(since, 0), data['frames'])
+        data['angles'] = {
+            joint: name_series([
+                [None if np.isnan(angle) else angle for angle in series[:, i, j].tolist()] for j in range(series.shape[2])
+            ])
+            for i, joint in enumerate(live_angles.joints)
+        }
+    return JsonResponse(data)
@@ -2,6 +2,8 @@
 ASGI config for connectedhealth project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+WebSocket connections for streaming pose data (see data/posestream.py) are handled
+alongside Django, which serves every HTTP request.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.1/howto/deployment/asgi/
@@ -13,4 +15,17 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'connectedhealth.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once Django is set up, as it uses the models
+from data.posestream import PATH as POSE_STREAM_PATH, pose_stream  # noqa: E402
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket':
+        if scope['path'] == POSE_STREAM_PATH:
+            return await pose_stream(scope, receive, send)
+        # No other WebSockets are served, closing before accepting rejects the handshake
+        await receive()
+        return await send({'type': 'websocket.close'})
+    return await django_application(scope, receive, send)
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 
 import os
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -86,6 +87,16 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Under ASGI every concurrent upload writes from its own thread, so wait longer than the default 5 s
+        # for SQLite's write lock rather than failing with "database is locked"
+        'OPTIONS': {
+            'timeout': 20,
+        },
+        # Tests use a file rather than SQLite's shared in-memory database, which fails with "database table
+        # is locked" instead of waiting when tests write from several threads at once
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
@@ -141,3 +152,61 @@ CORS_ORIGIN_ALLOW_ALL = True
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 DATA_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024 * 1024
+
+# Storage backend for clip data (see data/datastore/storage.py): 'azure', 'local' or 'memory'.
+# The local backend keeps data in files under DATA_STORAGE_ROOT.
+DATA_STORAGE_BACKEND = os.environ.get('DATA_STORAGE_BACKEND', 'azure')
+DATA_STORAGE_ROOT = BASE_DIR / 'storage'
+
+# Pose data of clips being recorded is kept in LOCAL_POSES_DIR until the clip is uploaded.
+LOCAL_POSES_DIR = BASE_DIR / 'data' / 'datastore' / 'sessions' / 'poses'
+
+# Local cache of clip data downloaded from storage (see data/datastore/cache.py): parsed pose
+# data is kept in memory, videos are kept in CLIP_CACHE_DIR.
+CLIP_CACHE_MEMORY_BYTES = 256 * 1024 * 1024
+CLIP_CACHE_DIR = Path(tempfile.gettempdir()) / 'connectedhealth-clip-cache'
+CLIP_CACHE_DISK_BYTES = 4 * 1024 * 1024 * 1024
+
+# Background clip uploads (see data/uploadqueue.py). Videos are spooled to UPLOAD_SPOOL_DIR,
+# failed uploads are retried after UPLOAD_RETRY_DELAY seconds, doubling each attempt.
+UPLOAD_SPOOL_DIR = BASE_DIR / 'spool'
+UPLOAD_WORKERS = 2
+UPLOAD_WORKERS_AUTOSTART = True
+UPLOAD_MAX_ATTEMPTS = 6
+UPLOAD_RETRY_DELAY = 5
+UPLOAD_POLL_INTERVAL = 5
+# A running job is taken for stale, and run again, if it isn't updated for UPLOAD_STALE_AFTER seconds,
+# so its worker marks it as updated every UPLOAD_HEARTBEAT_INTERVAL seconds while running it.
+UPLOAD_STALE_AFTER = 30 * 60
+UPLOAD_HEARTBEAT_INTERVAL = 60
+
+# Pool of MediaPipe pose estimators shared by each process (see data/posepool.py), used when
+# visualisations rerun pose estimation. Estimators are loaded when the pool is first used.
+POSE_POOL_SIZE = int(os.environ.get('POSE_POOL_SIZE', 2))
+POSE_POOL_MODEL_COMPLEXITY = 0
+POSE_POOL_SEGMENTATION = False
+
+# Visualisations are rendered in ranges of frames by a pool of VISUALISE_WORKERS processes
+# (see data/visualise.py). Clips shorter than two ranges of VISUALISE_MIN_RANGE_FRAMES frames
+# are rendered in the requesting process.
+VISUALISE_WORKERS = int(os.environ.get('VISUALISE_WORKERS', os.cpu_count() or 1))
+VISUALISE_MIN_RANGE_FRAMES = 30
+# Maximum number of frames in a window of frames rendered for the visualise page.
+VISUALISE_MAX_WINDOW_FRAMES = 120
+
+# The upload log (see data/datastore/uploadlog.py) keeps the latest UPLOAD_LOG_MAX_EVENTS events, and
+# the log page shows UPLOAD_LOG_PAGE_SIZE of them at a time.
+UPLOAD_LOG_MAX_EVENTS = 1000
+UPLOAD_LOG_PAGE_SIZE = 5
+
+# Maximum number of clips returned by one request to the clip listing (data/clips/).
+CLIP_LIST_MAX_LIMIT = 200
+
+# Joint angle charts are sent downsampled to about CHART_POINTS points per series, unless the page asks
+# for a different number, with angles rounded to CHART_PRECISION decimal places.
+CHART_POINTS = 1000
+CHART_PRECISION = 2
+
+# Pose chunks streamed over a WebSocket (see data/posestream.py) are acknowledged once stored, and a
+# client may only have POSE_STREAM_CREDIT unacknowledged chunks at a time.
+POSE_STREAM_CREDIT = 8
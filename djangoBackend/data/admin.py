@@ -1,6 +1,7 @@
 from django.contrib import admin
-from .models import User, Session, InvolvedIn
+from .models import User, Session, InvolvedIn, Clip
 
 admin.site.register(User)
 admin.site.register(Session)
 admin.site.register(InvolvedIn)
+admin.site.register(Clip)
@@ -6,3 +6,15 @@ KP_CONNS = [
     (11, 23), (24, 23), (24, 26), (23, 25), (26, 28), (25, 27), (28, 32), 
     (28, 30), (30, 32), (27, 29), (27, 31), (29, 31)
 ]
+
+# Width and height (in pixels) of the frames given to the pose estimation model by the mobile
+# application, i.e. the coordinate space of stored keypoint x and y values.
+MODEL_INPUT_SIZE = 256
+
+# Number of keypoints that are drawn in visualisations, i.e. the body landmarks, excluding the
+# auxiliary keypoints that follow them in the pose estimation model's output.
+NUM_DRAWN_KEYPOINTS = 33
+
+# Maximum difference (in milliseconds) between the time of a video frame and the timestamp of the
+# pose drawn over it. Frames with no pose within this time are drawn without a pose.
+MAX_POSE_OFFSET_MS = 100
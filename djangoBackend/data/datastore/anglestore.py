@@ -0,0 +1,81 @@
+import io
+import numpy as np
+import data.datastore.const as const
+from data.datastore.storage import BlobNotFound, Storage, get_storage
+from data.datastore.cache import get_clip_cache
+
+class AngleStore:
+    '''
+    Handle the storage and retrieval of the joint angles calculated from a clip's pose data.
+    Clips don't change once uploaded, so angles are calculated once and kept next to the pose data.
+    '''
+    def __init__(self, sid: str, clip_num: str, tag: str, storage: Storage = None) -> None:
+        '''
+        Args:
+            sid (str)           - the id of the session
+            clip_num (str)      - the clip number within this session
+            tag (str)           - identifies how the angles were calculated (e.g. the engine's
+                                  version and the joints included)
+            storage (Storage)   - where clip data is stored, the configured backend by default
+        '''
+        self.sid = sid
+        self.clip_num = clip_num
+        self.tag = tag
+        self.storage = storage or get_storage()
+
+
+    def get(self) -> np.ndarray:
+        '''
+        Return the angles for this clip, as stored by write. The array is kept in the clip cache,
+        so it is only downloaded again if the angles have changed (or it was evicted), and must not
+        be modified.
+
+        Raises:
+            ValueError: if the angles for this clip are not found.
+        '''
+        container, name = const.AZ_ANGLES_CONTAINER_NAME, self.get_name()
+        try:
+            etag = self.storage.etag(container, name)
+            return get_clip_cache().get_array(
+                f"{container}/{name}",
+                etag,
+                lambda: np.load(io.BytesIO(self.storage.read(container, name)), allow_pickle=False)
+            )
+        except BlobNotFound:
+            raise ValueError(
+                f"angles '{self.tag}' from clip with sid '{self.sid}' and clip number '{self.clip_num}' not found"
+            )
+
+
+    def write(self, angles: np.ndarray) -> None:
+        '''
+        Store the angles for this clip.
+        If there are already angles with the same tag, they are overwritten.
+
+        Args:
+            angles: array of angles, of any shape.
+        '''
+        data = io.BytesIO()
+        np.save(data, np.ascontiguousarray(angles), allow_pickle=False)
+        self.storage.write(const.AZ_ANGLES_CONTAINER_NAME, self.get_name(), data.getvalue())
+
+
+    def exists(self) -> bool:
+        '''
+        Return whether angles are stored for this clip, without downloading them.
+        '''
+        return self.storage.exists(const.AZ_ANGLES_CONTAINER_NAME, self.get_name())
+
+
+    def delete(self) -> None:
+        '''
+        Delete the angles for this clip from cloud storage.
+        '''
+        self.storage.delete(const.AZ_ANGLES_CONTAINER_NAME, self.get_name())
+
+
+    def get_name(self) -> str:
+        '''
+        Return the name that should be used to identify the angles for this clip.
+        '''
+        return f"{self.sid}_{self.clip_num}_{self.tag}.npy"
@@ -0,0 +1,241 @@
+'''
+Local cache of clip data downloaded from storage, so that reopening a clip does not download it again.
+
+There are two tiers, each bounded in size and evicting the least recently used entries first:
+    memory  - parsed pose data, as (timestamps, keypoints) arrays, and other arrays derived from clips.
+    disk    - files, e.g. videos, in settings.CLIP_CACHE_DIR.
+
+Entries are keyed by a name (e.g. the clip's blob name) and the ETag of the blob they were
+downloaded from, so a blob that is rewritten is downloaded again. Concurrent requests for the
+same missing entry wait for a single download, rather than each downloading it.
+'''
+
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from django.conf import settings
+
+# Prefix of files being created in the disk tier, which are removed if left behind.
+TMP_PREFIX = "tmp-"
+
+
+class _Tier:
+    '''
+    Size-bounded, least recently used map from keys to entries, with hit and miss counters.
+    '''
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.sizes = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.loading = {}
+
+
+    def get(self, key: tuple, load) -> object:
+        '''
+        Return the entry for a key, loading it with load() if it is not cached.
+
+        Args:
+            key: hashable key of the entry.
+            load: callable (with no arguments) returning (entry, size in bytes).
+        '''
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return self.entries[key]
+            self.misses += 1
+            key_lock = self.loading.setdefault(key, threading.Lock())
+
+        # Only one thread loads a given key, the others wait and then use its result
+        with key_lock:
+            with self.lock:
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    return self.entries[key]
+            try:
+                entry, size = load()
+                with self.lock:
+                    self._insert(key, entry, size)
+            finally:
+                with self.lock:
+                    self.loading.pop(key, None)
+        return entry
+
+
+    def _insert(self, key: tuple, entry: object, size: int) -> None:
+        '''
+        Add an entry, evicting least recently used entries to make room for it.
+        The new entry itself is never evicted here, even if it is larger than max_bytes.
+        '''
+        self.entries[key] = entry
+        self.sizes[key] = size
+        self.bytes += size
+        while self.bytes > self.max_bytes and len(self.entries) > 1:
+            old_key, old_entry = self.entries.popitem(last=False)
+            self.bytes -= self.sizes.pop(old_key)
+            self.evictions += 1
+            self.on_evict(old_entry)
+
+
+    def on_evict(self, entry: object) -> None:
+        '''
+        Release an entry once it has been evicted.
+        '''
+
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+
+class _DiskTier(_Tier):
+    '''
+    Tier whose entries are paths to files in a directory, which are deleted on eviction.
+    Files already in the directory (e.g. from before a restart) are indexed when it is created.
+    '''
+    def __init__(self, directory: str, max_bytes: int) -> None:
+        super().__init__(max_bytes)
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+        existing = []
+        for filename in os.listdir(directory):
+            path = os.path.join(directory, filename)
+            if filename.startswith(TMP_PREFIX):
+                os.remove(path)
+            elif os.path.isfile(path):
+                existing.append((os.path.getatime(path), filename, os.path.getsize(path)))
+        for _, filename, size in sorted(existing):
+            self._insert(filename, os.path.join(directory, filename), size)
+
+
+    def on_evict(self, path: str) -> None:
+        # Readers that already opened the file can keep reading it after it is removed
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class ClipCache:
+    '''
+    Two tier (memory and disk) cache of clip data, see module docstring.
+    '''
+    def __init__(self, memory_bytes: int, disk_directory: str, disk_bytes: int) -> None:
+        self.memory = _Tier(memory_bytes)
+        self.disk = _DiskTier(disk_directory, disk_bytes)
+
+
+    def get_poses(self, name: str, etag: str, load) -> tuple:
+        '''
+        Return the (timestamps, keypoints) arrays of a clip's pose data.
+
+        Args:
+            name: name of the clip's pose data, e.g. its blob name.
+            etag: ETag of the blob the pose data is loaded from.
+            load: callable (with no arguments) returning the (timestamps, keypoints) arrays, used on a miss.
+        '''
+        def load_entry():
+            timestamps, keypoints = load()
+            # Entries are shared between requests, so must not be modified
+            timestamps.flags.writeable = False
+            keypoints.flags.writeable = False
+            return (timestamps, keypoints), timestamps.nbytes + keypoints.nbytes
+        return self.memory.get((name, etag), load_entry)
+
+
+    def get_array(self, name: str, etag: str, load) -> object:
+        '''
+        Return an array of clip data, e.g. a clip's joint angles.
+
+        Args:
+            name: name of the array, e.g. its blob name.
+            etag: ETag of the blob the array is loaded from.
+            load: callable (with no arguments) returning the array, used on a miss.
+        '''
+        def load_entry():
+            array = load()
+            array.flags.writeable = False
+            return array, array.nbytes
+        return self.memory.get((name, etag), load_entry)
+
+
+    def get_file(self, name: str, etag: str, download) -> str:
+        '''
+        Return the path to a cached copy of a file, e.g. a clip's video.
+
+        Args:
+            name: name of the file, e.g. its blob name. Its extension is kept.
+            etag: ETag of the blob the file is downloaded from.
+            download: callable taking a writable (binary) file object, used to download the file on a miss.
+        '''
+        def create(path):
+            with open(path, "wb") as f:
+                download(f)
+        return self.get_created_file(name, etag, create)
+
+
+    def get_created_file(self, name: str, etag: str, create) -> str:
+        '''
+        Return the path to a cached file, creating it on a miss, e.g. for files generated from clip data.
+
+        Args:
+            name: name of the file. Its extension is kept.
+            etag: tag that changes whenever the file's contents would change.
+            create: callable taking a path, which writes the file to that path. The path has
+                the same extension as name.
+        '''
+        tag = hashlib.sha1(f"{name}\0{etag}".encode()).hexdigest()[:16]
+        filename = f"{tag}{os.path.splitext(name)[1]}"
+
+        def load_entry():
+            path = os.path.join(self.disk.directory, filename)
+            tmp_path = os.path.join(self.disk.directory, f"{TMP_PREFIX}{os.getpid()}-{threading.get_ident()}-{filename}")
+            try:
+                create(tmp_path)
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            return path, os.path.getsize(path)
+        return self.disk.get(filename, load_entry)
+
+
+    def stats(self) -> dict:
+        '''
+        Return hit, miss and eviction counters and the size of each tier.
+        '''
+        return {'memory': self.memory.stats(), 'disk': self.disk.stats()}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_clip_cache() -> ClipCache:
+    '''
+    Return the clip cache shared by the whole process, configured by the CLIP_CACHE_* settings.
+    '''
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ClipCache(
+                    settings.CLIP_CACHE_MEMORY_BYTES,
+                    str(settings.CLIP_CACHE_DIR),
+                    settings.CLIP_CACHE_DISK_BYTES
+                )
+    return _cache
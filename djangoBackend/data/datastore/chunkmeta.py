@@ -0,0 +1,107 @@
+'''Functionality related to storing chunks of pose data for a clip, and recording which have been received.'''
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Max
+from ..models import PoseChunk, Session
+from .posestore import PoseStore
+from chart.LiveAngles import LiveAngles
+
+
+class ClipClosed(Exception):
+    '''Raised when a chunk arrives for a clip that has already been closed (see sessionmeta.close_clip).'''
+    def __init__(self, sid: str, clip_num: int) -> None:
+        super().__init__(f"clip {clip_num} of session with sid '{sid}' is closed")
+        self.sid = sid
+        self.clip_num = clip_num
+
+
+def record_chunk(sid: str, clip_num: int, seq: int, num_frames: int, write) -> bool:
+    '''
+    Record that a chunk has been received and store it, unless it was received before.
+
+    The chunk is recorded and written in one transaction, so a chunk that fails to be
+    written is not recorded and can be retried.
+
+    A chunk is only stored while its clip is open, i.e. the session has not moved past it. The
+    clip is checked after the chunk's row is written, with the session's row locked, so the clip
+    can't be closed between the check and the write.
+
+    Args:
+        sid: the id of the session.
+        clip_num: the clip number within this session.
+        seq: the sequence number of this chunk within the clip.
+        num_frames: the number of frames in this chunk.
+        write: callable (with no arguments) that stores the chunk.
+
+    Returns:
+        True if the chunk was stored, False if it had already been received.
+
+    Raises:
+        ClipClosed: if the clip was closed before the chunk was received.
+        Session.DoesNotExist: if there is no session with this id.
+    '''
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                PoseChunk.objects.create(session_id=sid, clip_num=clip_num, seq=seq, num_frames=num_frames)
+        except IntegrityError:
+            return False
+        # On SQLite the insert above already holds the database's write lock, which keeps out the
+        # update closing the clip just as the row lock does elsewhere
+        current = Session.objects.select_for_update().values_list('clip_num', flat=True).get(id=sid)
+        if clip_num < current:
+            raise ClipClosed(sid, clip_num)
+        write()
+    return True
+
+
+def get_progress(sid: str, clip_num: int) -> dict:
+    '''
+    Return which chunks of a clip have been received.
+
+    Returns:
+        Dictionary with the sequence number the next new chunk should have ('next_seq'),
+        and the sequence numbers below it that have not been received ('missing').
+    '''
+    progress = PoseChunk.objects.filter(session_id=sid, clip_num=clip_num).aggregate(
+        received=Count('seq'), last=Max('seq')
+    )
+    next_seq = 0 if progress['last'] is None else progress['last'] + 1
+    missing = []
+    if progress['received'] < next_seq:
+        # Only look at individual chunks when there is a gap
+        received = set(
+            PoseChunk.objects.filter(session_id=sid, clip_num=clip_num).values_list('seq', flat=True)
+        )
+        missing = [seq for seq in range(next_seq) if seq not in received]
+    return {'next_seq': next_seq, 'missing': missing}
+
+
+def store_chunk(sid: str, clip_num: int, seq: int, timestamps, keypoints) -> bool:
+    '''
+    Store a sequence-numbered chunk of pose data for a clip, unless it was received before (see
+    record_chunk), and add it to the clip's live joint angles.
+
+    Returns:
+        True if the chunk was stored, False if it had already been received.
+
+    Raises:
+        ClipClosed: if the clip was closed before the chunk was received.
+        Session.DoesNotExist: if there is no session with this id.
+    '''
+    pose_store = PoseStore(sid, clip_num)
+    stored = record_chunk(sid, clip_num, seq, len(timestamps), lambda: pose_store.append(timestamps, keypoints))
+    if stored:
+        update_live_angles(sid, clip_num, timestamps, keypoints)
+    return stored
+
+
+def update_live_angles(sid: str, clip_num: int, timestamps, keypoints) -> None:
+    '''
+    Add newly stored pose data to a clip's live joint angles (see chart.LiveAngles).
+    The pose data is already stored, so a failure here is only reported, rather than failing the upload.
+    '''
+    try:
+        LiveAngles(sid, clip_num).update(timestamps, keypoints)
+    except Exception as e:
+        print(f"could not update live angles for clip with sid '{sid}' and clip number '{clip_num}': {e}")
@@ -1,11 +1,28 @@
 '''Helper functions relating to cloud storage.'''
 
+import threading
 import data.datastore.const as const
 from azure.storage.blob import BlobServiceClient
 
+_service_client = None
+_service_client_lock = threading.Lock()
+
+
+def get_service_client() -> BlobServiceClient:
+    '''
+    Return the blob service client shared by the whole process, creating it on first use.
+    Sharing one client means its connection pool (and TLS sessions) are reused between requests.
+    '''
+    global _service_client
+    if _service_client is None:
+        with _service_client_lock:
+            if _service_client is None:
+                _service_client = BlobServiceClient.from_connection_string(const.AZ_CON_STR)
+    return _service_client
+
+
 def get_blob_client(container_name: str, blob_name: str):
     '''
     Return a blob client for a given container name and blob name.
     '''
-    blob_service_client = BlobServiceClient.from_connection_string(const.AZ_CON_STR)
-    return blob_service_client.get_blob_client(container_name, blob_name)
+    return get_service_client().get_blob_client(container_name, blob_name)
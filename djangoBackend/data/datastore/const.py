@@ -4,6 +4,8 @@ AZ_ACCOUNT_KEY = "wq4q+wFN99NgDz0kkYdbTAArr5zrJH0x2yG9EFKgO13QYFlqrlX/9JvQRrKCEF
 AZ_CON_STR = f"DefaultEndpointsProtocol=https;AccountName={AZ_ACCOUNT_NAME};AccountKey={AZ_ACCOUNT_KEY};EndpointSuffix=core.windows.net"
 AZ_POSES_CONTAINER_NAME = "poses"
 AZ_VIDEOS_CONTAINER_NAME = "videos"
+AZ_OVERLAYS_CONTAINER_NAME = "overlays"
+AZ_ANGLES_CONTAINER_NAME = "angles"
 
 # The number of keypoints captured by the pose estimation model.
 NUM_KEYPOINTS = 39
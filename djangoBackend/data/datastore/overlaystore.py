@@ -0,0 +1,70 @@
+import data.datastore.const as const
+from data.datastore.storage import BlobNotFound, Storage, get_storage
+from data.datastore.cache import get_clip_cache
+
+class OverlayStore:
+    '''
+    Handle the storage and retrieval of overlays for a clip, i.e. videos of the clip overlayed
+    with its pose data, which are rendered once the clip has been uploaded.
+    '''
+    def __init__(self, sid: str, clip_num: str, tag: str, storage: Storage = None) -> None:
+        '''
+        Args:
+            sid (str)           - the id of the session
+            clip_num (str)      - the clip number within this session
+            tag (str)           - identifies how the overlay was rendered (e.g. the renderer's
+                                  mode and settings) and ends with its file extension
+            storage (Storage)   - where clip data is stored, the configured backend by default
+        '''
+        self.sid = sid
+        self.clip_num = clip_num
+        self.tag = tag
+        self.storage = storage or get_storage()
+
+
+    def get(self) -> str:
+        '''
+        Load the overlay for this clip into a file and return the path to this file.
+        The file is kept in the clip cache, so it is only downloaded again if the overlay
+        has changed (or it was evicted).
+
+        Raises:
+            ValueError: if the overlay for this clip is not found.
+        '''
+        container, name = const.AZ_OVERLAYS_CONTAINER_NAME, self.get_name()
+        try:
+            etag = self.storage.etag(container, name)
+            return get_clip_cache().get_file(
+                f"{container}/{name}",
+                etag,
+                lambda f: self.storage.read_into(container, name, f)
+            )
+        except BlobNotFound:
+            raise ValueError(
+                f"overlay '{self.tag}' from clip with sid '{self.sid}' and clip number '{self.clip_num}' not found"
+            )
+
+
+    def write(self, overlay: bytes) -> None:
+        '''
+        Store the overlay for this clip.
+        If there is already an overlay with the same tag, it is overwritten.
+
+        Args:
+            overlay: the overlay video, as bytes or a readable (binary) file object.
+        '''
+        self.storage.write(const.AZ_OVERLAYS_CONTAINER_NAME, self.get_name(), overlay)
+
+
+    def delete(self) -> None:
+        '''
+        Delete the overlay for this clip from cloud storage.
+        '''
+        self.storage.delete(const.AZ_OVERLAYS_CONTAINER_NAME, self.get_name())
+
+
+    def get_name(self) -> str:
+        '''
+        Return the name that should be used to identify the overlay for this clip.
+        '''
+        return f"{self.sid}_{self.clip_num}_{self.tag}"
@@ -0,0 +1,261 @@
+'''
+Binary, columnar storage format for the pose data of a clip.
+
+Locally, a clip is kept as two append-only columns:
+    <name>.kp   - packed little-endian float32 keypoint values, shape (frames, 39, 5)
+    <name>.ts   - packed little-endian int64 timestamps (ms since epoch), shape (frames,)
+
+In cloud storage, a clip is a single blob made of a fixed size header followed by the
+timestamp column and then the keypoint block, so it can be read back without parsing.
+
+Appends to a clip's columns are serialised by a lock on its keypoints column. A frame counts once
+both of its columns hold it, and a partial frame left by an append that was cut short is dropped
+by the next append.
+
+The values of each keypoint are stored in the order they are received from the pose
+estimation model: x, y, z, visibility, presence.
+'''
+
+import os
+import fcntl
+import struct
+import numpy as np
+import data.datastore.const as const
+
+KEYPOINTS_EXT = ".kp"
+TIMESTAMPS_EXT = ".ts"
+BLOB_EXT = ".poses"
+
+KEYPOINT_DTYPE = np.dtype('<f4')
+TIMESTAMP_DTYPE = np.dtype('<i8')
+FRAME_SHAPE = (const.NUM_KEYPOINTS, const.VALS_PER_KEYPOINT)
+FRAME_NBYTES = const.NUM_KEYPOINTS * const.VALS_PER_KEYPOINT * KEYPOINT_DTYPE.itemsize
+
+# Timestamp stored for frames that were received without one.
+MISSING_TIMESTAMP = -1
+
+# Blob header: magic, version, keypoints per frame, values per keypoint, frame count.
+MAGIC = b'CHPS'
+VERSION = 1
+HEADER = struct.Struct('<4sHHH6xQ')
+
+
+def empty() -> tuple:
+    '''
+    Return an empty (timestamps, keypoints) pair.
+    '''
+    return np.empty(0, TIMESTAMP_DTYPE), np.empty((0,) + FRAME_SHAPE, KEYPOINT_DTYPE)
+
+
+def append(kp_path: str, ts_path: str, timestamps: np.ndarray, keypoints: np.ndarray) -> None:
+    '''
+    Append frames to the end of the local columns of a clip, never rewriting existing data.
+
+    Args:
+        kp_path: path to the keypoints column.
+        ts_path: path to the timestamps column.
+        timestamps: array of shape (frames,).
+        keypoints: array of shape (frames, 39, 5).
+
+    Raises:
+        ValueError: if the arrays do not describe the same number of frames.
+    '''
+    timestamps = np.ascontiguousarray(timestamps, dtype=TIMESTAMP_DTYPE)
+    keypoints = np.ascontiguousarray(keypoints, dtype=KEYPOINT_DTYPE)
+    if keypoints.shape[1:] != FRAME_SHAPE or len(keypoints) != len(timestamps):
+        raise ValueError(f"expected {len(timestamps)} frames of shape {FRAME_SHAPE}, got {keypoints.shape}")
+
+    with open(kp_path, "ab") as kp, open(ts_path, "ab") as ts:
+        # Appenders of the same clip, in any process, take turns, so their frames never interleave.
+        fcntl.flock(kp, fcntl.LOCK_EX)
+        try:
+            # Drop any partial frame left by an append that was cut short, so that later frames stay
+            # paired with their own timestamps.
+            n = _whole_frames(os.fstat(kp.fileno()).st_size, os.fstat(ts.fileno()).st_size)
+            _truncate(kp, ts, n)
+            try:
+                kp.write(keypoints.tobytes())
+                kp.flush()
+                ts.write(timestamps.tobytes())
+                ts.flush()
+            except BaseException:
+                _truncate(kp, ts, n)
+                raise
+        finally:
+            fcntl.flock(kp, fcntl.LOCK_UN)
+
+
+def _whole_frames(kp_size: int, ts_size: int) -> int:
+    '''
+    Return the number of complete frames in columns of the given sizes, in bytes.
+    '''
+    return min(kp_size // FRAME_NBYTES, ts_size // TIMESTAMP_DTYPE.itemsize)
+
+
+def _truncate(kp, ts, n: int) -> None:
+    '''
+    Truncate open columns to their first n frames.
+    '''
+    kp.truncate(n * FRAME_NBYTES)
+    ts.truncate(n * TIMESTAMP_DTYPE.itemsize)
+
+
+def num_frames(kp_path: str, ts_path: str) -> int:
+    '''
+    Return the number of complete frames held in the local columns of a clip.
+    '''
+    if not os.path.exists(kp_path) or not os.path.exists(ts_path):
+        return 0
+    return _whole_frames(os.path.getsize(kp_path), os.path.getsize(ts_path))
+
+
+def read(kp_path: str, ts_path: str) -> tuple:
+    '''
+    Read the local columns of a clip into memory.
+
+    Returns:
+        (timestamps, keypoints) arrays, of shape (frames,) and (frames, 39, 5).
+    '''
+    n = num_frames(kp_path, ts_path)
+    if n == 0:
+        return empty()
+    timestamps = np.fromfile(ts_path, dtype=TIMESTAMP_DTYPE, count=n)
+    keypoints = np.fromfile(kp_path, dtype=KEYPOINT_DTYPE, count=n * FRAME_NBYTES // KEYPOINT_DTYPE.itemsize)
+    return timestamps, keypoints.reshape((n,) + FRAME_SHAPE)
+
+
+def pack(timestamps: np.ndarray, keypoints: np.ndarray) -> bytes:
+    '''
+    Pack the pose data of a clip into a single blob.
+    '''
+    timestamps = np.ascontiguousarray(timestamps, dtype=TIMESTAMP_DTYPE)
+    keypoints = np.ascontiguousarray(keypoints, dtype=KEYPOINT_DTYPE)
+    header = HEADER.pack(MAGIC, VERSION, const.NUM_KEYPOINTS, const.VALS_PER_KEYPOINT, len(timestamps))
+    return header + timestamps.tobytes() + keypoints.tobytes()
+
+
+def read_header(buffer, size: int = None) -> int:
+    '''
+    Validate the header of a packed blob and return the number of frames it holds.
+
+    Args:
+        buffer: the blob, or at least its first HEADER.size bytes.
+        size: the size of the whole blob in bytes, if buffer only holds the start of it.
+
+    Raises:
+        ValueError: if the buffer is not a packed pose blob this version can read.
+    '''
+    size = len(buffer) if size is None else size
+    if len(buffer) < HEADER.size:
+        raise ValueError("pose blob is too short to contain a header")
+    magic, version, num_keypoints, vals_per_keypoint, n = HEADER.unpack_from(buffer)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("not a pose blob, or unsupported pose blob version")
+    if (num_keypoints, vals_per_keypoint) != FRAME_SHAPE:
+        raise ValueError(f"pose blob has frames of shape {(num_keypoints, vals_per_keypoint)}, expected {FRAME_SHAPE}")
+    if size < HEADER.size + n * (TIMESTAMP_DTYPE.itemsize + FRAME_NBYTES):
+        raise ValueError("pose blob is truncated")
+    return n
+
+
+def unpack(buffer) -> tuple:
+    '''
+    Unpack a blob produced by pack(). The returned arrays are views onto the buffer.
+
+    Returns:
+        (timestamps, keypoints) arrays, of shape (frames,) and (frames, 39, 5).
+    '''
+    n = read_header(buffer)
+    timestamps = np.frombuffer(buffer, dtype=TIMESTAMP_DTYPE, count=n, offset=HEADER.size)
+    keypoints = np.frombuffer(
+        buffer,
+        dtype=KEYPOINT_DTYPE,
+        count=n * FRAME_NBYTES // KEYPOINT_DTYPE.itemsize,
+        offset=HEADER.size + timestamps.nbytes
+    )
+    return timestamps, keypoints.reshape((n,) + FRAME_SHAPE)
+
+
+def to_dicts(timestamps: np.ndarray, keypoints: np.ndarray, indexes: list = None) -> list:
+    '''
+    Convert pose data to the (legacy) JSON structure, a list of
+    {'timestamp': ..., 'keypoints': [{'name': ..., 'x': ..., ...}, ...]} dictionaries.
+
+    Args:
+        timestamps: array of shape (frames,).
+        keypoints: array of shape (frames, 39, 5).
+        indexes: indexes of the keypoints to include, all keypoints are included if not given.
+    '''
+    if indexes is None:
+        indexes = range(const.NUM_KEYPOINTS)
+    else:
+        keypoints = keypoints[:, indexes]
+    names = [const.KEYPOINT_MAPPINGS[i] for i in indexes]
+    poses = []
+    for timestamp, frame in zip(timestamps.tolist(), keypoints.tolist()):
+        poses.append({
+            'timestamp': None if timestamp == MISSING_TIMESTAMP else timestamp,
+            'keypoints': [
+                {'name': name, 'x': x, 'y': y, 'z': z, 'visibility': visibility, 'presence': presence}
+                for name, (x, y, z, visibility, presence) in zip(names, frame)
+            ]
+        })
+    return poses
+
+
+def from_dicts(poses: list) -> tuple:
+    '''
+    Convert pose data from the (legacy) JSON structure produced by to_dicts().
+
+    Returns:
+        (timestamps, keypoints) arrays, of shape (frames,) and (frames, 39, 5).
+    '''
+    if not poses:
+        return empty()
+    timestamps = np.array(
+        [MISSING_TIMESTAMP if p.get('timestamp') is None else p['timestamp'] for p in poses],
+        dtype=TIMESTAMP_DTYPE
+    )
+    keypoints = np.array(
+        [[(kp['x'], kp['y'], kp['z'], kp['visibility'], kp['presence']) for kp in p['keypoints']] for p in poses],
+        dtype=KEYPOINT_DTYPE
+    )
+    return timestamps, keypoints
+
+
+def map_columns(kp_path: str, ts_path: str) -> tuple:
+    '''
+    Memory-map the local columns of a clip (read only), without reading them into memory.
+
+    Returns:
+        (timestamps, keypoints) arrays, of shape (frames,) and (frames, 39, 5).
+    '''
+    n = num_frames(kp_path, ts_path)
+    if n == 0:
+        return empty()
+    timestamps = np.memmap(ts_path, dtype=TIMESTAMP_DTYPE, mode='r', shape=(n,))
+    keypoints = np.memmap(kp_path, dtype=KEYPOINT_DTYPE, mode='r', shape=(n,) + FRAME_SHAPE)
+    return timestamps, keypoints
+
+
+def map_blob(path: str) -> tuple:
+    '''
+    Memory-map a file containing a blob produced by pack() (read only), without reading
+    it into memory.
+
+    Returns:
+        (timestamps, keypoints) arrays, of shape (frames,) and (frames, 39, 5).
+    '''
+    with open(path, "rb") as f:
+        n = read_header(f.read(HEADER.size), os.path.getsize(path))
+    if n == 0:
+        return empty()
+    timestamps = np.memmap(path, dtype=TIMESTAMP_DTYPE, mode='r', offset=HEADER.size, shape=(n,))
+    keypoints = np.memmap(
+        path,
+        dtype=KEYPOINT_DTYPE,
+        mode='r',
+        offset=HEADER.size + n * TIMESTAMP_DTYPE.itemsize,
+        shape=(n,) + FRAME_SHAPE
+    )
+    return timestamps, keypoints
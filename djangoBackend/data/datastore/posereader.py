@@ -0,0 +1,101 @@
+import numpy as np
+import data.datastore.const as const
+import data.datastore.poseformat as poseformat
+
+# Mappings from joint names to indexes in the data returned from the pose estimation model.
+KEYPOINT_INDEXES = {name: index for index, name in const.KEYPOINT_MAPPINGS.items()}
+
+
+class PoseReader:
+    '''
+    Read only access to (a range of frames of) the pose data for a clip.
+
+    Frame ranges are views onto the underlying arrays, which are usually memory-mapped
+    files, so only the frames and keypoints that are actually used get read from disk.
+    '''
+    def __init__(self, timestamps: np.ndarray, keypoints: np.ndarray) -> None:
+        '''
+        Args:
+            timestamps: array of shape (frames,).
+            keypoints: array of shape (frames, 39, 5).
+        '''
+        self._timestamps = timestamps
+        self._keypoints = keypoints
+
+
+    def __len__(self) -> int:
+        return len(self._timestamps)
+
+
+    def frames(self, start: int = None, stop: int = None) -> 'PoseReader':
+        '''
+        Return a reader over frames [start, stop) of this reader, without copying any data.
+        Negative and out of range indexes behave as they do for list slices.
+        '''
+        return PoseReader(self._timestamps[start:stop], self._keypoints[start:stop])
+
+
+    def in_capture_order(self) -> 'PoseReader':
+        '''
+        Return a reader over the frames of this reader in the order they were captured, i.e. sorted by
+        timestamp, as chunks of a clip may be received out of order. Frames without a timestamp are
+        kept after the frame received before them.
+
+        This reader is returned if its frames are already in order, so no data is copied, as for clips
+        read from storage. Otherwise the frames are copied.
+        '''
+        missing = self._timestamps == poseformat.MISSING_TIMESTAMP
+        # Each frame without a timestamp is sorted by the timestamp of the last frame before it that has one
+        last_valid = np.maximum.accumulate(np.where(missing, 0, np.arange(len(self))))
+        order_by = self._timestamps[last_valid]
+        if not np.any(order_by[1:] < order_by[:-1]):
+            return self
+        order = np.argsort(order_by, kind='stable')
+        return PoseReader(self._timestamps[order], self._keypoints[order])
+
+
+    def timestamps(self) -> np.ndarray:
+        '''
+        Return the timestamps of the frames in this reader, as an array of shape (frames,).
+        '''
+        return self._timestamps
+
+
+    def keypoints(self, keypoints: list = None) -> np.ndarray:
+        '''
+        Return keypoint values for the frames in this reader, as an array of shape
+        (frames, keypoints, 5), with values in the order x, y, z, visibility, presence.
+
+        Args:
+            keypoints: the keypoints to include, as names (e.g. 'left_elbow') or indexes.
+                All keypoints are included if not given, in which case no data is copied.
+                Otherwise, only the selected keypoints are copied.
+
+        Raises:
+            KeyError: if a keypoint name is not recognised.
+        '''
+        if keypoints is None:
+            return self._keypoints
+        return self._keypoints[:, PoseReader.keypoint_indexes(keypoints)]
+
+
+    def to_dicts(self, keypoints: list = None) -> list:
+        '''
+        Return the frames in this reader in the JSON structure produced by PoseStore.format_poses.
+
+        Args:
+            keypoints: the keypoints to include, as for keypoints(). All keypoints are included if not given.
+        '''
+        indexes = None if keypoints is None else PoseReader.keypoint_indexes(keypoints)
+        return poseformat.to_dicts(self._timestamps, self._keypoints, indexes)
+
+
+    @staticmethod
+    def keypoint_indexes(keypoints: list) -> list:
+        '''
+        Return the indexes of keypoints given as names or indexes.
+
+        Raises:
+            KeyError: if a keypoint name is not recognised.
+        '''
+        return [KEYPOINT_INDEXES[kp] if isinstance(kp, str) else int(kp) for kp in keypoints]
@@ -1,72 +1,135 @@
 import os
 import json
+import numpy as np
+from itertools import chain
+from operator import itemgetter
+from django.conf import settings
 import data.datastore.const as const
-from data.datastore.cloud import get_blob_client
-from data.datastore.util import get_keypoint_value_keys
+import data.datastore.poseformat as poseformat
+from data.datastore.posereader import PoseReader
+from data.datastore.storage import BlobNotFound, Storage, get_storage
+from data.datastore.cache import get_clip_cache
+from data.datastore.util import get_pose_value_keys
+
+# Keys of the values in a pose from the pose estimation model, in the order they are stored.
+POSE_VALUE_KEYS = get_pose_value_keys()
+_get_pose_values = itemgetter(*POSE_VALUE_KEYS)
 
 class PoseStore:
     '''
     Handle the storage and retrieval of pose data for a clip.  
     '''
-    def __init__(self, sid: str, clip_num: str) -> None:
+    def __init__(self, sid: str, clip_num: str, storage: Storage = None) -> None:
         '''
         Args:
-            sid (str)       - the id of the session
-            clip_num (str)  - the clip number within this session
+            sid (str)           - the id of the session
+            clip_num (str)      - the clip number within this session
+            storage (Storage)   - where clip data is stored, the configured backend by default
         '''
         self.sid = sid
         self.clip_num = clip_num
+        self.storage = storage or get_storage()
 
 
     def get(self) -> list:
         '''
-        Return the pose data for this clip.
+        Return the pose data for this clip, in the JSON structure produced by format_poses.
 
         Raises:
             ValueError: if pose data for this clip is not found.
         '''
-        blob_client = get_blob_client(const.AZ_POSES_CONTAINER_NAME, self.get_name())
-        if blob_client.exists():
-            pose_data_string = blob_client.download_blob().content_as_text()
-            return json.loads(pose_data_string)
+        return poseformat.to_dicts(*self.get_array())
+
+
+    def get_array(self) -> tuple:
+        '''
+        Return the pose data for this clip as (timestamps, keypoints) arrays, of shape
+        (frames,) and (frames, 39, 5).
+
+        Clips stored before the binary format was introduced are read from their JSON blob.
+
+        Raises:
+            ValueError: if pose data for this clip is not found.
+        '''
+        try:
+            return poseformat.unpack(self.storage.read(const.AZ_POSES_CONTAINER_NAME, self.get_blob_name()))
+        except BlobNotFound:
+            pass
+
+        try:
+            pose_data = self.storage.read(const.AZ_POSES_CONTAINER_NAME, self.get_name())
+        except BlobNotFound:
+            raise ValueError(
+                f"poses from clip with sid '{self.sid}' and clip number '{self.clip_num}' not found"
+            )
+        return poseformat.from_dicts(json.loads(pose_data))
+
+
+    @staticmethod
+    def open(sid: str, clip_num: str) -> PoseReader:
+        '''
+        Return a reader over the pose data for a clip, see PoseStore.reader.
+        '''
+        return PoseStore(sid, clip_num).reader()
+
+
+    def reader(self) -> PoseReader:
+        '''
+        Return a reader over the pose data for this clip, in the order it was captured (see
+        PoseReader.in_capture_order).
+
+        The local copy of the clip is used, memory-mapped, if there is one. Otherwise the clip
+        is loaded from storage through the clip cache, so it is only downloaded again if its
+        blob has changed (or it was evicted).
+
+        Raises:
+            ValueError: if pose data for this clip is not found.
+        '''
+        kp_path = self.get_path(poseformat.KEYPOINTS_EXT)
+        ts_path = self.get_path(poseformat.TIMESTAMPS_EXT)
+        if os.path.exists(kp_path) and os.path.exists(ts_path):
+            return PoseReader(*poseformat.map_columns(kp_path, ts_path)).in_capture_order()
+
+        for name in (self.get_blob_name(), self.get_name()):
+            try:
+                etag = self.storage.etag(const.AZ_POSES_CONTAINER_NAME, name)
+            except BlobNotFound:
+                continue
+            key = f"{const.AZ_POSES_CONTAINER_NAME}/{name}"
+            return PoseReader(*get_clip_cache().get_poses(key, etag, self.get_array)).in_capture_order()
         raise ValueError(
             f"poses from clip with sid '{self.sid}' and clip number '{self.clip_num}' not found"
         )
 
 
-    def write_to_cloud(self) -> None:
+    def write_to_cloud(self) -> int:
         '''
         Write pose data for a this clip to cloud storage and delete local copy.
+
+        Returns:
+            The size of the blob written, in bytes, or 0 if there are no local poses to write.
         '''
-        file_path = self.get_path()
-        if not os.path.exists(file_path):
+        kp_path = self.get_path(poseformat.KEYPOINTS_EXT)
+        ts_path = self.get_path(poseformat.TIMESTAMPS_EXT)
+        if not os.path.exists(kp_path):
             print(f"can't write poses to cloud for clip with sid '{self.sid}' and clip number '{self.clip_num}', no local poses")
-            return
-
-        with open(file_path, "r") as f:
-            pose_data = json.load(f)
-            blob_client = get_blob_client(const.AZ_POSES_CONTAINER_NAME, self.get_name())
-            if blob_client.exists():
-                # Shouldn't be reached, but handle this case just to be safe
-                downloaded_bytes = blob_client.download_blob().readall()
-                existing_data = json.loads(downloaded_bytes)
-                existing_data.update(pose_data)
-                updated_clip_data_bytes = json.dumps(existing_data).encode('utf-8')
-
-                # Upload the updated clip data (overwrite with updated information)
-                blob_client.upload_blob(updated_clip_data_bytes, overwrite=True)
-            else:
-                # Upload the clip data as a new blob
-                pose_data_bytes = json.dumps(pose_data).encode('utf-8')
-                blob_client.upload_blob(pose_data_bytes)
+            return 0
+
+        # Chunks may have arrived out of order, put frames back in the order they were captured.
+        poses = PoseReader(*poseformat.read(kp_path, ts_path)).in_capture_order()
+        blob = poseformat.pack(poses.timestamps(), poses.keypoints())
+        self.storage.write(const.AZ_POSES_CONTAINER_NAME, self.get_blob_name(), blob)
 
         # NOTE -> commented out for validation
-        # os.remove(file_path)
+        # os.remove(kp_path)
+        # os.remove(ts_path)
+        return len(blob)
 
 
     def write_locally(self, poses: list) -> None:
         '''
-        Write poses to locally (to file in file system).
+        Append poses to the local (file system) copy of this clip.
+        Existing frames are never read or rewritten, so each call costs O(len(poses)).
 
         Args:
             poses: a list of poses as received from the pose estimation model.
@@ -77,18 +140,62 @@ class PoseStore:
         if not isinstance(poses, list):
             raise TypeError('poses must be of type list')
 
-        poses = PoseStore.format_poses(poses)
-        file_path = self.get_path()
+        self.append(*PoseStore.format_poses_array(poses))
+
+
+    def append(self, timestamps: np.ndarray, keypoints: np.ndarray) -> None:
+        '''
+        Append poses, already in the array form produced by format_poses_array, to the local
+        (file system) copy of this clip.
+
+        Args:
+            timestamps: array of shape (frames,).
+            keypoints: array of shape (frames, 39, 5).
+        '''
+        poseformat.append(
+            self.get_path(poseformat.KEYPOINTS_EXT),
+            self.get_path(poseformat.TIMESTAMPS_EXT),
+            timestamps,
+            keypoints
+        )
 
-        if os.path.exists(file_path):
-            with open(file_path, "r") as f:
-                existing_data = json.load(f)
-        else:
-            existing_data = []
-        existing_data += poses
 
-        with open(file_path, "w") as f:
-            json.dump(existing_data, f, indent=4)
+    def read_locally(self) -> tuple:
+        '''
+        Return the local copy of the pose data for this clip as (timestamps, keypoints) arrays.
+        '''
+        return poseformat.read(self.get_path(poseformat.KEYPOINTS_EXT), self.get_path(poseformat.TIMESTAMPS_EXT))
+
+
+    def export_json(self) -> str:
+        '''
+        Export the local copy of the pose data for this clip to a JSON file in the
+        structure produced by format_poses, and return the path to this file.
+        '''
+        json_path = self.get_path(".json")
+        with open(json_path, "w") as f:
+            json.dump(poseformat.to_dicts(*self.read_locally()), f, indent=4)
+        return json_path
+
+
+    def convert_json(self) -> bool:
+        '''
+        Convert a local JSON copy of the pose data for this clip to the binary format.
+        The JSON file is left in place.
+
+        Returns:
+            True if the clip was converted, False if it has no JSON copy or was already converted.
+        '''
+        json_path = self.get_path(".json")
+        kp_path = self.get_path(poseformat.KEYPOINTS_EXT)
+        ts_path = self.get_path(poseformat.TIMESTAMPS_EXT)
+        if not os.path.exists(json_path) or os.path.exists(kp_path) or os.path.exists(ts_path):
+            return False
+
+        with open(json_path, "r") as f:
+            timestamps, keypoints = poseformat.from_dicts(json.load(f))
+        poseformat.append(kp_path, ts_path, timestamps, keypoints)
+        return True
 
 
     @staticmethod
@@ -96,51 +203,61 @@ class PoseStore:
         '''
         Reformat pose data structure and return it.
 
+        Only needed when the JSON structure is wanted, poses are stored using format_poses_array.
+
         Args:
             poses: a list of poses as received from the pose estimation model.
 
         Returns:
             List containing formatted pose data.
         '''
-        formatted_poses = []
-        for pose in poses:
-            timestamp = pose.get('timestamp')
-            keypoints = []
-            for i in range(const.NUM_KEYPOINTS):
-                keypoint_index = i * const.VALS_PER_KEYPOINT
-                new_keypoint = PoseStore.__create_formatted_keypoint(pose, keypoint_index)
-                keypoints.append(new_keypoint)
-            formatted_poses.append({'timestamp': timestamp, 'keypoints': keypoints})
-        return formatted_poses
+        return poseformat.to_dicts(*PoseStore.format_poses_array(poses))
 
 
     @staticmethod
-    def __create_formatted_keypoint(pose: dict, keypoint_index: int) -> dict:
+    def format_poses_array(poses: list) -> tuple:
         '''
-        Format keypoint data in a more readable way.
+        Convert poses to arrays, in the binary format used to store them.
+
+        All values are gathered in a single pass with itemgetter and np.fromiter, rather than
+        building a dictionary for each keypoint.
 
         Args:
-            pose: dictionary representing a single pose, from pose estimation model
-            keypoint_index: index of this keypoint in the pose dictionary
+            poses: a list of poses as received from the pose estimation model.
 
         Returns:
-            Dictionary with newly formatted keypoint data.
+            (timestamps, keypoints) arrays, of shape (frames,) and (frames, 39, 5).
+
+        Raises:
+            ValueError: if poses is not a list of poses, or a timestamp or keypoint value is not a number.
         '''
-        xi, yi, zi, visi, presi = get_keypoint_value_keys(keypoint_index)
-        x = pose.get(xi)
-        y = pose.get(yi)
-        z = pose.get(zi)
-        visibility = pose.get(visi)
-        presence = pose.get(presi)
+        if not poses:
+            return poseformat.empty()
+        if not isinstance(poses, list) or not all(isinstance(p, dict) for p in poses):
+            raise ValueError("expected poses to be a list of objects")
 
-        return {
-            'name': const.KEYPOINT_MAPPINGS.get(keypoint_index / const.VALS_PER_KEYPOINT),
-            'x': x,
-            'y': y,
-            'z': z,
-            'visibility': visibility,
-            'presence': presence
-        }
+        n = len(poses)
+        try:
+            timestamps = np.fromiter(
+                (poseformat.MISSING_TIMESTAMP if p.get('timestamp') is None else p['timestamp'] for p in poses),
+                dtype=poseformat.TIMESTAMP_DTYPE,
+                count=n
+            )
+        except TypeError as e:
+            raise ValueError(f"invalid pose timestamp: {e}")
+        try:
+            values = np.fromiter(
+                chain.from_iterable(map(_get_pose_values, poses)),
+                dtype=poseformat.KEYPOINT_DTYPE,
+                count=n * len(POSE_VALUE_KEYS)
+            )
+        except (KeyError, TypeError, ValueError):
+            # At least one pose is missing values, store those as NaN.
+            try:
+                values = np.array([[p.get(k) for k in POSE_VALUE_KEYS] for p in poses], dtype=poseformat.KEYPOINT_DTYPE)
+            except TypeError as e:
+                raise ValueError(f"invalid pose value: {e}")
+        return timestamps, values.reshape((n,) + poseformat.FRAME_SHAPE)
 
 
     def get_name(self) -> str:
@@ -150,19 +267,26 @@ class PoseStore:
         return f"{self.sid}_{self.clip_num}"
     
 
-    def get_path(self) -> str:
+    def get_blob_name(self) -> str:
+        '''
+        Return the name of the blob containing poses for this clip in cloud storage.
         '''
-        Return the path to the file containing pose data for this clip in local storage.
+        return self.get_name() + poseformat.BLOB_EXT
+
+
+    def get_path(self, extension: str) -> str:
+        '''
+        Return the path to a file containing pose data for this clip in local storage.
+
+        Args:
+            extension: the extension of the file, e.g. poseformat.KEYPOINTS_EXT or ".json".
         '''
-        path = os.path.dirname(__file__)
-        filename = self.get_name() + ".json"
-        return os.path.join(path, "sessions", "poses", filename)
+        return os.path.join(settings.LOCAL_POSES_DIR, self.get_name() + extension)
 
 
     def delete(self) -> None:
         '''
         Delete the pose data for a given clip from cloud storage.
         '''
-        blob_client = get_blob_client(const.AZ_POSES_CONTAINER_NAME, self.get_name())
-        if blob_client.exists():
-            blob_client.delete_blob()
+        self.storage.delete(const.AZ_POSES_CONTAINER_NAME, self.get_blob_name())
+        self.storage.delete(const.AZ_POSES_CONTAINER_NAME, self.get_name())
@@ -1,18 +1,97 @@
-'''Functionality related to retrieving and updating session metadata.'''
+'''
+Functionality related to retrieving and updating session metadata.
 
+A session's clip number is the number of the clip currently being recorded; clips before it are
+closed. It only moves on through allocate_clip_num or close_clip, each a single atomic query. It is
+not cached, as every process that reads it would need to see it move on: get_clip_num is a single
+query on the session's primary key.
+'''
+
+from django.db import connection, transaction
+from django.db.models import F
 from ..models import Session
 
 
-def get_clip_num(sid: str):
+def get_clip_num(sid: str) -> int:
     '''
     Get the current clip number for this session.
+
+    Raises:
+        Session.DoesNotExist: if there is no session with this id.
+    '''
+    return Session.objects.values_list('clip_num', flat=True).get(id=sid)
+
+
+def is_clip_closed(sid: str, clip_num) -> bool:
+    '''
+    Return whether a clip of this session has finished recording, so that no more of its pose data
+    will be received. False if there is no session with this id.
+    '''
+    return Session.objects.filter(id=sid, clip_num__gt=int(clip_num)).exists()
+
+
+def allocate_clip_num(sid: str) -> int:
+    '''
+    Finish the current clip of this session and move the session on to the next clip, atomically,
+    so that concurrent calls for the same session always get different clip numbers.
+
+    Returns:
+        The clip number of the finished clip, i.e. the current clip number before the call.
+
+    Raises:
+        Session.DoesNotExist: if there is no session with this id.
     '''
-    return Session.objects.get(id=sid).clip_num
+    if _can_update_returning():
+        # Increment and read back the new value in a single query
+        table = connection.ops.quote_name(Session._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {table} SET clip_num = clip_num + 1 WHERE id = %s RETURNING clip_num",
+                [sid]
+            )
+            row = cursor.fetchone()
+        clip_num = None if row is None else row[0]
+    else:
+        # The update locks the session's row until the end of the transaction, so the value read
+        # back is this call's increment
+        with transaction.atomic():
+            if Session.objects.filter(id=sid).update(clip_num=F('clip_num') + 1):
+                clip_num = Session.objects.values_list('clip_num', flat=True).get(id=sid)
+            else:
+                clip_num = None
 
-def increment_clip_num(sid: str):
+    if clip_num is None:
+        raise Session.DoesNotExist(f"session with id '{sid}' does not exist")
+    return clip_num - 1
+
+
+def close_clip(sid: str, clip_num: int) -> None:
+    '''
+    Close a clip that has finished recording, moving the session on to the clip after it, so that
+    chunks still arriving for the clip are rejected (see chunkmeta.record_chunk).
+
+    Any earlier clip still open (e.g. one whose video never arrived) is closed with it. Closing a
+    clip that is already closed changes nothing.
+
+    Raises:
+        Session.DoesNotExist: if there is no session with this id.
+    '''
+    if not Session.objects.filter(id=sid, clip_num__lte=clip_num).update(clip_num=clip_num + 1):
+        if not Session.objects.filter(id=sid).exists():
+            raise Session.DoesNotExist(f"session with id '{sid}' does not exist")
+
+
+def increment_clip_num(sid: str) -> None:
     '''
     Increment the current clip number for this session by 1.
+    Prefer allocate_clip_num, which also returns the number of the clip that was finished.
+    '''
+    allocate_clip_num(sid)
+
+
+def _can_update_returning() -> bool:
+    '''
+    Return whether the database supports UPDATE ... RETURNING (PostgreSQL, and SQLite from 3.35).
+    MySQL and MariaDB do not.
     '''
-    s = Session.objects.get(id=sid)
-    s.clip_num += 1
-    s.save()
+    return connection.vendor in ('postgresql', 'sqlite') and connection.features.can_return_columns_from_insert
@@ -0,0 +1,270 @@
+'''
+Storage backends for clip data (pose blobs, videos, ...).
+
+Data is stored as named blobs within containers. The backend in use is chosen by the
+DATA_STORAGE_BACKEND setting:
+    azure   - Azure blob storage, through a single process-wide (pooled) client.
+    local   - files under the DATA_STORAGE_ROOT directory.
+    memory  - an in-process dictionary, for development, tests and benchmarks.
+
+Reads raise BlobNotFound for missing blobs, so callers never need to check exists() first.
+'''
+
+import os
+import shutil
+import threading
+from azure.core.exceptions import ResourceNotFoundError
+from django.conf import settings
+from data.datastore.cloud import get_blob_client
+
+# Size of the pieces file-like data is copied in.
+COPY_BUFSIZE = 1024 * 1024
+
+
+class BlobNotFound(LookupError):
+    '''Raised when a blob does not exist.'''
+    def __init__(self, container: str, name: str) -> None:
+        super().__init__(f"blob '{name}' not found in container '{container}'")
+        self.container = container
+        self.name = name
+
+
+class Storage:
+    '''
+    Interface for a storage backend.
+    '''
+    def read(self, container: str, name: str) -> bytes:
+        '''
+        Return the contents of a blob.
+
+        Raises:
+            BlobNotFound: if the blob does not exist.
+        '''
+        raise NotImplementedError
+
+
+    def read_into(self, container: str, name: str, f) -> None:
+        '''
+        Write the contents of a blob to a writable (binary) file object.
+
+        Raises:
+            BlobNotFound: if the blob does not exist.
+        '''
+        f.write(self.read(container, name))
+
+
+    def write(self, container: str, name: str, data) -> None:
+        '''
+        Store a blob, overwriting any existing blob with the same name.
+
+        Args:
+            data: the contents of the blob, as bytes or a readable (binary) file object.
+        '''
+        raise NotImplementedError
+
+
+    def delete(self, container: str, name: str) -> None:
+        '''
+        Delete a blob, if it exists.
+        '''
+        raise NotImplementedError
+
+
+    def exists(self, container: str, name: str) -> bool:
+        '''
+        Return whether a blob exists.
+        '''
+        raise NotImplementedError
+
+
+    def etag(self, container: str, name: str) -> str:
+        '''
+        Return a tag that changes whenever a blob is (re)written, without reading the blob.
+
+        Raises:
+            BlobNotFound: if the blob does not exist.
+        '''
+        raise NotImplementedError
+
+
+class AzureStorage(Storage):
+    '''
+    Azure blob storage, using the blob service client shared by the process (see cloud.py).
+    '''
+    def read(self, container: str, name: str) -> bytes:
+        try:
+            return get_blob_client(container, name).download_blob().readall()
+        except ResourceNotFoundError:
+            raise BlobNotFound(container, name)
+
+
+    def read_into(self, container: str, name: str, f) -> None:
+        try:
+            get_blob_client(container, name).download_blob().readinto(f)
+        except ResourceNotFoundError:
+            raise BlobNotFound(container, name)
+
+
+    def write(self, container: str, name: str, data) -> None:
+        get_blob_client(container, name).upload_blob(data, overwrite=True)
+
+
+    def delete(self, container: str, name: str) -> None:
+        try:
+            get_blob_client(container, name).delete_blob()
+        except ResourceNotFoundError:
+            pass
+
+
+    def exists(self, container: str, name: str) -> bool:
+        return get_blob_client(container, name).exists()
+
+
+    def etag(self, container: str, name: str) -> str:
+        try:
+            return get_blob_client(container, name).get_blob_properties().etag
+        except ResourceNotFoundError:
+            raise BlobNotFound(container, name)
+
+
+class LocalStorage(Storage):
+    '''
+    Blobs stored as files, at <root>/<container>/<name>.
+    '''
+    def __init__(self, root: str) -> None:
+        self.root = root
+
+
+    def get_path(self, container: str, name: str) -> str:
+        '''
+        Return the path to the file for a blob.
+
+        Raises:
+            ValueError: if the container or name would refer to a path outside of the root directory.
+        '''
+        for part in (container, name):
+            if not part or part in (".", "..") or "/" in part or os.sep in part:
+                raise ValueError(f"invalid blob path '{container}/{name}'")
+        return os.path.join(self.root, container, name)
+
+
+    def read(self, container: str, name: str) -> bytes:
+        try:
+            with open(self.get_path(container, name), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            raise BlobNotFound(container, name)
+
+
+    def read_into(self, container: str, name: str, f) -> None:
+        try:
+            with open(self.get_path(container, name), "rb") as src:
+                shutil.copyfileobj(src, f, COPY_BUFSIZE)
+        except FileNotFoundError:
+            raise BlobNotFound(container, name)
+
+
+    def write(self, container: str, name: str, data) -> None:
+        path = self.get_path(container, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write to a temporary file first, so that readers never see a partial blob.
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            if isinstance(data, (bytes, bytearray, memoryview)):
+                f.write(data)
+            else:
+                shutil.copyfileobj(data, f, COPY_BUFSIZE)
+        os.replace(tmp_path, path)
+
+
+    def delete(self, container: str, name: str) -> None:
+        try:
+            os.remove(self.get_path(container, name))
+        except FileNotFoundError:
+            pass
+
+
+    def exists(self, container: str, name: str) -> bool:
+        return os.path.exists(self.get_path(container, name))
+
+
+    def etag(self, container: str, name: str) -> str:
+        try:
+            stat = os.stat(self.get_path(container, name))
+        except FileNotFoundError:
+            raise BlobNotFound(container, name)
+        return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+
+class MemoryStorage(Storage):
+    '''
+    Blobs held in memory, for the lifetime of the process.
+    '''
+    def __init__(self) -> None:
+        self.blobs = {}
+        self.etags = {}
+        self.writes = 0
+        self.lock = threading.Lock()
+
+
+    def read(self, container: str, name: str) -> bytes:
+        try:
+            return self.blobs[(container, name)]
+        except KeyError:
+            raise BlobNotFound(container, name)
+
+
+    def write(self, container: str, name: str, data) -> None:
+        if not isinstance(data, (bytes, bytearray, memoryview)):
+            data = data.read()
+        with self.lock:
+            self.writes += 1
+            self.blobs[(container, name)] = bytes(data)
+            self.etags[(container, name)] = str(self.writes)
+
+
+    def delete(self, container: str, name: str) -> None:
+        with self.lock:
+            self.blobs.pop((container, name), None)
+            self.etags.pop((container, name), None)
+
+
+    def exists(self, container: str, name: str) -> bool:
+        return (container, name) in self.blobs
+
+
+    def etag(self, container: str, name: str) -> str:
+        try:
+            return self.etags[(container, name)]
+        except KeyError:
+            raise BlobNotFound(container, name)
+
+
+_storages = {}
+_storages_lock = threading.Lock()
+
+
+def get_storage() -> Storage:
+    '''
+    Return the process-wide instance of the storage backend chosen by settings.DATA_STORAGE_BACKEND.
+
+    Raises:
+        ValueError: if the setting does not name a known backend.
+    '''
+    backend = settings.DATA_STORAGE_BACKEND
+    storage = _storages.get(backend)
+    if storage is not None:
+        return storage
+
+    with _storages_lock:
+        if backend not in _storages:
+            if backend == 'azure':
+                _storages[backend] = AzureStorage()
+            elif backend == 'local':
+                _storages[backend] = LocalStorage(str(settings.DATA_STORAGE_ROOT))
+            elif backend == 'memory':
+                _storages[backend] = MemoryStorage()
+            else:
+                raise ValueError(f"unknown storage backend '{backend}'")
+        return _storages[backend]
@@ -0,0 +1,88 @@
+'''
+Functionality related to the upload log: a record of new patients, sessions and uploaded clips,
+shown by the show_log view.
+
+Events are rows of a capped table (UploadEvent). Each write inserts one row and deletes the rows
+that fall out of the last settings.UPLOAD_LOG_MAX_EVENTS, both through the primary key index, so
+writes cost the same however long the log has been running. Sessions and clips are logged with
+the patient they belong to, where known, so the log can be filtered by patient as well as by session.
+A session's patient is looked up from the session's InvolvedIn row, recorded when the client names
+the patient, rather than from the log, as the session's own event may have been dropped from it.
+
+Events logged to the upload_log.txt file that came before the table are imported into it by the
+0015_import_upload_log migration.
+'''
+
+from django.conf import settings
+from ..models import InvolvedIn, UploadEvent, User
+
+
+def log_user(uid: str, first_name: str, last_name: str) -> UploadEvent:
+    '''
+    Log a new patient.
+    '''
+    return _log(
+        UploadEvent.USER,
+        f"Patient: {first_name} {last_name}\nuid: {uid}",
+        uid=uid,
+        patient=f"{first_name} {last_name}"
+    )
+
+
+def log_session(sid: str, name: str, description: str, uid: str = None) -> UploadEvent:
+    '''
+    Log a new session, as belonging to the patient with id uid if the client gave one (and there is
+    such a patient), otherwise without a patient.
+    '''
+    user = User.objects.filter(id=uid).first() if uid else None
+    return _log(
+        UploadEvent.SESSION,
+        f"Session Name: {name}\nSession Description: {description}\nsid: {sid}",
+        uid=user.id if user else '',
+        patient=str(user) if user else '',
+        sid=sid
+    )
+
+
+def log_clip(sid: str, clip_num: int) -> UploadEvent:
+    '''
+    Log a clip uploaded to a session, as belonging to the patient involved in the session, if any.
+    '''
+    involved = InvolvedIn.objects.filter(session_id=sid).select_related('user').first()
+    user = involved.user if involved else None
+    return _log(
+        UploadEvent.CLIP,
+        f"===== Uploaded Clip: {clip_num} ======",
+        uid=user.id if user else '',
+        patient=str(user) if user else '',
+        sid=sid,
+        clip_num=clip_num
+    )
+
+
+def get_events(offset: int = 0, limit: int = None, sid: str = None, patient: str = None) -> list:
+    '''
+    Return the latest events, newest first, optionally only those of one session or patient.
+
+    Args:
+        offset: number of (matching) events to skip, for paging.
+        limit: maximum number of events to return, settings.UPLOAD_LOG_PAGE_SIZE by default.
+        sid: only return events of the session with this id.
+        patient: only return events of patients with exactly this name.
+    '''
+    limit = settings.UPLOAD_LOG_PAGE_SIZE if limit is None else limit
+    events = UploadEvent.objects.order_by('-id')
+    if sid:
+        events = events.filter(sid=sid)
+    if patient:
+        events = events.filter(patient=patient)
+    return list(events[offset:offset + limit])
+
+
+def _log(kind: str, message: str, **fields) -> UploadEvent:
+    '''
+    Add an event to the log, dropping the oldest events once there are more than settings.UPLOAD_LOG_MAX_EVENTS.
+    '''
+    event = UploadEvent.objects.create(kind=kind, message=message, **fields)
+    UploadEvent.objects.filter(id__lte=event.id - settings.UPLOAD_LOG_MAX_EVENTS).delete()
+    return event
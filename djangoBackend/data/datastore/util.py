@@ -1,3 +1,6 @@
+import data.datastore.const as const
+
+
 def get_keypoint_value_keys(keypoint_index: int):
   '''
     Args:
@@ -13,4 +16,16 @@ def get_keypoint_value_keys(keypoint_index: int):
     str(keypoint_index + 2),
     str(keypoint_index + 3),
     str(keypoint_index + 4)
-  ]
\ No newline at end of file
+  ]
+
+
+def get_pose_value_keys():
+  '''
+    Returns:
+      list of keys for every value in a pose from the pose estimation model, keypoint by
+      keypoint, in the order given by get_keypoint_value_keys.
+  '''
+  keys = []
+  for i in range(const.NUM_KEYPOINTS):
+    keys += get_keypoint_value_keys(i * const.VALS_PER_KEYPOINT)
+  return keys
@@ -1,56 +1,62 @@
-import os
-import tempfile
 import data.datastore.const as const
-from data.datastore.cloud import get_blob_client
+from data.datastore.storage import BlobNotFound, Storage, get_storage
+from data.datastore.cache import get_clip_cache
 
 class VideoStore:
     '''
     Handle the storage and retrieval of video data for a clip.
     '''
-    def __init__(self, sid: str, clip_num: str) -> None:
+    def __init__(self, sid: str, clip_num: str, storage: Storage = None) -> None:
         '''
         Args:
-            sid (str)       - the id of the session
-            clip_num (str)  - the clip number within this session
+            sid (str)           - the id of the session
+            clip_num (str)      - the clip number within this session
+            storage (Storage)   - where clip data is stored, the configured backend by default
         '''
         self.sid = sid
         self.clip_num = clip_num
+        self.storage = storage or get_storage()
 
 
     def get(self) -> str:
         '''
         Load the video data for this clip into a file and return the path to this file.
+        The file is kept in the clip cache, so it is only downloaded again if the video
+        has changed (or it was evicted).
 
         Raises:
             ValueError: if video data for this clip is not found.
         '''
-        blob_client = get_blob_client(const.AZ_VIDEOS_CONTAINER_NAME, self.get_name())
-        if blob_client.exists():
-            video_path = os.path.join(tempfile.gettempdir(), self.get_name())
-            with open(video_path, "wb") as f:
-                blob_client.download_blob().readinto(f)
-            return video_path
-        raise ValueError(
-            f"video from clip with sid '{self.sid}' and clip number '{self.clip_num}' not found"
-        )
+        container, name = const.AZ_VIDEOS_CONTAINER_NAME, self.get_name()
+        try:
+            etag = self.storage.etag(container, name)
+            return get_clip_cache().get_file(
+                f"{container}/{name}",
+                etag,
+                lambda f: self.storage.read_into(container, name, f)
+            )
+        except BlobNotFound:
+            raise ValueError(
+                f"video from clip with sid '{self.sid}' and clip number '{self.clip_num}' not found"
+            )
     
 
     def write(self, video: bytes) -> None:
         '''
         Store the video data for this clip.
         If there is already some video data, it is overwritten.
+
+        Args:
+            video: the video data, as bytes or a readable (binary) file object.
         '''
-        blob_client = get_blob_client(const.AZ_VIDEOS_CONTAINER_NAME, self.get_name())
-        blob_client.upload_blob(video, overwrite=True)
+        self.storage.write(const.AZ_VIDEOS_CONTAINER_NAME, self.get_name(), video)
 
 
     def delete(self) -> None:
         '''
         Delete the video file for a this clip from cloud storage.
         '''
-        blob_client = get_blob_client(const.AZ_VIDEOS_CONTAINER_NAME, self.get_name())
-        if blob_client.exists():
-            blob_client.delete_blob()
+        self.storage.delete(const.AZ_VIDEOS_CONTAINER_NAME, self.get_name())
 
 
     def get_name(self) -> str:
@@ -0,0 +1,58 @@
+import random
+import timeit
+import data.datastore.const as const
+from django.core.management.base import BaseCommand
+from data.datastore.posestore import PoseStore
+from data.datastore.util import get_keypoint_value_keys
+
+
+def legacy_format_poses(poses: list) -> list:
+    '''
+    The per-keypoint implementation of PoseStore.format_poses that format_poses_array replaces,
+    kept here as a baseline.
+    '''
+    formatted_poses = []
+    for pose in poses:
+        keypoints = []
+        for i in range(const.NUM_KEYPOINTS):
+            keypoint_index = i * const.VALS_PER_KEYPOINT
+            xi, yi, zi, visi, presi = get_keypoint_value_keys(keypoint_index)
+            keypoints.append({
+                'name': const.KEYPOINT_MAPPINGS.get(keypoint_index / const.VALS_PER_KEYPOINT),
+                'x': pose.get(xi),
+                'y': pose.get(yi),
+                'z': pose.get(zi),
+                'visibility': pose.get(visi),
+                'presence': pose.get(presi)
+            })
+        formatted_poses.append({'timestamp': pose.get('timestamp'), 'keypoints': keypoints})
+    return formatted_poses
+
+
+class Command(BaseCommand):
+    help = 'Benchmark formatting raw pose estimation model output for storage.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--frames', type=int, default=30, help='poses per batch (30 = one second of video)')
+        parser.add_argument('--repeat', type=int, default=200, help='number of batches to format')
+
+    def handle(self, *args, **options):
+        num_values = const.NUM_KEYPOINTS * const.VALS_PER_KEYPOINT
+        poses = []
+        for t in range(options['frames']):
+            pose = {str(i): random.uniform(-200, 200) for i in range(num_values)}
+            pose['timestamp'] = 1720410157109 + t * 33
+            poses.append(pose)
+
+        candidates = [
+            ('legacy format_poses (dicts)', legacy_format_poses),
+            ('format_poses (dicts, via arrays)', PoseStore.format_poses),
+            ('format_poses_array', PoseStore.format_poses_array),
+        ]
+        self.stdout.write(f"{options['repeat']} batches of {options['frames']} poses")
+        baseline = None
+        for name, fn in candidates:
+            seconds = min(timeit.repeat(lambda: fn(poses), number=options['repeat'], repeat=3))
+            per_frame = seconds / (options['repeat'] * options['frames']) * 1e6
+            baseline = baseline or per_frame
+            self.stdout.write(f"{name:<34} {per_frame:8.2f} us/frame  {baseline / per_frame:6.1f}x")
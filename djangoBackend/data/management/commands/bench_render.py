@@ -0,0 +1,59 @@
+import os
+import time
+import tempfile
+import cv2
+import numpy as np
+import data.const as const
+import data.datastore.const as datastore_const
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from data.datastore.posereader import PoseReader
+from data.visualise import create_2D_visualisation, get_executor, STORED_MODE, MODES
+
+
+class Command(BaseCommand):
+    help = 'Benchmark how 2D visualisation rendering time scales with the number of worker processes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--video', help='video to render, a synthetic clip is generated if not given')
+        parser.add_argument('--seconds', type=int, default=60, help='length of the synthetic clip')
+        parser.add_argument('--mode', choices=MODES, default=STORED_MODE)
+        parser.add_argument('--workers', type=int, nargs='+', help='worker counts to compare (default 1, 2, 4, ... up to VISUALISE_WORKERS)')
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as directory:
+            video_path = options['video'] or self.write_clip(os.path.join(directory, 'clip.avi'), options['seconds'])
+            cap = cv2.VideoCapture(video_path)
+            num_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            fps = cap.get(cv2.CAP_PROP_FPS) or 30
+            cap.release()
+
+            # Poses at the video's frame times, with keypoints spread over the model input
+            timestamps = 1720410157109 + (np.arange(num_frames) * 1000 / fps).astype(np.int64)
+            keypoints = np.random.default_rng(0).uniform(0, const.MODEL_INPUT_SIZE, (num_frames, datastore_const.NUM_KEYPOINTS, datastore_const.VALS_PER_KEYPOINT)).astype(np.float32)
+            poses = PoseReader(timestamps, keypoints)
+
+            worker_counts = options['workers'] or [n for n in (1, 2, 4, 8, 16, 32, 64) if n <= settings.VISUALISE_WORKERS]
+            # Start the worker processes before timing, as a server's are started by its first request
+            get_executor().submit(int).result()
+
+            self.stdout.write(f"{num_frames} frames, {options['mode']} mode, {os.cpu_count()} cores")
+            self.stdout.write(f"{'workers':>7} {'seconds':>8} {'frames/s':>9} {'speedup':>8}")
+            baseline = None
+            for workers in worker_counts:
+                start = time.perf_counter()
+                frames = create_2D_visualisation(poses, video_path, options['mode'], workers)
+                seconds = time.perf_counter() - start
+                baseline = baseline or seconds
+                self.stdout.write(f"{workers:>7} {seconds:8.2f} {len(frames) / seconds:9.1f} {baseline / seconds:7.2f}x")
+
+    def write_clip(self, path: str, seconds: int) -> str:
+        '''
+        Write a synthetic 30 fps clip, with frames the size of those recorded by the mobile application.
+        '''
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 30, (320, 240))
+        rng = np.random.default_rng(0)
+        for _ in range(seconds * 30):
+            writer.write(rng.integers(0, 256, (240, 320, 3), dtype=np.uint8))
+        writer.release()
+        return path
@@ -0,0 +1,41 @@
+import json
+import random
+import timeit
+import data.datastore.const as const
+import data.datastore.poseformat as poseformat
+import data.wire as wire
+from django.core.management.base import BaseCommand
+from data.datastore.posestore import PoseStore
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the size and server decode time of each pose upload encoding.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--frames', type=int, default=1000, help='poses per upload')
+        parser.add_argument('--repeat', type=int, default=20, help='number of uploads to decode')
+
+    def handle(self, *args, **options):
+        num_values = const.NUM_KEYPOINTS * const.VALS_PER_KEYPOINT
+        poses = []
+        for t in range(options['frames']):
+            # Values are float32, as they are in the mobile application
+            pose = {str(i): float(poseformat.KEYPOINT_DTYPE.type(random.uniform(-200, 200))) for i in range(num_values)}
+            pose['timestamp'] = 1720410157109 + t * 33
+            poses.append(pose)
+        timestamps, keypoints = PoseStore.format_poses_array(poses)
+        fields = {'sid': 'ccbe340e-f1db-4037-8f91-257bcac2c2f9', 'seq': 0}
+
+        encodings = [
+            ('JSON, poses as string (legacy)', json.dumps({**fields, 'poses': json.dumps(poses)}).encode(), wire.decode_json),
+            ('JSON, poses as list', json.dumps({**fields, 'poses': poses}).encode(), wire.decode_json),
+            ('msgpack', wire.encode_msgpack(fields, timestamps, keypoints), wire.decode_msgpack),
+            ('raw float32 block', poseformat.pack(timestamps, keypoints), poseformat.unpack),
+        ]
+
+        per = 1000 / options['frames']
+        self.stdout.write(f"per 1000 frames ({options['frames']} frames per upload)")
+        self.stdout.write(f"{'encoding':<32} {'KiB':>9} {'decode ms':>10}")
+        for name, body, decode in encodings:
+            seconds = min(timeit.repeat(lambda: decode(body), number=options['repeat'], repeat=3)) / options['repeat']
+            self.stdout.write(f"{name:<32} {len(body) * per / 1024:9.1f} {seconds * per * 1000:10.3f}")
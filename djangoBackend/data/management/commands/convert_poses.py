@@ -0,0 +1,22 @@
+import os
+from django.core.management.base import BaseCommand
+from data.datastore.posestore import PoseStore
+
+
+class Command(BaseCommand):
+    help = 'Convert local JSON pose files (sessions/poses/*.json) to the binary pose format.'
+
+    def handle(self, *args, **options):
+        poses_dir = os.path.dirname(PoseStore('', '').get_path(".json"))
+        converted = 0
+        for filename in sorted(os.listdir(poses_dir)):
+            name, extension = os.path.splitext(filename)
+            if extension != ".json":
+                continue
+            sid, _, clip_num = name.rpartition("_")
+            if PoseStore(sid, clip_num).convert_json():
+                converted += 1
+                self.stdout.write(f"converted {filename}")
+            else:
+                self.stdout.write(f"skipped {filename}, already converted")
+        self.stdout.write(self.style.SUCCESS(f"converted {converted} clip(s)"))
@@ -0,0 +1,214 @@
+import io
+import os
+import sys
+import time
+import uuid
+import asyncio
+import threading
+import numpy as np
+import data.datastore.poseformat as poseformat
+import data.wire as wire
+from datetime import datetime
+from django.conf import settings
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+from django.core.wsgi import get_wsgi_application
+from django.db import connection
+from django.test import override_settings
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.core.files.uploadedfile import SimpleUploadedFile
+from data.models import Session, UploadEvent, UploadJob
+from data.datastore.posestore import PoseStore
+from chart.LiveAngles import ANGLES_EXT, STATS_EXT
+
+ENDPOINTS = {
+    # endpoint: (sync path, async path)
+    'poses': ('/data/poses/upload/', '/data/poses/upload/async/'),
+    'video': ('/data/video/upload/', '/data/video/upload/async/'),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Load test the pose and video upload views, comparing requests per second and latency of the sync views '
+        'under WSGI with the async views under ASGI. The applications are called in process, so no server is '
+        'needed. Uploads go to a temporary session, which is deleted (with its data) afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--endpoint', choices=ENDPOINTS, default='poses')
+        parser.add_argument('--requests', type=int, default=2000, help='number of uploads per run')
+        parser.add_argument('--concurrency', type=int, default=64, help='number of clients uploading at once')
+        parser.add_argument('--workers', type=int, default=8, help='WSGI worker threads, as a WSGI server would have')
+        parser.add_argument('--frames', type=int, default=30, help='poses per pose upload')
+        parser.add_argument('--video-kb', type=int, default=1024, help='size of each video upload in KiB')
+
+    def handle(self, *args, **options):
+        sid = f"loadtest-{uuid.uuid4()}"
+        Session.objects.create(id=sid, name='load test', date=datetime.now(), description='')
+        content_type, body = self.make_body(sid, options)
+        sync_path, async_path = ENDPOINTS[options['endpoint']]
+        host = settings.ALLOWED_HOSTS[0]
+
+        runs = [
+            ('WSGI', 'sync', lambda: self.run_wsgi(sync_path, content_type, body, host, options)),
+            ('ASGI', 'sync', lambda: self.run_asgi(sync_path, content_type, body, host, options)),
+            ('ASGI', 'async', lambda: self.run_asgi(async_path, content_type, body, host, options)),
+        ]
+        # Queued videos are left for the workers of a real server, rather than uploaded during the test
+        with override_settings(UPLOAD_WORKERS_AUTOSTART=False):
+            try:
+                self.stdout.write(
+                    f"{options['endpoint']} uploads of {len(body) / 1024:.1f} KiB, {options['requests']} requests, "
+                    f"{options['concurrency']} clients, {options['workers']} WSGI workers, {os.cpu_count()} cores"
+                )
+                self.stdout.write(f"{'server':<6} {'view':<6} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+                for server, view, run in runs:
+                    start = time.perf_counter()
+                    latencies, errors = run()
+                    seconds = time.perf_counter() - start
+                    p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+                    self.stdout.write(
+                        f"{server:<6} {view:<6} {len(latencies) / seconds:8.1f} {p50:8.1f} {p99:8.1f} {errors:>7}"
+                    )
+            finally:
+                self.clean_up(sid)
+
+    def make_body(self, sid: str, options: dict) -> tuple:
+        '''
+        Return the content type and body of each upload.
+        '''
+        if options['endpoint'] == 'video':
+            video = SimpleUploadedFile('clip.MOV', os.urandom(options['video_kb'] * 1024))
+            return MULTIPART_CONTENT, encode_multipart(BOUNDARY, {'sid': sid, 'video': video})
+
+        frames = options['frames']
+        timestamps = 1720410157109 + np.arange(frames, dtype=poseformat.TIMESTAMP_DTYPE) * 33
+        keypoints = np.random.default_rng(0).uniform(0, 200, (frames,) + poseformat.FRAME_SHAPE)
+        return wire.MSGPACK_CONTENT_TYPES[0], wire.encode_msgpack({'sid': sid}, timestamps, keypoints)
+
+    def run_wsgi(self, path: str, content_type: str, body: bytes, host: str, options: dict) -> tuple:
+        '''
+        Upload through the WSGI application, from options['concurrency'] client threads sharing
+        options['workers'] worker slots. Latency includes the time spent waiting for a worker.
+        '''
+        application = get_wsgi_application()
+        workers = threading.BoundedSemaphore(options['workers'])
+        remaining = iter(range(options['requests']))
+        remaining_lock = threading.Lock()
+        latencies = []
+        errors = []
+
+        def client():
+            try:
+                while True:
+                    with remaining_lock:
+                        if next(remaining, None) is None:
+                            return
+                    start = time.perf_counter()
+                    with workers:
+                        statuses = []
+                        environ = {
+                            'REQUEST_METHOD': 'POST',
+                            'PATH_INFO': path,
+                            'SERVER_NAME': host,
+                            'SERVER_PORT': '80',
+                            'HTTP_HOST': host,
+                            'CONTENT_TYPE': content_type,
+                            'CONTENT_LENGTH': str(len(body)),
+                            'wsgi.input': io.BytesIO(body),
+                            'wsgi.errors': sys.stderr,
+                            'wsgi.url_scheme': 'http',
+                        }
+                        result = application(environ, lambda status, headers: statuses.append(status))
+                        b''.join(result)
+                        result.close()
+                    latencies.append(time.perf_counter() - start)
+                    if not statuses[0].startswith('2'):
+                        errors.append(statuses[0])
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=client) for _ in range(options['concurrency'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return np.array(latencies), len(errors)
+
+    def run_asgi(self, path: str, content_type: str, body: bytes, host: str, options: dict) -> tuple:
+        '''
+        Upload through the ASGI application, from options['concurrency'] client tasks on one event loop.
+        '''
+        application = get_asgi_application()
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': 'POST',
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode(),
+            'query_string': b'',
+            'root_path': '',
+            'headers': [
+                (b'host', host.encode()),
+                (b'content-type', content_type.encode()),
+                (b'content-length', str(len(body)).encode()),
+            ],
+            'client': ('127.0.0.1', 50000),
+            'server': (host, 80),
+        }
+
+        async def upload():
+            received = False
+            statuses = []
+
+            async def receive():
+                nonlocal received
+                if received:
+                    # The client stays connected until the response is sent
+                    await asyncio.Event().wait()
+                received = True
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    statuses.append(message['status'])
+
+            start = time.perf_counter()
+            await application(dict(scope), receive, send)
+            return time.perf_counter() - start, statuses[0]
+
+        async def client(remaining, latencies, errors):
+            while next(remaining, None) is not None:
+                latency, status = await upload()
+                latencies.append(latency)
+                if not 200 <= status < 300:
+                    errors.append(status)
+
+        async def run():
+            remaining = iter(range(options['requests']))
+            latencies = []
+            errors = []
+            await asyncio.gather(*(client(remaining, latencies, errors) for _ in range(options['concurrency'])))
+            return np.array(latencies), len(errors)
+
+        return asyncio.run(run())
+
+    def clean_up(self, sid: str) -> None:
+        '''
+        Delete the load test session and everything uploaded to it.
+        '''
+        for job in UploadJob.objects.filter(session_id=sid):
+            if os.path.exists(job.video_path):
+                os.remove(job.video_path)
+        UploadEvent.objects.filter(sid=sid).delete()
+        clip_nums = range(Session.objects.get(id=sid).clip_num + 1)
+        # Deleting the session deletes its jobs and clips too
+        Session.objects.filter(id=sid).delete()
+        for clip_num in clip_nums:
+            pose_store = PoseStore(sid, clip_num)
+            for ext in (poseformat.KEYPOINTS_EXT, poseformat.TIMESTAMPS_EXT, ANGLES_EXT, STATS_EXT):
+                if os.path.exists(pose_store.get_path(ext)):
+                    os.remove(pose_store.get_path(ext))
@@ -0,0 +1,19 @@
+import time
+from django.core.management.base import BaseCommand
+import data.uploadqueue as uploadqueue
+
+
+class Command(BaseCommand):
+    help = 'Run a pool of background clip upload workers in this process (see data/uploadqueue.py).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help='number of workers, settings.UPLOAD_WORKERS by default')
+
+    def handle(self, *args, **options):
+        workers = uploadqueue.start_workers(options['workers'])
+        self.stdout.write(f"running {len(workers)} upload worker(s), press Ctrl-C to stop")
+        try:
+            while True:
+                time.sleep(60)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-18 10:38
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0010_session_clip_num'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PoseChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('clip_num', models.IntegerField(help_text='Enter the clip number within the session that this chunk belongs to: ')),
+                ('seq', models.IntegerField(help_text='Enter the sequence number of this chunk within its clip, counting from 0: ')),
+                ('num_frames', models.IntegerField(help_text='Enter the number of frames in this chunk: ')),
+                ('received', models.DateTimeField(auto_now_add=True)),
+                ('session', models.ForeignKey(help_text='Enter the id of the session this chunk belongs to: ', on_delete=django.db.models.deletion.CASCADE, to='data.session')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='posechunk',
+            constraint=models.UniqueConstraint(fields=('session', 'clip_num', 'seq'), name='unique_pose_chunk_seq'),
+        ),
+    ]
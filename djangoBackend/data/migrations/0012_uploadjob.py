@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-18 10:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0011_posechunk'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadJob',
+            fields=[
+                ('id', models.TextField(max_length=200, primary_key=True, serialize=False)),
+                ('clip_num', models.IntegerField(help_text='Enter the clip number within the session that this upload belongs to: ')),
+                ('video_path', models.TextField(help_text='Enter the path to the locally spooled video file: ', max_length=1000)),
+                ('status', models.TextField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('progress', models.IntegerField(default=0, help_text='Enter the progress of the upload, as a percentage: ')),
+                ('attempts', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True, default='', max_length=2000)),
+                ('run_after', models.DateTimeField(help_text='Enter the earliest time the upload should be (re)tried: ')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('session', models.ForeignKey(help_text='Enter the id of the session this upload belongs to: ', on_delete=django.db.models.deletion.CASCADE, to='data.session')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'run_after'], name='upload_job_status_run_after')],
+            },
+        ),
+    ]
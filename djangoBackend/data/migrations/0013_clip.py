@@ -0,0 +1,38 @@
+# Generated by Django 4.2.7 on 2026-10-18 11:01
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0012_uploadjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Clip',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('clip_num', models.IntegerField(help_text='Enter the clip number within the session: ')),
+                ('frame_count', models.IntegerField(blank=True, help_text='Enter the number of frames of pose data in the clip: ', null=True)),
+                ('duration', models.FloatField(blank=True, help_text='Enter the length of the clip, in seconds: ', null=True)),
+                ('fps', models.FloatField(blank=True, help_text="Enter the frame rate of the clip's video: ", null=True)),
+                ('pose_bytes', models.BigIntegerField(blank=True, help_text="Enter the size of the clip's stored pose data, in bytes: ", null=True)),
+                ('video_bytes', models.BigIntegerField(blank=True, help_text="Enter the size of the clip's video, in bytes: ", null=True)),
+                ('pose_key', models.TextField(blank=True, default='', help_text="Enter the container and name of the clip's pose data blob: ", max_length=1000)),
+                ('video_key', models.TextField(blank=True, default='', help_text="Enter the container and name of the clip's video blob: ", max_length=1000)),
+                ('status', models.TextField(choices=[('uploading', 'Uploading'), ('stored', 'Stored'), ('failed', 'Failed')], default='uploading', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('session', models.ForeignKey(help_text='Enter the id of the session this clip belongs to: ', on_delete=django.db.models.deletion.CASCADE, to='data.session')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['session', '-created_at'], name='clip_session_created_at'), models.Index(fields=['-created_at'], name='clip_created_at')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='clip',
+            constraint=models.UniqueConstraint(fields=('session', 'clip_num'), name='unique_clip_num'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-18 11:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0013_clip'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.TextField(choices=[('user', 'User'), ('session', 'Session'), ('clip', 'Clip')], max_length=20)),
+                ('uid', models.TextField(blank=True, default='', help_text='Enter the id of the patient this event is about: ', max_length=200)),
+                ('patient', models.TextField(blank=True, default='', help_text='Enter the name of the patient this event is about: ', max_length=200)),
+                ('sid', models.TextField(blank=True, default='', help_text='Enter the id of the session this event is about: ', max_length=200)),
+                ('clip_num', models.IntegerField(blank=True, help_text='Enter the clip number this event is about: ', null=True)),
+                ('message', models.TextField(help_text='Enter the text shown for this event in the upload log: ', max_length=2000)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['sid', '-id'], name='upload_event_sid'), models.Index(fields=['patient', '-id'], name='upload_event_patient'), models.Index(fields=['kind', '-id'], name='upload_event_kind')],
+            },
+        ),
+    ]
@@ -0,0 +1,89 @@
+import re
+from django.conf import settings
+from django.db import migrations
+
+LOG_FILE_NAME = 'upload_log.txt'
+CLIP_PATTERN = re.compile(r"Uploaded Clip: (\d+)")
+
+
+def parse_upload_log(lines) -> list:
+    '''
+    Parse the upload_log.txt file written before the upload log was kept in the database.
+
+    The file has an entry per new patient: "Patient: <name>" and "uid: <id>" lines, followed by
+    the "Session Name:", "Session Description:" and "sid:" lines of each session started straight
+    after it, then a "===== Uploaded Clip: <n> ======" marker for each clip uploaded to the session
+    (markers were written without a line break, so several can share a line).
+
+    Returns:
+        The events in the order they were logged, as dictionaries of UploadEvent fields.
+    '''
+    events = []
+    patient = uid = sid = ''
+    session = {}
+    for line in lines:
+        line = line.strip()
+        if line.startswith('Patient:'):
+            patient, uid, sid = line[len('Patient:'):].strip(), '', ''
+        elif line.startswith('uid:'):
+            uid = line[len('uid:'):].strip()
+            events.append({'kind': 'user', 'message': f"Patient: {patient}\nuid: {uid}", 'uid': uid, 'patient': patient})
+        elif line.startswith('Session Name:'):
+            session = {'name': line[len('Session Name:'):].strip(), 'description': ''}
+        elif line.startswith('Session Description:'):
+            session['description'] = line[len('Session Description:'):].strip()
+        elif line.startswith('sid:'):
+            sid = line[len('sid:'):].strip()
+            events.append({
+                'kind': 'session',
+                'message': f"Session Name: {session.get('name', '')}\nSession Description: {session.get('description', '')}\nsid: {sid}",
+                'uid': uid,
+                'patient': patient,
+                'sid': sid,
+            })
+        for clip_num in CLIP_PATTERN.findall(line):
+            events.append({
+                'kind': 'clip',
+                'message': f"===== Uploaded Clip: {clip_num} ======",
+                'uid': uid,
+                'patient': patient,
+                'sid': sid,
+                'clip_num': int(clip_num),
+            })
+    return events
+
+
+def import_upload_log(apps, schema_editor, path=None) -> None:
+    '''
+    Import the events of upload_log.txt, if there is one, keeping the latest settings.UPLOAD_LOG_MAX_EVENTS.
+    They are added before any events already in the table, which are newer.
+    '''
+    path = path or settings.BASE_DIR / LOG_FILE_NAME
+    try:
+        with open(path) as f:
+            events = parse_upload_log(f)
+    except FileNotFoundError:
+        return
+
+    UploadEvent = apps.get_model('data', 'UploadEvent')
+    existing = list(UploadEvent.objects.order_by('id'))
+    events = events[max(0, len(events) + len(existing) - settings.UPLOAD_LOG_MAX_EVENTS):]
+    UploadEvent.objects.all().delete()
+    UploadEvent.objects.bulk_create([UploadEvent(**event) for event in events])
+    for event in existing:
+        # Saved again with new ids, after the imported events
+        created_at = event.created_at
+        event.id = None
+        event.save()
+        UploadEvent.objects.filter(id=event.id).update(created_at=created_at)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0014_uploadevent'),
+    ]
+
+    operations = [
+        migrations.RunPython(import_upload_log, migrations.RunPython.noop),
+    ]
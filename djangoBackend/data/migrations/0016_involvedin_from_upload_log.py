@@ -0,0 +1,34 @@
+import uuid
+from django.db import migrations
+
+
+def record_session_patients(apps, schema_editor) -> None:
+    '''
+    Record the patient of each session logged with one in the upload log as involved in the session,
+    as clips are now logged with the patient involved in their session rather than the one in the log.
+    '''
+    UploadEvent = apps.get_model('data', 'UploadEvent')
+    InvolvedIn = apps.get_model('data', 'InvolvedIn')
+    Session = apps.get_model('data', 'Session')
+    User = apps.get_model('data', 'User')
+
+    involved = set(InvolvedIn.objects.values_list('session_id', flat=True))
+    for event in UploadEvent.objects.filter(kind='session').exclude(uid='').order_by('id'):
+        if event.sid in involved:
+            continue
+        session = Session.objects.filter(id=event.sid).first()
+        user = User.objects.filter(id=event.uid).first()
+        if session and user:
+            InvolvedIn.objects.create(id=str(uuid.uuid4()), user=user, session=session)
+            involved.add(event.sid)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0015_import_upload_log'),
+    ]
+
+    operations = [
+        migrations.RunPython(record_session_patients, migrations.RunPython.noop),
+    ]
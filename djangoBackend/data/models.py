@@ -34,4 +34,120 @@ class InvolvedIn(models.Model):
         session_info = Session.objects.get(id=self.session.id)
         return f"{user_info.first_name} {user_info.last_name} (user id #{user_info.id}) "\
                 f"was involved in session #{session_info.id} on {session_info.date}"
-    
\ No newline at end of file
+
+
+class PoseChunk(models.Model):
+    '''
+    Record of a sequence-numbered chunk of pose data received for a clip, so that a chunk
+    that is sent more than once (e.g. retried by the client) is only stored once.
+    '''
+    session = models.ForeignKey(Session, on_delete=models.CASCADE, help_text='Enter the id of the session this chunk belongs to: ')
+    clip_num = models.IntegerField(help_text='Enter the clip number within the session that this chunk belongs to: ')
+    seq = models.IntegerField(help_text='Enter the sequence number of this chunk within its clip, counting from 0: ')
+    num_frames = models.IntegerField(help_text='Enter the number of frames in this chunk: ')
+    received = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['session', 'clip_num', 'seq'], name='unique_pose_chunk_seq'),
+        ]
+
+    def __str__(self) -> str:
+        return f"Chunk #{self.seq} of clip {self.clip_num} in session #{self.session_id} ({self.num_frames} frames)"
+
+
+class UploadJob(models.Model):
+    '''
+    A clip upload (video and pose data) waiting for, or being processed by, a background
+    upload worker. See data/uploadqueue.py.
+    '''
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = [(PENDING, 'Pending'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    id = models.TextField(max_length=200, primary_key=True)
+    session = models.ForeignKey(Session, on_delete=models.CASCADE, help_text='Enter the id of the session this upload belongs to: ')
+    clip_num = models.IntegerField(help_text='Enter the clip number within the session that this upload belongs to: ')
+    video_path = models.TextField(max_length=1000, help_text='Enter the path to the locally spooled video file: ')
+    status = models.TextField(max_length=20, choices=STATUSES, default=PENDING)
+    progress = models.IntegerField(default=0, help_text='Enter the progress of the upload, as a percentage: ')
+    attempts = models.IntegerField(default=0)
+    error = models.TextField(max_length=2000, blank=True, default='')
+    run_after = models.DateTimeField(help_text='Enter the earliest time the upload should be (re)tried: ')
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='upload_job_status_run_after'),
+        ]
+
+    def __str__(self) -> str:
+        return f"Upload #{self.id} of clip {self.clip_num} in session #{self.session_id} ({self.status}, {self.progress}%)"
+
+
+class Clip(models.Model):
+    '''
+    Catalog entry for a recorded clip, with its metadata and where its data is stored, so that
+    clips can be listed without probing storage. Created when the clip's video is received and
+    filled in once the clip has been uploaded (see data/uploadqueue.py).
+    '''
+    UPLOADING = 'uploading'
+    STORED = 'stored'
+    FAILED = 'failed'
+    STATUSES = [(UPLOADING, 'Uploading'), (STORED, 'Stored'), (FAILED, 'Failed')]
+
+    session = models.ForeignKey(Session, on_delete=models.CASCADE, help_text='Enter the id of the session this clip belongs to: ')
+    clip_num = models.IntegerField(help_text='Enter the clip number within the session: ')
+    frame_count = models.IntegerField(null=True, blank=True, help_text='Enter the number of frames of pose data in the clip: ')
+    duration = models.FloatField(null=True, blank=True, help_text='Enter the length of the clip, in seconds: ')
+    fps = models.FloatField(null=True, blank=True, help_text='Enter the frame rate of the clip\'s video: ')
+    pose_bytes = models.BigIntegerField(null=True, blank=True, help_text='Enter the size of the clip\'s stored pose data, in bytes: ')
+    video_bytes = models.BigIntegerField(null=True, blank=True, help_text='Enter the size of the clip\'s video, in bytes: ')
+    pose_key = models.TextField(max_length=1000, blank=True, default='', help_text='Enter the container and name of the clip\'s pose data blob: ')
+    video_key = models.TextField(max_length=1000, blank=True, default='', help_text='Enter the container and name of the clip\'s video blob: ')
+    status = models.TextField(max_length=20, choices=STATUSES, default=UPLOADING)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['session', 'clip_num'], name='unique_clip_num'),
+        ]
+        indexes = [
+            models.Index(fields=['session', '-created_at'], name='clip_session_created_at'),
+            models.Index(fields=['-created_at'], name='clip_created_at'),
+        ]
+
+    def __str__(self) -> str:
+        return f"Clip {self.clip_num} in session #{self.session_id} ({self.status})"
+
+
+class UploadEvent(models.Model):
+    '''
+    Entry in the upload log, shown by the show_log view: a new patient, session or uploaded clip.
+    The log is capped at settings.UPLOAD_LOG_MAX_EVENTS entries, see data/datastore/uploadlog.py.
+    '''
+    USER = 'user'
+    SESSION = 'session'
+    CLIP = 'clip'
+    KINDS = [(USER, 'User'), (SESSION, 'Session'), (CLIP, 'Clip')]
+
+    kind = models.TextField(max_length=20, choices=KINDS)
+    uid = models.TextField(max_length=200, blank=True, default='', help_text='Enter the id of the patient this event is about: ')
+    patient = models.TextField(max_length=200, blank=True, default='', help_text='Enter the name of the patient this event is about: ')
+    sid = models.TextField(max_length=200, blank=True, default='', help_text='Enter the id of the session this event is about: ')
+    clip_num = models.IntegerField(null=True, blank=True, help_text='Enter the clip number this event is about: ')
+    message = models.TextField(max_length=2000, help_text='Enter the text shown for this event in the upload log: ')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['sid', '-id'], name='upload_event_sid'),
+            models.Index(fields=['patient', '-id'], name='upload_event_patient'),
+            models.Index(fields=['kind', '-id'], name='upload_event_kind'),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.kind} event #{self.id}: {self.message}"
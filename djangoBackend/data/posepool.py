@@ -0,0 +1,158 @@
+'''
+Process-wide pool of warm MediaPipe pose estimators.
+
+Loading a pose estimation model takes much longer than running it on a short clip, so
+estimators are loaded (and run once, to warm them up) when the pool is first used, then
+borrowed by requests and returned to the pool, rather than loaded for each request:
+
+    with get_pose_pool().borrow() as pose:
+        results = pose.process(image)
+
+Estimators run in static image mode, so no tracking state is carried from one borrower to the next.
+The pool's size and the estimators' options are set by the POSE_POOL_* settings.
+'''
+
+import time
+import queue
+import threading
+from contextlib import contextmanager
+import numpy as np
+from django.conf import settings
+
+
+class PoolTimeout(Exception):
+    '''Raised when no estimator becomes free within the time a borrower is willing to wait.'''
+
+
+class PosePool:
+    '''
+    Fixed size pool of MediaPipe pose estimators, which is safe to share between threads.
+    '''
+    def __init__(self, size: int, model_complexity: int = 0, segmentation: bool = False) -> None:
+        '''
+        Load and warm up the pool's estimators.
+
+        Args:
+            size: number of estimators, i.e. how many can be in use at once.
+            model_complexity: MediaPipe pose model complexity, 0 (fastest), 1 or 2.
+            segmentation: whether estimators also produce segmentation masks.
+        '''
+        # Imported here so that processes which never rerun pose estimation never load MediaPipe
+        import mediapipe as mp
+
+        self.size = size
+        self.model_complexity = model_complexity
+        self.segmentation = segmentation
+        self.estimators = []
+        self.free = queue.LifoQueue()
+        self.lock = threading.Lock()
+        self.created = time.monotonic()
+        self.borrows = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.busy_seconds = 0.0
+        self.in_use = 0
+
+        blank = np.zeros((64, 64, 3), dtype=np.uint8)
+        for _ in range(size):
+            pose = mp.solutions.pose.Pose(
+                static_image_mode=True,
+                model_complexity=model_complexity,
+                enable_segmentation=segmentation,
+                min_detection_confidence=0.5)
+            # The first call to process() initialises the model's graph, so is much slower
+            pose.process(blank)
+            self.estimators.append(pose)
+            self.free.put(pose)
+
+
+    @contextmanager
+    def borrow(self, timeout: float = None):
+        '''
+        Context manager that borrows an estimator for the duration of a with block,
+        waiting for one to become free if they are all in use.
+
+        Args:
+            timeout: maximum number of seconds to wait, or None to wait for as long as it takes.
+
+        Raises:
+            PoolTimeout: if no estimator became free within timeout seconds.
+        '''
+        start = time.monotonic()
+        try:
+            pose = self.free.get(timeout=timeout)
+        except queue.Empty:
+            with self.lock:
+                self.timeouts += 1
+            raise PoolTimeout(f"no pose estimator became free within {timeout} seconds")
+
+        borrowed = time.monotonic()
+        with self.lock:
+            self.borrows += 1
+            self.in_use += 1
+            self.wait_seconds += borrowed - start
+            self.max_wait_seconds = max(self.max_wait_seconds, borrowed - start)
+        try:
+            yield pose
+        finally:
+            with self.lock:
+                self.in_use -= 1
+                self.busy_seconds += time.monotonic() - borrowed
+            self.free.put(pose)
+
+
+    def stats(self) -> dict:
+        '''
+        Return wait time and utilisation metrics for the pool, where utilisation is the
+        fraction of the estimators' lifetime that they have spent borrowed.
+        '''
+        with self.lock:
+            uptime = time.monotonic() - self.created
+            return {
+                'size': self.size,
+                'model_complexity': self.model_complexity,
+                'segmentation': self.segmentation,
+                'in_use': self.in_use,
+                'borrows': self.borrows,
+                'timeouts': self.timeouts,
+                'mean_wait_seconds': self.wait_seconds / self.borrows if self.borrows else 0.0,
+                'max_wait_seconds': self.max_wait_seconds,
+                'utilisation': self.busy_seconds / (self.size * uptime) if self.size and uptime else 0.0,
+            }
+
+
+    def close(self) -> None:
+        '''
+        Release the pool's estimators. The pool must not be used afterwards.
+        '''
+        for pose in self.estimators:
+            pose.close()
+        self.estimators = []
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pose_pool() -> PosePool:
+    '''
+    Return the pose estimator pool shared by the whole process, configured by the POSE_POOL_* settings.
+    '''
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = PosePool(
+                    settings.POSE_POOL_SIZE,
+                    settings.POSE_POOL_MODEL_COMPLEXITY,
+                    settings.POSE_POOL_SEGMENTATION
+                )
+    return _pool
+
+
+def get_pose_pool_stats() -> dict:
+    '''
+    Return the stats of this process's pool, or None if it hasn't been used (so isn't loaded).
+    '''
+    return None if _pool is None else _pool.stats()
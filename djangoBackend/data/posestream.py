@@ -0,0 +1,205 @@
+'''
+Streaming of pose data over a WebSocket, served by the ASGI application (see connectedhealth/asgi.py).
+
+Rather than posting a batch of poses every second, a client keeps one connection open for a
+session and sends chunks of poses as they are produced:
+    client: {"type": "hello", "sid": ...}         identifies the session, once per connection
+    server: {"type": "ready", "credit": n}        the client may send n chunks
+    client: a chunk, as JSON text {"clip_num": ..., "seq": ..., "poses": [...]} or a binary msgpack
+            map {"clip_num": ..., "seq": ..., "timestamps": [...], "keypoints": <bin>} (see data.wire)
+    server: {"type": "ack", "clip_num": ..., "seq": ..., "duplicate": ..., "credit": 1} once the
+            chunk is stored,
+            {"type": "closed", "clip_num": ..., "seq": ..., "credit": 1} if its clip was already
+            closed, so it will never be stored, or
+            {"type": "error", "clip_num": ..., "seq": ..., "message": ..., "credit": 1} if it can't
+            be stored now, and should be sent again
+
+Chunks are numbered and stored as those posted to poses_chunk_upload are, so a client can fall back
+to that endpoint and resend unacknowledged chunks without any being stored twice. Each chunk names
+the clip it was recorded in, so chunks still being stored once the client has moved on (even after
+it disconnects) go to the right clip.
+
+Backpressure is credit-based: each chunk uses one credit, which is only given back once the chunk is
+stored, so a client never has more than settings.POSE_STREAM_CREDIT chunks waiting on the server.
+A client without credit keeps adding poses to its next chunk, so it sends fewer, larger chunks until
+the server catches up. Sending a chunk without credit closes the connection.
+'''
+
+import json
+import asyncio
+from asgiref.sync import ThreadSensitiveContext, sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http.request import split_domain_port, validate_host
+from .models import Session
+import data.datastore.chunkmeta as cm
+import data.wire as wire
+
+PATH = "/data/poses/stream/"
+
+# Close codes
+POLICY_VIOLATION = 1008
+SESSION_NOT_FOUND = 4404
+
+
+class PoseStream:
+    '''
+    A single pose streaming connection, as an ASGI application.
+    '''
+    def __init__(self, scope: dict, receive, send) -> None:
+        '''
+        Args:
+            scope (dict)    - the ASGI connection scope
+            receive, send   - the ASGI receive and send callables of the connection
+        '''
+        self.scope = scope
+        self.receive = receive
+        self.send = send
+        self.sid = None
+        self.chunks = asyncio.Queue()
+        self.outstanding = 0
+        self.connected = False
+
+
+    async def run(self) -> None:
+        '''
+        Accept the connection, identify its session and store the chunks it sends until it is closed.
+        '''
+        if (await self.receive())['type'] != 'websocket.connect':
+            return
+        if not self.valid_host():
+            # Closing before accepting rejects the handshake
+            await self.send({'type': 'websocket.close', 'code': POLICY_VIOLATION})
+            return
+        await self.send({'type': 'websocket.accept'})
+        self.connected = True
+
+        # Database and file work for this connection runs in a thread of its own, as a request's does
+        async with ThreadSensitiveContext():
+            try:
+                if await self.hello():
+                    await self.stream()
+            finally:
+                await sync_to_async(close_old_connections)()
+
+
+    async def hello(self) -> bool:
+        '''
+        Receive the hello message identifying the session, and give the client its credit.
+
+        Returns:
+            True if the session exists, False if the connection was closed.
+        '''
+        message = await self.receive()
+        if message['type'] == 'websocket.disconnect':
+            self.connected = False
+            return False
+        try:
+            hello = json.loads(message.get('text') or message.get('bytes') or '')
+            if hello['type'] != 'hello':
+                raise ValueError("expected a hello message")
+            self.sid = str(hello['sid'])
+        except (ValueError, KeyError, TypeError):
+            await self.close(POLICY_VIOLATION, "expected a hello message with the session id")
+            return False
+
+        if not await sync_to_async(Session.objects.filter(id=self.sid).exists)():
+            await self.close(SESSION_NOT_FOUND, "session with this id does not exist")
+            return False
+        await self.send_json({'type': 'ready', 'credit': settings.POSE_STREAM_CREDIT})
+        return True
+
+
+    async def stream(self) -> None:
+        '''
+        Receive chunks until the connection is closed, storing each in turn. Chunks are received while
+        earlier ones are being stored, up to the client's credit.
+        '''
+        storing = asyncio.create_task(self.store_chunks())
+        try:
+            while True:
+                message = await self.receive()
+                if message['type'] == 'websocket.disconnect':
+                    self.connected = False
+                    break
+                if self.outstanding >= settings.POSE_STREAM_CREDIT:
+                    await self.close(POLICY_VIOLATION, "chunk sent without credit")
+                    break
+                self.outstanding += 1
+                self.chunks.put_nowait(message)
+        finally:
+            # Chunks that were received are still stored, even if they can no longer be acknowledged
+            self.chunks.put_nowait(None)
+            await storing
+
+
+    async def store_chunks(self) -> None:
+        '''
+        Store received chunks in order, acknowledging each and giving back its credit.
+        '''
+        while (message := await self.chunks.get()) is not None:
+            reply = await sync_to_async(self.store_chunk)(message)
+            self.outstanding -= 1
+            if self.connected:
+                await self.send_json({**reply, 'credit': 1})
+
+
+    def store_chunk(self, message: dict) -> dict:
+        '''
+        Decode and store a chunk received on the connection.
+
+        Returns:
+            The reply to send for the chunk, without its credit.
+        '''
+        clip_num = seq = None
+        try:
+            if message.get('bytes') is not None:
+                fields, timestamps, keypoints = wire.decode_msgpack(message['bytes'])
+            else:
+                fields, timestamps, keypoints = wire.decode_json(message.get('text') or '')
+            clip_num = int(fields['clip_num'])
+            seq = int(fields['seq'])
+            if seq < 0:
+                raise ValueError("seq must not be negative")
+        except (ValueError, KeyError, TypeError):
+            return {'type': 'error', 'clip_num': clip_num, 'seq': seq, 'message': "expected clip_num, seq and poses"}
+
+        try:
+            stored = cm.store_chunk(self.sid, clip_num, seq, timestamps, keypoints)
+        except cm.ClipClosed:
+            return {'type': 'closed', 'clip_num': clip_num, 'seq': seq}
+        except Exception as e:
+            print(f"could not store streamed chunk {seq} of clip {clip_num} for session with sid '{self.sid}': {e}")
+            return {'type': 'error', 'clip_num': clip_num, 'seq': seq, 'message': "could not store chunk"}
+        return {'type': 'ack', 'clip_num': clip_num, 'seq': seq, 'duplicate': not stored}
+
+
+    async def send_json(self, data: dict) -> None:
+        '''
+        Send a JSON text message.
+        '''
+        await self.send({'type': 'websocket.send', 'text': json.dumps(data)})
+
+
+    async def close(self, code: int, reason: str) -> None:
+        '''
+        Close the connection.
+        '''
+        self.connected = False
+        await self.send({'type': 'websocket.close', 'code': code, 'reason': reason})
+
+
+    def valid_host(self) -> bool:
+        '''
+        Return whether the connection's Host header is one of settings.ALLOWED_HOSTS, as Django checks for requests.
+        '''
+        headers = dict(self.scope.get('headers', []))
+        domain, _ = split_domain_port(headers.get(b'host', b'').decode('latin-1'))
+        return bool(domain) and validate_host(domain, settings.ALLOWED_HOSTS)
+
+
+async def pose_stream(scope: dict, receive, send) -> None:
+    '''
+    ASGI application for pose streaming connections.
+    '''
+    await PoseStream(scope, receive, send).run()
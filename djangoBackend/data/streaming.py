@@ -0,0 +1,70 @@
+'''
+Serving of (large) files, such as rendered visualisation videos, with support for HTTP Range
+requests, so that video players can seek without downloading the whole file first.
+'''
+
+import os
+import re
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from rest_framework import status
+
+# Size of the pieces a range of a file is sent in.
+CHUNK_SIZE = 64 * 1024
+
+# A single byte range, e.g. "bytes=0-499", "bytes=500-" or "bytes=-500" (the last 500 bytes).
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def ranged_file_response(request, path: str, content_type: str) -> HttpResponse:
+    '''
+    Return a response with the contents of a file, or the part of it requested by the request's
+    Range header. Requests for multiple ranges, or with a malformed Range header, get the whole file.
+
+    Args:
+        request: the request being responded to.
+        path: path to the file.
+        content_type: content type of the file.
+    '''
+    size = os.path.getsize(path)
+    match = RANGE_RE.match(request.headers.get('Range', '').strip())
+    if match is None or match.groups() == ('', ''):
+        response = FileResponse(open(path, 'rb'), content_type=content_type)
+        response['Accept-Ranges'] = 'bytes'
+        return response
+
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        # Suffix range, the last N bytes of the file
+        start = max(size - int(last), 0)
+        end = size - 1 if int(last) else -1
+
+    if start > end:
+        response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        response['Content-Range'] = f"bytes */{size}"
+        return response
+
+    f = open(path, 'rb')
+    f.seek(start)
+    response = StreamingHttpResponse(_read_range(f, end - start + 1), status=status.HTTP_206_PARTIAL_CONTENT, content_type=content_type)
+    response['Content-Range'] = f"bytes {start}-{end}/{size}"
+    response['Content-Length'] = str(end - start + 1)
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def _read_range(f, length: int):
+    '''
+    Yield the next length bytes of a file in chunks, closing the file afterwards.
+    '''
+    try:
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
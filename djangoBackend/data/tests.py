@@ -0,0 +1,708 @@
+import io
+import importlib
+import os
+import json
+import tempfile
+import threading
+import time
+import numpy as np
+from unittest import mock
+from asgiref.sync import sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from datetime import datetime, timedelta
+from django.apps import apps
+from django.conf import settings
+from django.db import connection
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import AsyncClient, Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from data.models import Session, InvolvedIn, UploadEvent, UploadJob, Clip, User
+import data.datastore.sessionmeta as sm
+import data.datastore.uploadlog as uploadlog
+import data.datastore.poseformat as poseformat
+import data.wire as wire
+import data.uploadqueue as uploadqueue
+from data.datastore.posestore import PoseStore
+from data.visualise import align_poses, pose_video_times
+from connectedhealth.asgi import application
+
+import_upload_log = importlib.import_module('data.migrations.0015_import_upload_log').import_upload_log
+
+
+
+def make_poses(num_frames, start=0):
+    '''
+    Return (timestamps, keypoints) for num_frames frames, with every keypoint value of a frame equal to its timestamp.
+    '''
+    timestamps = np.arange(start, start + num_frames, dtype=poseformat.TIMESTAMP_DTYPE)
+    keypoints = np.broadcast_to(timestamps[:, None, None], (num_frames,) + poseformat.FRAME_SHAPE)
+    return timestamps, keypoints.astype(poseformat.KEYPOINT_DTYPE)
+
+
+class PoseFormatTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.kp_path = os.path.join(self.directory.name, 'clip' + poseformat.KEYPOINTS_EXT)
+        self.ts_path = os.path.join(self.directory.name, 'clip' + poseformat.TIMESTAMPS_EXT)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_appended_frames_are_read_back(self):
+        self.assertEqual(poseformat.read(self.kp_path, self.ts_path)[0].shape, (0,))
+        poseformat.append(self.kp_path, self.ts_path, *make_poses(3))
+        poseformat.append(self.kp_path, self.ts_path, *make_poses(2, start=3))
+
+        timestamps, keypoints = poseformat.read(self.kp_path, self.ts_path)
+        np.testing.assert_array_equal(timestamps, np.arange(5))
+        np.testing.assert_array_equal(keypoints, make_poses(5)[1])
+        mapped_timestamps, mapped_keypoints = poseformat.map_columns(self.kp_path, self.ts_path)
+        np.testing.assert_array_equal(mapped_timestamps, timestamps)
+        np.testing.assert_array_equal(mapped_keypoints, keypoints)
+
+    def test_append_rejects_mismatched_frames(self):
+        timestamps, keypoints = make_poses(3)
+        with self.assertRaises(ValueError):
+            poseformat.append(self.kp_path, self.ts_path, timestamps[:2], keypoints)
+
+    def test_partial_frame_is_dropped_by_next_append(self):
+        poseformat.append(self.kp_path, self.ts_path, *make_poses(2))
+        # An append cut short after writing part of a frame's keypoints, and none of its timestamp
+        with open(self.kp_path, 'ab') as f:
+            f.write(b'\0' * (poseformat.FRAME_NBYTES + 12))
+        self.assertEqual(poseformat.num_frames(self.kp_path, self.ts_path), 2)
+
+        poseformat.append(self.kp_path, self.ts_path, *make_poses(2, start=2))
+        timestamps, keypoints = poseformat.read(self.kp_path, self.ts_path)
+        np.testing.assert_array_equal(timestamps, np.arange(4))
+        np.testing.assert_array_equal(keypoints, make_poses(4)[1])
+        self.assertEqual(os.path.getsize(self.kp_path), 4 * poseformat.FRAME_NBYTES)
+
+    def test_concurrent_appends_keep_frames_paired(self):
+        num_threads = 8
+        appends = 20
+
+        def append(thread):
+            for i in range(appends):
+                poseformat.append(self.kp_path, self.ts_path, *make_poses(3, start=(thread * appends + i) * 3))
+
+        threads = [threading.Thread(target=append, args=(thread,)) for thread in range(num_threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        timestamps, keypoints = poseformat.read(self.kp_path, self.ts_path)
+        self.assertEqual(len(timestamps), num_threads * appends * 3)
+        np.testing.assert_array_equal(np.sort(timestamps), np.arange(len(timestamps)))
+        np.testing.assert_array_equal(keypoints[:, 0, 0], timestamps)
+
+    def test_blob_round_trip(self):
+        timestamps, keypoints = make_poses(4)
+        blob = poseformat.pack(timestamps, keypoints)
+        unpacked_timestamps, unpacked_keypoints = poseformat.unpack(blob)
+        np.testing.assert_array_equal(unpacked_timestamps, timestamps)
+        np.testing.assert_array_equal(unpacked_keypoints, keypoints)
+
+        path = os.path.join(self.directory.name, 'clip' + poseformat.BLOB_EXT)
+        with open(path, 'wb') as f:
+            f.write(blob)
+        np.testing.assert_array_equal(poseformat.map_blob(path)[1], keypoints)
+
+        with self.assertRaises(ValueError):
+            poseformat.unpack(blob[:-1])
+        with self.assertRaises(ValueError):
+            poseformat.unpack(b'XXXX' + blob[4:])
+
+    def test_out_of_order_chunks_are_read_in_capture_order(self):
+        with override_settings(LOCAL_POSES_DIR=self.directory.name):
+            pose_store = PoseStore('sid', 1)
+            pose_store.append(*make_poses(3, start=3))
+            timestamps, keypoints = make_poses(3)
+            timestamps[1] = poseformat.MISSING_TIMESTAMP
+            pose_store.append(timestamps, keypoints)
+            poses = pose_store.reader()
+
+        # The frame without a timestamp stays after the frame received before it
+        np.testing.assert_array_equal(poses.timestamps(), [0, -1, 2, 3, 4, 5])
+        np.testing.assert_array_equal(poses.keypoints()[:, 0, 0], [0, 1, 2, 3, 4, 5])
+        np.testing.assert_array_equal(pose_video_times(poses), [0, 0.001, 0.002, 0.003, 0.004, 0.005])
+        pose_times, xy = align_poses(poses)
+        np.testing.assert_array_equal(pose_times, [0, 2, 3, 4, 5])
+        # Readers already in order are returned as they are
+        self.assertIs(poses.in_capture_order(), poses)
+
+    def test_json_conversion(self):
+        timestamps, keypoints = make_poses(3)
+        timestamps[1] = poseformat.MISSING_TIMESTAMP
+        poses = poseformat.to_dicts(timestamps, keypoints)
+        self.assertIsNone(poses[1]['timestamp'])
+        converted_timestamps, converted_keypoints = poseformat.from_dicts(poses)
+        np.testing.assert_array_equal(converted_timestamps, timestamps)
+        np.testing.assert_array_equal(converted_keypoints, keypoints)
+
+        with override_settings(LOCAL_POSES_DIR=self.directory.name):
+            pose_store = PoseStore('sid', 1)
+            with open(pose_store.get_path('.json'), 'w') as f:
+                json.dump(poses, f)
+            self.assertTrue(pose_store.convert_json())
+            # Already converted
+            self.assertFalse(pose_store.convert_json())
+            np.testing.assert_array_equal(pose_store.read_locally()[1], keypoints)
+
+
+class ClipAllocationTests(TransactionTestCase):
+    def setUp(self):
+        Session.objects.create(id='session', name='', date=datetime.now(), description='')
+
+    def test_concurrent_allocations_get_distinct_clip_numbers(self):
+        num_threads = 16
+        allocations = 5
+        barrier = threading.Barrier(num_threads)
+        allocated = []
+        errors = []
+
+        def allocate():
+            try:
+                # Start every thread's allocations at once, so they overlap
+                barrier.wait()
+                for _ in range(allocations):
+                    allocated.append(sm.allocate_clip_num('session'))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=allocate) for _ in range(num_threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(allocated), list(range(1, num_threads * allocations + 1)))
+        self.assertEqual(sm.get_clip_num('session'), num_threads * allocations + 1)
+
+    def test_concurrent_allocations_without_update_returning(self):
+        # Databases without UPDATE ... RETURNING (e.g. MySQL) increment and read back in a transaction
+        with mock.patch.object(sm, '_can_update_returning', return_value=False):
+            self.test_concurrent_allocations_get_distinct_clip_numbers()
+
+    def test_read_interleaved_with_allocation(self):
+        # An allocation landing between a read's query and its return must still be seen by later reads
+        values_list = Session.objects.values_list
+        allocated = []
+
+        def read_then_allocate(*args, **kwargs):
+            queryset = values_list(*args, **kwargs)
+            get = queryset.get
+
+            def get_then_allocate(*args, **kwargs):
+                clip_num = get(*args, **kwargs)
+                if not allocated:
+                    allocated.append(sm.allocate_clip_num('session'))
+                return clip_num
+
+            queryset.get = get_then_allocate
+            return queryset
+
+        with mock.patch.object(Session.objects, 'values_list', side_effect=read_then_allocate):
+            self.assertEqual(sm.get_clip_num('session'), 1)
+        self.assertEqual(allocated, [1])
+        self.assertEqual(sm.get_clip_num('session'), 2)
+
+        sm.close_clip('session', 2)
+        self.assertEqual(sm.get_clip_num('session'), 3)
+
+    def test_missing_session(self):
+        with self.assertRaises(Session.DoesNotExist):
+            sm.allocate_clip_num('missing')
+        with self.assertRaises(Session.DoesNotExist):
+            sm.get_clip_num('missing')
+
+
+class UploadLogTests(TestCase):
+    def setUp(self):
+        # Leave out the events imported from upload_log.txt by the migrations
+        UploadEvent.objects.all().delete()
+
+    def log_patients(self):
+        for patient in range(3):
+            user = User.objects.create(id=f"uid{patient}", first_name='Patient', last_name=str(patient))
+            uploadlog.log_user(f"uid{patient}", 'Patient', str(patient))
+            session = Session.objects.create(id=f"sid{patient}", name='Session', date=datetime.now(), description='')
+            InvolvedIn.objects.create(id=f"involved{patient}", user=user, session=session)
+            uploadlog.log_session(f"sid{patient}", 'Session', '', f"uid{patient}")
+            uploadlog.log_clip(f"sid{patient}", 1)
+
+    @override_settings(UPLOAD_LOG_MAX_EVENTS=4)
+    def test_log_is_capped(self):
+        self.log_patients()
+        self.assertEqual(UploadEvent.objects.count(), 4)
+        self.assertEqual(
+            [event.message for event in uploadlog.get_events(limit=2)],
+            ['===== Uploaded Clip: 1 ======', 'Session Name: Session\nSession Description: \nsid: sid2']
+        )
+
+    def test_events_are_filtered_by_session_and_patient(self):
+        self.log_patients()
+        events = uploadlog.get_events(patient='Patient 1')
+        self.assertEqual([event.kind for event in events], [UploadEvent.CLIP, UploadEvent.SESSION, UploadEvent.USER])
+        self.assertTrue(all(event.uid == 'uid1' for event in events))
+        self.assertEqual([event.clip_num for event in uploadlog.get_events(sid='sid2')], [1, None])
+
+    @override_settings(UPLOAD_LOG_PAGE_SIZE=2)
+    def test_show_log_pages(self):
+        self.log_patients()
+        client = Client(HTTP_HOST='192.168.0.150')
+
+        first = client.get('/data/logs/', {'patient': 'Patient 0'})
+        self.assertEqual(len(first.context['events']), 2)
+        self.assertEqual(first.context['next_query'], 'patient=Patient+0&page=2')
+        self.assertIsNone(first.context['previous_query'])
+
+        second = client.get('/data/logs/', {'patient': 'Patient 0', 'page': 2})
+        self.assertEqual([event.kind for event in second.context['events']], [UploadEvent.USER])
+        self.assertIsNone(second.context['next_query'])
+
+    def test_session_is_logged_with_the_patient_given(self):
+        self.log_patients()
+        client = Client(HTTP_HOST='192.168.0.150')
+        for uid, patient in (('uid0', 'Patient 0'), (None, ''), ('missing', '')):
+            body = {'session': {'name': 'Session', 'description': ''}}
+            if uid:
+                body['uid'] = uid
+            sid = client.post('/data/session/init/', body, content_type='application/json').json()['sid']
+            self.assertEqual(uploadlog.get_events(sid=sid)[0].patient, patient)
+
+    @override_settings(UPLOAD_LOG_MAX_EVENTS=2)
+    def test_clips_are_logged_with_the_patient_after_the_session_is_dropped(self):
+        User.objects.create(id='uid0', first_name='Patient', last_name='0')
+        client = Client(HTTP_HOST='192.168.0.150')
+        body = {'session': {'name': 'Session', 'description': ''}, 'uid': 'uid0'}
+        sid = client.post('/data/session/init/', body, content_type='application/json').json()['sid']
+        for clip_num in range(1, 4):
+            uploadlog.log_clip(sid, clip_num)
+
+        events = uploadlog.get_events(sid=sid)
+        self.assertEqual([event.clip_num for event in events], [3, 2])
+        self.assertTrue(all(event.uid == 'uid0' and event.patient == 'Patient 0' for event in events))
+
+    def test_upload_log_file_is_imported(self):
+        uploadlog.log_user('uid-new', 'New', 'Patient')
+        with tempfile.NamedTemporaryFile('w', suffix='.txt') as f:
+            f.write(
+                "\n\n\nPatient: Old Patient\nuid: uid-old\n"
+                "Session Name: Elbow\nSession Description: elbow\nsid: sid-old\n"
+                "===== Uploaded Clip: 1 =========== Uploaded Clip: 2 ======"
+            )
+            f.flush()
+            import_upload_log(apps, None, f.name)
+
+        events = uploadlog.get_events(limit=10)
+        self.assertEqual([event.kind for event in events], ['user', 'clip', 'clip', 'session', 'user'])
+        self.assertEqual(events[0].uid, 'uid-new')
+        self.assertEqual([event.clip_num for event in events[1:3]], [2, 1])
+        self.assertTrue(all(event.sid == 'sid-old' and event.patient == 'Old Patient' for event in events[1:4]))
+        self.assertEqual(events[3].message, 'Session Name: Elbow\nSession Description: elbow\nsid: sid-old')
+        self.assertEqual(events[4].message, 'Patient: Old Patient\nuid: uid-old')
+
+
+class UploadQueueTests(TransactionTestCase):
+    def setUp(self):
+        Session.objects.create(id='queue-session', name='', date=datetime.now(), description='')
+        self.directory = tempfile.TemporaryDirectory()
+        self.settings = override_settings(
+            LOCAL_POSES_DIR=self.directory.name,
+            UPLOAD_SPOOL_DIR=self.directory.name,
+            UPLOAD_WORKERS_AUTOSTART=False
+        )
+        self.settings.enable()
+        # The clip's storage and rendering are stood in for by the mocks, each test sets how the video upload goes
+        self.patches = [
+            mock.patch('data.uploadqueue.PoseStore.write_to_cloud', return_value=0),
+            mock.patch('data.uploadqueue._catalog_clip'),
+            mock.patch('data.uploadqueue.store_2D_visualisation'),
+            mock.patch('data.uploadqueue.store_clip_angles'),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        self.settings.disable()
+        self.directory.cleanup()
+
+    def enqueue(self, clip_num=1):
+        return uploadqueue.enqueue('queue-session', clip_num, io.BytesIO(b'video'))
+
+    def test_jobs_are_claimed_once_in_order(self):
+        first = self.enqueue(1)
+        second = self.enqueue(2)
+        later = self.enqueue(3)
+        UploadJob.objects.filter(id=later.id).update(run_after=datetime.now() + timedelta(hours=1))
+
+        claimed = uploadqueue.claim_job()
+        self.assertEqual((claimed.id, claimed.status, claimed.attempts), (first.id, UploadJob.RUNNING, 1))
+        self.assertEqual(uploadqueue.claim_job().id, second.id)
+        self.assertIsNone(uploadqueue.claim_job())
+
+        # A job left running by a worker that stopped is claimed again once stale
+        UploadJob.objects.filter(id=first.id).update(updated=datetime.now() - timedelta(seconds=settings.UPLOAD_STALE_AFTER + 1))
+        claimed = uploadqueue.claim_job()
+        self.assertEqual((claimed.id, claimed.attempts), (first.id, 2))
+
+    @override_settings(UPLOAD_MAX_ATTEMPTS=2)
+    def test_stale_job_on_its_last_attempt_fails(self):
+        job = self.enqueue()
+        stale = datetime.now() - timedelta(seconds=settings.UPLOAD_STALE_AFTER + 1)
+        for attempts in (1, 2):
+            self.assertEqual(uploadqueue.claim_job().attempts, attempts)
+            # The worker stops without finishing the job
+            UploadJob.objects.filter(id=job.id).update(updated=stale)
+
+        self.assertIsNone(uploadqueue.claim_job())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (UploadJob.FAILED, 2))
+        self.assertEqual(job.error, "worker stopped during the last of 2 attempts")
+        self.assertEqual(Clip.objects.get(session_id='queue-session', clip_num=1).status, Clip.FAILED)
+        self.assertFalse(os.path.exists(job.video_path))
+
+    @override_settings(UPLOAD_MAX_ATTEMPTS=3, UPLOAD_RETRY_DELAY=5)
+    def test_failed_uploads_are_retried_with_backoff(self):
+        job = self.enqueue()
+        with mock.patch('data.uploadqueue.VideoStore.write', side_effect=OSError("storage unavailable")):
+            for attempt, delay in ((1, 5), (2, 10)):
+                before = datetime.now()
+                uploadqueue.run_job(uploadqueue.claim_job())
+                job.refresh_from_db()
+                self.assertEqual((job.status, job.attempts), (UploadJob.PENDING, attempt))
+                self.assertEqual(job.error, "OSError: storage unavailable")
+                self.assertGreaterEqual(job.run_after, before + timedelta(seconds=delay))
+                self.assertLessEqual(job.run_after, datetime.now() + timedelta(seconds=delay))
+                # Not due again until the delay has passed
+                self.assertIsNone(uploadqueue.claim_job())
+                UploadJob.objects.filter(id=job.id).update(run_after=datetime.now())
+
+            uploadqueue.run_job(uploadqueue.claim_job())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (UploadJob.FAILED, 3))
+        self.assertEqual(Clip.objects.get(session_id='queue-session', clip_num=1).status, Clip.FAILED)
+        self.assertFalse(os.path.exists(job.video_path))
+
+    @override_settings(UPLOAD_STALE_AFTER=0.5, UPLOAD_HEARTBEAT_INTERVAL=0.1)
+    def test_long_steps_keep_the_job_claimed(self):
+        job = self.enqueue()
+        claims = []
+
+        def slow_write(f):
+            # Another worker looks for work while the upload takes longer than UPLOAD_STALE_AFTER
+            time.sleep(1)
+            claims.append(uploadqueue.claim_job())
+
+        with mock.patch('data.uploadqueue.VideoStore.write', side_effect=slow_write):
+            uploadqueue.run_job(uploadqueue.claim_job())
+        self.assertEqual(claims, [None])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.progress), (UploadJob.DONE, 1, 100))
+        self.assertFalse(os.path.exists(job.video_path))
+
+    def test_job_claimed_again_is_left_to_its_new_worker(self):
+        job = self.enqueue()
+
+        def reclaimed_write(f):
+            # The job is taken for stale and claimed by another worker while this one uploads it
+            UploadJob.objects.filter(id=job.id).update(updated=datetime.now() - timedelta(seconds=settings.UPLOAD_STALE_AFTER + 1))
+            self.assertIsNotNone(uploadqueue.claim_job())
+
+        with mock.patch('data.uploadqueue.VideoStore.write', side_effect=reclaimed_write):
+            uploadqueue.run_job(uploadqueue.claim_job())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.progress), (UploadJob.RUNNING, 2, 0))
+        # The new worker still needs the spooled video
+        self.assertTrue(os.path.exists(job.video_path))
+
+
+class UploadViewTests(TestCase):
+    def setUp(self):
+        Session.objects.create(id='upload-session', name='', date=datetime.now(), description='')
+        self.directory = tempfile.TemporaryDirectory()
+        self.settings = override_settings(
+            LOCAL_POSES_DIR=self.directory.name,
+            UPLOAD_SPOOL_DIR=self.directory.name,
+            UPLOAD_WORKERS_AUTOSTART=False
+        )
+        self.settings.enable()
+        self.client = Client(HTTP_HOST='192.168.0.150')
+
+    def tearDown(self):
+        self.settings.disable()
+        self.directory.cleanup()
+
+    def test_poses_upload_stores_poses(self):
+        timestamps, keypoints = make_poses(10)
+        result = self.client.post(
+            '/data/poses/upload/',
+            wire.encode_msgpack({'sid': 'upload-session'}, timestamps, keypoints),
+            content_type='application/msgpack'
+        )
+        self.assertEqual(result.status_code, 200)
+        stored_timestamps, stored_keypoints = PoseStore('upload-session', 1).read_locally()
+        np.testing.assert_array_equal(stored_timestamps, timestamps)
+        np.testing.assert_array_equal(stored_keypoints, keypoints)
+
+        result = self.client.post('/data/poses/upload/', 'not json', content_type='application/json')
+        self.assertEqual(result.status_code, 400)
+        for poses in ([1, 2], [{'timestamp': [1]}]):
+            result = self.client.post('/data/poses/upload/', {'sid': 'upload-session', 'poses': poses}, content_type='application/json')
+            self.assertEqual(result.status_code, 400)
+        result = self.client.post(
+            '/data/poses/upload/',
+            wire.encode_msgpack({'sid': 'missing'}, timestamps, keypoints),
+            content_type='application/msgpack'
+        )
+        self.assertEqual(result.status_code, 404)
+
+    def test_video_upload_queues_clip(self):
+        result = self.client.post('/data/video/upload/', {
+            'sid': 'upload-session',
+            'video': SimpleUploadedFile('clip.MOV', b'video')
+        })
+        self.assertEqual(result.status_code, 202)
+
+        job = UploadJob.objects.get(id=result.json()['job_id'])
+        self.assertEqual(job.clip_num, 1)
+        with open(job.video_path, 'rb') as f:
+            self.assertEqual(f.read(), b'video')
+        self.assertEqual(Clip.objects.get(session_id='upload-session', clip_num=1).video_bytes, 5)
+        self.assertEqual(sm.get_clip_num('upload-session'), 2)
+
+    def post_chunk(self, clip_num, seq, timestamps, keypoints):
+        return self.client.post(
+            '/data/poses/chunk/',
+            wire.encode_msgpack({'sid': 'upload-session', 'clip_num': clip_num, 'seq': seq}, timestamps, keypoints),
+            content_type='application/msgpack'
+        )
+
+    def test_chunks_are_stored_in_the_clients_clip(self):
+        timestamps, keypoints = make_poses(10)
+        result = self.post_chunk(1, 0, timestamps[:5], keypoints[:5])
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(result.json(), {'seq': 0, 'duplicate': False, 'next_seq': 1, 'missing': []})
+
+        # The video closes clip 1, after which its chunks are no longer stored
+        result = self.client.post('/data/video/upload/', {
+            'sid': 'upload-session',
+            'clip_num': 1,
+            'video': SimpleUploadedFile('clip.MOV', b'video')
+        })
+        self.assertEqual(result.status_code, 202)
+        self.assertEqual(result.json()['clip_num'], 1)
+        self.assertEqual(self.post_chunk(1, 1, timestamps[5:], keypoints[5:]).status_code, 409)
+        # A chunk received before the clip was closed is still acknowledged when resent
+        self.assertEqual(self.post_chunk(1, 0, timestamps[:5], keypoints[:5]).json()['duplicate'], True)
+
+        # Chunks of the next clip start their own sequence, even if they arrive before its video
+        result = self.post_chunk(2, 0, timestamps[5:], keypoints[5:])
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(result.json()['duplicate'], False)
+
+        stored_timestamps, _ = PoseStore('upload-session', 1).read_locally()
+        np.testing.assert_array_equal(stored_timestamps, timestamps[:5])
+        stored_timestamps, _ = PoseStore('upload-session', 2).read_locally()
+        np.testing.assert_array_equal(stored_timestamps, timestamps[5:])
+        self.assertEqual(sm.get_clip_num('upload-session'), 2)
+
+    def test_chunk_upload_requires_clip_num(self):
+        timestamps, keypoints = make_poses(1)
+        result = self.client.post(
+            '/data/poses/chunk/',
+            wire.encode_msgpack({'sid': 'upload-session', 'seq': 0}, timestamps, keypoints),
+            content_type='application/msgpack'
+        )
+        self.assertEqual(result.status_code, 400)
+
+
+class VisualiseViewTests(SimpleTestCase):
+    def setUp(self):
+        self.client = Client(HTTP_HOST='192.168.0.150')
+
+    def test_stored_overlay_is_played_without_fetching_the_clip(self):
+        with mock.patch('data.views.find_2D_visualisation_video', return_value=('overlay.mp4', 'video/mp4')), \
+                mock.patch('data.views.PoseStore.open') as open_poses, \
+                mock.patch('data.views.VideoStore.get') as get_video:
+            result = self.client.get('/data/visualise2D/', {'sid': 'session', 'clipNum': 1})
+        self.assertEqual(result.status_code, 200)
+        self.assertTrue(result.context['stored'])
+        open_poses.assert_not_called()
+        get_video.assert_not_called()
+
+    def test_clip_is_fetched_without_stored_overlay(self):
+        with mock.patch('data.views.find_2D_visualisation_video', return_value=None), \
+                mock.patch('data.views.PoseStore.open') as open_poses, \
+                mock.patch('data.views.VideoStore.get') as get_video:
+            result = self.client.get('/data/visualise2D/', {'sid': 'session', 'clipNum': 1})
+        self.assertEqual(result.status_code, 200)
+        self.assertFalse(result.context['stored'])
+        open_poses.assert_called_once_with('session', '1')
+        get_video.assert_called_once_with()
+
+
+class AsyncUploadTests(TransactionTestCase):
+    def setUp(self):
+        Session.objects.create(id='async-session', name='', date=datetime.now(), description='')
+        self.directory = tempfile.TemporaryDirectory()
+        self.settings = override_settings(
+            LOCAL_POSES_DIR=self.directory.name,
+            UPLOAD_SPOOL_DIR=self.directory.name,
+            UPLOAD_WORKERS_AUTOSTART=False
+        )
+        self.settings.enable()
+        self.client = AsyncClient(HTTP_HOST='192.168.0.150')
+
+    def tearDown(self):
+        self.settings.disable()
+        self.directory.cleanup()
+
+    async def test_poses_upload_stores_poses(self):
+        timestamps, keypoints = make_poses(10)
+        result = await self.client.post(
+            '/data/poses/upload/async/',
+            wire.encode_msgpack({'sid': 'async-session'}, timestamps, keypoints),
+            content_type='application/msgpack'
+        )
+        self.assertEqual(result.status_code, 200)
+        stored_timestamps, stored_keypoints = PoseStore('async-session', 1).read_locally()
+        np.testing.assert_array_equal(stored_timestamps, timestamps)
+        np.testing.assert_array_equal(stored_keypoints, keypoints)
+
+        result = await self.client.post('/data/poses/upload/async/', 'not json', content_type='application/json')
+        self.assertEqual(result.status_code, 400)
+        result = await self.client.post(
+            '/data/poses/upload/async/',
+            wire.encode_msgpack({'sid': 'missing'}, timestamps, keypoints),
+            content_type='application/msgpack'
+        )
+        self.assertEqual(result.status_code, 404)
+
+    async def test_video_upload_queues_clip(self):
+        result = await self.client.post('/data/video/upload/async/', {
+            'sid': 'async-session',
+            'clip_num': 1,
+            'video': SimpleUploadedFile('clip.MOV', b'video')
+        })
+        self.assertEqual(result.status_code, 202)
+        self.assertEqual(result.json()['clip_num'], 1)
+
+        job = await UploadJob.objects.aget(id=result.json()['job_id'])
+        self.assertEqual(job.clip_num, 1)
+        with open(job.video_path, 'rb') as f:
+            self.assertEqual(f.read(), b'video')
+        self.assertEqual((await Clip.objects.aget(session_id='async-session', clip_num=1)).video_bytes, 5)
+        self.assertEqual(await sync_to_async(sm.get_clip_num)('async-session'), 2)
+
+        result = await self.client.post('/data/video/upload/async/', {
+            'sid': 'missing',
+            'video': SimpleUploadedFile('clip.MOV', b'video')
+        })
+        self.assertEqual(result.status_code, 404)
+
+
+class PoseStreamTests(TransactionTestCase):
+    def setUp(self):
+        Session.objects.create(id='stream-session', name='', date=datetime.now(), description='')
+        self.directory = tempfile.TemporaryDirectory()
+        self.settings = override_settings(LOCAL_POSES_DIR=self.directory.name)
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        self.directory.cleanup()
+
+    async def connect(self, sid='stream-session'):
+        communicator = ApplicationCommunicator(application, {
+            'type': 'websocket',
+            'path': '/data/poses/stream/',
+            'headers': [(b'host', b'192.168.0.150')],
+        })
+        await communicator.send_input({'type': 'websocket.connect'})
+        self.assertEqual((await communicator.receive_output())['type'], 'websocket.accept')
+        await communicator.send_input({'type': 'websocket.receive', 'text': json.dumps({'type': 'hello', 'sid': sid})})
+        return communicator
+
+    async def receive_json(self, communicator):
+        return json.loads((await communicator.receive_output(5))['text'])
+
+    def chunk(self, seq, timestamps, keypoints, clip_num=1):
+        return {
+            'type': 'websocket.receive',
+            'bytes': wire.encode_msgpack({'clip_num': clip_num, 'seq': seq}, timestamps, keypoints)
+        }
+
+    async def test_chunks_are_stored_and_acknowledged(self):
+        timestamps = np.arange(20, dtype=poseformat.TIMESTAMP_DTYPE)
+        keypoints = np.random.default_rng(0).random((20,) + poseformat.FRAME_SHAPE).astype(poseformat.KEYPOINT_DTYPE)
+        communicator = await self.connect()
+        self.assertEqual(await self.receive_json(communicator), {'type': 'ready', 'credit': 8})
+
+        await communicator.send_input(self.chunk(0, timestamps[:10], keypoints[:10]))
+        await communicator.send_input(self.chunk(1, timestamps[10:], keypoints[10:]))
+        # A resent chunk (e.g. after falling back to HTTP) is acknowledged, but not stored again
+        await communicator.send_input(self.chunk(0, timestamps[:10], keypoints[:10]))
+        await communicator.send_input({'type': 'websocket.receive', 'text': 'not json'})
+        await communicator.send_input({'type': 'websocket.receive', 'text': json.dumps({'clip_num': 1, 'seq': 2, 'poses': [1, 2]})})
+        replies = [await self.receive_json(communicator) for _ in range(5)]
+        self.assertEqual(replies, [
+            {'type': 'ack', 'clip_num': 1, 'seq': 0, 'duplicate': False, 'credit': 1},
+            {'type': 'ack', 'clip_num': 1, 'seq': 1, 'duplicate': False, 'credit': 1},
+            {'type': 'ack', 'clip_num': 1, 'seq': 0, 'duplicate': True, 'credit': 1},
+            {'type': 'error', 'clip_num': None, 'seq': None, 'message': 'expected clip_num, seq and poses', 'credit': 1},
+            {'type': 'error', 'clip_num': None, 'seq': None, 'message': 'expected clip_num, seq and poses', 'credit': 1},
+        ])
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait(5)
+
+        stored_timestamps, stored_keypoints = PoseStore('stream-session', 1).read_locally()
+        np.testing.assert_array_equal(stored_timestamps, timestamps)
+        np.testing.assert_array_equal(stored_keypoints, keypoints)
+
+    @override_settings(POSE_STREAM_CREDIT=1)
+    async def test_chunk_without_credit_closes_connection(self):
+        timestamps = np.arange(1, dtype=poseformat.TIMESTAMP_DTYPE)
+        keypoints = np.zeros((1,) + poseformat.FRAME_SHAPE, dtype=poseformat.KEYPOINT_DTYPE)
+        communicator = await self.connect()
+        self.assertEqual(await self.receive_json(communicator), {'type': 'ready', 'credit': 1})
+
+        # Store the first chunk slowly, so the second arrives before its credit is given back
+        with mock.patch('data.datastore.chunkmeta.store_chunk', side_effect=lambda *args: time.sleep(0.2) or True):
+            await communicator.send_input(self.chunk(0, timestamps, keypoints))
+            await communicator.send_input(self.chunk(1, timestamps, keypoints))
+            close = await communicator.receive_output(5)
+            self.assertEqual((close['type'], close['code']), ('websocket.close', 1008))
+            await communicator.wait(5)
+
+    async def test_chunks_are_stored_in_the_clients_clip(self):
+        timestamps, keypoints = make_poses(10)
+        await sync_to_async(sm.close_clip)('stream-session', 1)
+        communicator = await self.connect()
+        await self.receive_json(communicator)
+
+        await communicator.send_input(self.chunk(0, timestamps[:5], keypoints[:5], clip_num=1))
+        await communicator.send_input(self.chunk(0, timestamps[5:], keypoints[5:], clip_num=2))
+        replies = [await self.receive_json(communicator) for _ in range(2)]
+        self.assertEqual(replies, [
+            {'type': 'closed', 'clip_num': 1, 'seq': 0, 'credit': 1},
+            {'type': 'ack', 'clip_num': 2, 'seq': 0, 'duplicate': False, 'credit': 1},
+        ])
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait(5)
+
+        self.assertFalse(os.path.exists(PoseStore('stream-session', 1).get_path(poseformat.KEYPOINTS_EXT)))
+        stored_timestamps, _ = PoseStore('stream-session', 2).read_locally()
+        np.testing.assert_array_equal(stored_timestamps, timestamps[5:])
+
+    async def test_unknown_session_closes_connection(self):
+        communicator = await self.connect('missing')
+        close = await communicator.receive_output(5)
+        self.assertEqual((close['type'], close['code']), ('websocket.close', 4404))
+        await communicator.wait(5)
@@ -0,0 +1,344 @@
+'''
+Durable, database-backed queue of clip uploads, processed by a pool of background worker threads.
+
+A clip's video is spooled to a local file and an UploadJob is saved for it, so the request that
+received the video can return straight away. Workers upload the video and the clip's pose data
+to storage, retrying failed uploads with exponential backoff, then render and store the clip's
+overlay (see data.visualise.store_2D_visualisation) and joint angles (see
+chart.Visualise.store_clip_angles). Jobs survive a restart, as they are
+kept in the database; jobs left running by a stopped process are picked up again once stale.
+
+A worker keeps its running job from going stale with a heartbeat, and each claim of a job counts
+as an attempt, so a worker only records progress or an outcome for a job while the job's attempts
+are still its own: a job claimed again by another worker is left to that worker.
+
+Workers are started in the web server process on the first enqueue, or can be run in a separate
+process with "python manage.py run_upload_workers".
+'''
+
+import os
+import uuid
+import shutil
+import threading
+import traceback
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from .models import UploadJob, Clip
+import data.datastore.const as const
+import data.datastore.poseformat as poseformat
+from data.datastore.posestore import PoseStore
+from data.datastore.videostore import VideoStore
+from data.visualise import store_2D_visualisation, get_video_info
+from chart.Visualise import store_clip_angles
+
+_workers = []
+_workers_lock = threading.Lock()
+_wakeup = threading.Event()
+
+
+class JobLost(Exception):
+    '''Raised when a running job has been claimed again by another worker, having been taken for stale.'''
+    def __init__(self, job: UploadJob) -> None:
+        super().__init__(f"upload job '{job.id}' was claimed again by another worker")
+        self.job = job
+
+
+def enqueue(sid: str, clip_num: int, video) -> UploadJob:
+    '''
+    Spool a clip's video to a local file and queue the clip for upload.
+
+    Args:
+        sid: the id of the session.
+        clip_num: the clip number within this session.
+        video: the video data, as an uploaded file (or any readable binary file object).
+
+    Returns:
+        The new upload job.
+    '''
+    job_id, video_path = spool_video(video)
+    return queue_job(sid, clip_num, job_id, video_path)
+
+
+def spool_video(video) -> tuple:
+    '''
+    Copy a clip's video to a new file in settings.UPLOAD_SPOOL_DIR, the first half of enqueue.
+    Only touches the disk, so may run in any thread, e.g. away from the event loop of an async view.
+
+    Returns:
+        (job_id, video_path), the id for the clip's upload job and the path to the spooled video.
+    '''
+    job_id = str(uuid.uuid4())
+    os.makedirs(settings.UPLOAD_SPOOL_DIR, exist_ok=True)
+    video_path = os.path.join(settings.UPLOAD_SPOOL_DIR, f"{job_id}.MOV")
+    with open(video_path, "wb") as f:
+        if hasattr(video, 'chunks'):
+            for chunk in video.chunks():
+                f.write(chunk)
+        else:
+            shutil.copyfileobj(video, f)
+    return job_id, video_path
+
+
+def queue_job(sid: str, clip_num: int, job_id: str, video_path: str) -> UploadJob:
+    '''
+    Save the upload job for a video spooled by spool_video, add the clip to the catalog and wake up
+    the workers, the second half of enqueue.
+    '''
+    # One transaction, opened by a write: on SQLite a transaction that reads before writing (as
+    # update_or_create does on its own) fails at once, rather than waiting, if another upload is writing
+    with transaction.atomic():
+        job = UploadJob.objects.create(
+            id=job_id,
+            session_id=sid,
+            clip_num=clip_num,
+            video_path=video_path,
+            run_after=datetime.now()
+        )
+        Clip.objects.update_or_create(
+            session_id=sid,
+            clip_num=clip_num,
+            defaults={'status': Clip.UPLOADING, 'video_bytes': os.path.getsize(video_path)}
+        )
+
+    if settings.UPLOAD_WORKERS_AUTOSTART:
+        start_workers()
+    _wakeup.set()
+    return job
+
+
+def start_workers(num_workers: int = None) -> list:
+    '''
+    Start the pool of upload worker threads for this process, if it is not already running.
+
+    Args:
+        num_workers: size of the pool, settings.UPLOAD_WORKERS by default.
+
+    Returns:
+        The worker threads.
+    '''
+    with _workers_lock:
+        if not _workers:
+            for i in range(num_workers or settings.UPLOAD_WORKERS):
+                worker = threading.Thread(target=_work, name=f"upload-worker-{i}", daemon=True)
+                worker.start()
+                _workers.append(worker)
+        return list(_workers)
+
+
+def _work() -> None:
+    '''
+    Main loop of an upload worker: claim and run jobs, waiting for new ones when there are none.
+    '''
+    while True:
+        close_old_connections()
+        try:
+            job = claim_job()
+        except Exception:
+            traceback.print_exc()
+            job = None
+
+        if job is None:
+            _wakeup.wait(settings.UPLOAD_POLL_INTERVAL)
+            _wakeup.clear()
+        else:
+            run_job(job)
+
+
+def claim_job() -> UploadJob:
+    '''
+    Claim the oldest job that is due to run, so no other worker (in any process) runs it.
+    Jobs that have been running for longer than settings.UPLOAD_STALE_AFTER are assumed to
+    belong to a worker that stopped, and can be claimed again, unless that was their last
+    attempt, in which case they fail.
+
+    Returns:
+        The claimed job, or None if no job is due.
+    '''
+    now = datetime.now()
+    stale = UploadJob.objects.filter(
+        status=UploadJob.RUNNING,
+        updated__lt=now - timedelta(seconds=settings.UPLOAD_STALE_AFTER)
+    )
+    for job in stale.filter(attempts__gte=settings.UPLOAD_MAX_ATTEMPTS):
+        error = f"worker stopped during the last of {settings.UPLOAD_MAX_ATTEMPTS} attempts"
+        # Only one worker fails the job, and not if its worker has just shown it is still running
+        if stale.filter(id=job.id, attempts=job.attempts).update(status=UploadJob.FAILED, error=error, updated=now):
+            Clip.objects.filter(session_id=job.session_id, clip_num=job.clip_num).update(status=Clip.FAILED)
+            _remove_video(job)
+    stale.filter(attempts__lt=settings.UPLOAD_MAX_ATTEMPTS).update(status=UploadJob.PENDING, updated=now)
+
+    candidates = UploadJob.objects.filter(status=UploadJob.PENDING, run_after__lte=now).order_by('run_after')
+    for job in candidates[:10]:
+        # Only one worker can move a given job from pending to running
+        claimed = UploadJob.objects.filter(id=job.id, status=UploadJob.PENDING).update(
+            status=UploadJob.RUNNING,
+            attempts=job.attempts + 1,
+            updated=now
+        )
+        if claimed:
+            job.refresh_from_db()
+            return job
+    return None
+
+
+def run_job(job: UploadJob) -> None:
+    '''
+    Upload a clip's video and pose data and store its overlay and joint angles, then remove the spooled video.
+    On failure, the job is retried later with exponential backoff, up to settings.UPLOAD_MAX_ATTEMPTS times,
+    after which it fails and its spooled video is removed.
+
+    If the job is claimed again by another worker while it runs, it is left to that worker.
+    '''
+    try:
+        with _Heartbeat(job):
+            with open(job.video_path, "rb") as f:
+                VideoStore(job.session_id, job.clip_num).write(f)
+            _set_progress(job, 60)
+
+            pose_bytes = PoseStore(job.session_id, job.clip_num).write_to_cloud()
+            _catalog_clip(job, pose_bytes)
+            _set_progress(job, 80)
+
+            # The clip's data is safely stored by now, so a failure to render its overlay or calculate its angles
+            # doesn't fail the upload, they are made when the clip is first viewed instead.
+            try:
+                store_2D_visualisation(job.session_id, job.clip_num, job.video_path)
+            except Exception:
+                traceback.print_exc()
+            try:
+                store_clip_angles(job.session_id, str(job.clip_num))
+            except Exception:
+                traceback.print_exc()
+            _set_progress(job, 100)
+    except JobLost as e:
+        print(e)
+        return
+    except Exception as e:
+        traceback.print_exc()
+        error = f"{type(e).__name__}: {e}"
+        if job.attempts >= settings.UPLOAD_MAX_ATTEMPTS:
+            if _finish(job, status=UploadJob.FAILED, error=error):
+                Clip.objects.filter(session_id=job.session_id, clip_num=job.clip_num).update(status=Clip.FAILED)
+                _remove_video(job)
+        else:
+            delay = settings.UPLOAD_RETRY_DELAY * 2 ** (job.attempts - 1)
+            _finish(job, status=UploadJob.PENDING, error=error, run_after=datetime.now() + timedelta(seconds=delay))
+        return
+
+    if _finish(job, status=UploadJob.DONE, error=''):
+        _remove_video(job)
+        print(f"\nUpload Finished\nsid: {job.session_id}\nclip num: {job.clip_num}\n")
+
+
+def _catalog_clip(job: UploadJob, pose_bytes: int) -> None:
+    '''
+    Record an uploaded clip's metadata and where its data is stored in the clip catalog (see models.Clip).
+
+    Args:
+        job: the clip's upload job, whose video and pose data have been stored.
+        pose_bytes: the size of the stored pose data, in bytes.
+    '''
+    pose_store = PoseStore(job.session_id, job.clip_num)
+    video_store = VideoStore(job.session_id, job.clip_num)
+    try:
+        timestamps = pose_store.reader().timestamps()
+    except ValueError:
+        timestamps = poseformat.empty()[0]
+
+    # The video's length is used if it can be read, otherwise the time between the first and last pose
+    num_frames, fps = get_video_info(job.video_path)
+    valid = timestamps[timestamps != poseformat.MISSING_TIMESTAMP]
+    if num_frames and fps:
+        duration = num_frames / fps
+    elif len(valid):
+        duration = float(valid.max() - valid.min()) / 1000
+    else:
+        duration = None
+
+    Clip.objects.update_or_create(
+        session_id=job.session_id,
+        clip_num=job.clip_num,
+        defaults={
+            'frame_count': len(timestamps),
+            'duration': duration,
+            'fps': fps,
+            'pose_bytes': pose_bytes,
+            'video_bytes': os.path.getsize(job.video_path),
+            'pose_key': f"{const.AZ_POSES_CONTAINER_NAME}/{pose_store.get_blob_name()}",
+            'video_key': f"{const.AZ_VIDEOS_CONTAINER_NAME}/{video_store.get_name()}",
+            'status': Clip.STORED,
+        }
+    )
+
+
+def _set_progress(job: UploadJob, progress: int) -> None:
+    '''
+    Record the progress of a running job, which also marks it as not stale.
+
+    Raises:
+        JobLost: if the job has been claimed again by another worker.
+    '''
+    if not _finish(job, progress=progress):
+        raise JobLost(job)
+
+
+def _finish(job: UploadJob, **fields) -> bool:
+    '''
+    Update fields of a running job, as of this worker's claim of it, i.e. unless it has been claimed again since.
+
+    Returns:
+        True if the job was updated, False if it has been claimed again by another worker.
+    '''
+    for name, value in fields.items():
+        setattr(job, name, value)
+    job.updated = datetime.now()
+    return bool(_owned(job).update(**fields, updated=job.updated))
+
+
+def _owned(job: UploadJob):
+    '''
+    Return the job as a queryset, matching only while it is still running under this worker's claim of it.
+    '''
+    # Every claim counts an attempt, so the attempts identify the claim
+    return UploadJob.objects.filter(id=job.id, status=UploadJob.RUNNING, attempts=job.attempts)
+
+
+def _remove_video(job: UploadJob) -> None:
+    '''
+    Remove a finished job's spooled video.
+    '''
+    try:
+        os.remove(job.video_path)
+    except FileNotFoundError:
+        pass
+
+
+class _Heartbeat:
+    '''
+    Marks a running job as updated every settings.UPLOAD_HEARTBEAT_INTERVAL seconds, from a thread of its own,
+    so that steps taking longer than settings.UPLOAD_STALE_AFTER don't get the job taken for stale.
+    Stops once the job has been claimed again by another worker, which the job's next progress update reports.
+    '''
+    def __init__(self, job: UploadJob) -> None:
+        self.job = job
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.beat, name=f"upload-heartbeat-{job.id}", daemon=True)
+
+    def __enter__(self) -> '_Heartbeat':
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stopped.set()
+        self.thread.join()
+
+    def beat(self) -> None:
+        try:
+            while not self.stopped.wait(settings.UPLOAD_HEARTBEAT_INTERVAL):
+                if not _owned(self.job).update(updated=datetime.now()):
+                    return
+        except Exception:
+            traceback.print_exc()
+        finally:
+            connection.close()
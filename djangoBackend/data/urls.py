@@ -5,9 +5,18 @@ app_name = 'data'
 
 urlpatterns = [
      path('visualise2D/', views.visualise_2D, name='visualise_2D'),
+     path('visualise2D/video/', views.visualise_2D_video, name='visualise_2D_video'),
+     path('visualise2D/frames/', views.visualise_2D_frames, name='visualise_2D_frames'),
      path('poses/upload/', views.poses_upload, name='frames_upload'),
+     path('poses/upload/async/', views.poses_upload_async, name='frames_upload_async'),
+     path('poses/chunk/', views.poses_chunk_upload, name='poses_chunk_upload'),
      path('video/upload/', views.video_upload, name='video_upload'),
+     path('video/upload/async/', views.video_upload_async, name='video_upload_async'),
+     path('upload/status/<str:job_id>/', views.upload_status, name='upload_status'),
+     path('clips/', views.list_clips, name='list_clips'),
      path('session/init/', views.session_init, name='session_init'),
      path('api/init_user/', views.user_init, name='init_user'),
-     path('logs/', views.show_log, name='show_log')
+     path('logs/', views.show_log, name='show_log'),
+     path('cache/stats/', views.cache_stats, name='cache_stats'),
+     path('posepool/stats/', views.pose_pool_stats, name='pose_pool_stats')
 ]
\ No newline at end of file
@@ -1,5 +1,4 @@
 import os
-import cv2
 import json
 import uuid
 from datetime import datetime
@@ -7,12 +6,32 @@ from rest_framework import status
 from django.shortcuts import render
 from django.views.decorators.csrf import csrf_exempt
 from django.http import HttpResponse as response, JsonResponse
-from .models import User, Session
+from django.urls import reverse
+from django.utils.http import urlencode
+from django.db.models import F
+from .models import User, Session, InvolvedIn, UploadJob, Clip
 import data.datastore.sessionmeta as sm
+import data.datastore.chunkmeta as cm
+import data.datastore.uploadlog as uploadlog
 from data.datastore.posestore import PoseStore
 from data.datastore.videostore import VideoStore
-from data.visualise import create_2D_visualisation 
+from data.datastore.cache import get_clip_cache
+from data.visualise import find_2D_visualisation_video, get_2D_visualisation_video, render_window, MODES, STORED_MODE
+from data.streaming import ranged_file_response
+import data.wire as wire
+import data.uploadqueue as uploadqueue
+from data.posepool import get_pose_pool_stats
 from django.conf import settings
+from asgiref.sync import sync_to_async
+
+def async_csrf_exempt(view):
+    '''
+    Mark an async view as exempt from CSRF protection.
+    Django 4.2's csrf_exempt wraps views in a sync function, which would stop async views being run as async.
+    '''
+    view.csrf_exempt = True
+    return view
+
 
 @csrf_exempt
 def user_init(request):
@@ -27,12 +46,7 @@ def user_init(request):
     new_user = User(uid, first_name, last_name)
     new_user.save()
 
-    # Write user details to log file
-    log_file_path = os.path.join(settings.BASE_DIR, 'upload_log.txt')
-    with open(log_file_path, 'a') as f:
-        f.write('\n')
-        f.write('\n')
-        f.write(f"\nPatient: {first_name} {last_name}\nuid: {uid}\n")
+    uploadlog.log_user(uid, first_name, last_name)
 
     return JsonResponse({'uid': uid}, status=201)
 
@@ -41,10 +55,12 @@ def user_init(request):
 def session_init(request):
     '''
     Initialise session metadata for a newly started session.
+    The id of the patient the session is for may be given as uid, so it is logged with the patient.
     '''
     data = json.loads(request.body)
     # uids = data.get('uids')
     session = data.get('session')
+    uid = data.get('uid')
 
     # NOTE -> skip error checking for now
     # First, ensure every user that is involved in this session exists
@@ -61,20 +77,16 @@ def session_init(request):
         session.get('description')
     )
 
-    # Write session details to log file
-    log_file_path = os.path.join(settings.BASE_DIR, 'upload_log.txt')
-    with open(log_file_path, 'a') as f:
-        f.write(f"Session Name: {new_session.name}\nSession Description: {new_session.description}\nsid: {new_sid}\n")
-
     new_session.save()
 
-    # NOTE -> skip for now
-    # Record each user as being involved in this session
-    # for user in users:
-    #    InvolvedIn(id=str(uuid.uuid4()), user=user, session=new_session).save()
+    # Record the patient as being involved in this session, so its clips are logged with the patient
+    user = User.objects.filter(id=uid).first() if uid else None
+    if user:
+        InvolvedIn(id=str(uuid.uuid4()), user=user, session=new_session).save()
+    uploadlog.log_session(new_sid, new_session.name, new_session.description, uid)
 
     return response(
-        json.dumps({'sid': new_sid}),
+        json.dumps({'sid': new_sid, 'clip_num': new_session.clip_num}),
         content_type="application/json",
         status=status.HTTP_200_OK
     )
@@ -84,12 +96,18 @@ def session_init(request):
 def poses_upload(request):
     '''
     Receive pose data, process it and store it locally. 
+
+    The body may be JSON, msgpack or a raw float32 frame block, see data.wire.
     '''
-    data = json.loads(request.body)
+    try:
+        data, timestamps, keypoints = wire.decode_poses(request)
+    except wire.UnsupportedEncoding as e:
+        return response(str(e), status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+    except ValueError as e:
+        return response(f"invalid pose data: {e}", status=status.HTTP_400_BAD_REQUEST)
 
     # uid = data.get('uid')
     sid = data.get('sid')
-    poses = data.get('poses')
 
     # NOTE -> skip error checking for now
     # user = User.objects.filter(id=uid)
@@ -101,83 +119,294 @@ def poses_upload(request):
     # if not len(InvolvedIn.objects.filter(session=sid, user=uid)):
     #    return response("user was not involved in this session", status=status.HTTP_403_FORBIDDEN)
 
-    clip_num = sm.get_clip_num(sid)
-    pose_store = PoseStore(sid, clip_num)
-    pose_store.write_locally(json.loads(poses))
+    try:
+        clip_num = sm.get_clip_num(sid)
+    except Session.DoesNotExist:
+        return response("session with this id does not exist", status=status.HTTP_404_NOT_FOUND)
+
+    store_poses(sid, clip_num, timestamps, keypoints)
     return response(status=status.HTTP_200_OK)
 
 
+@async_csrf_exempt
+async def poses_upload_async(request):
+    '''
+    Async version of poses_upload, for serving under ASGI (see connectedhealth/asgi.py).
+
+    Decoding and storing the poses run in threads of their own (not the single thread sync views
+    share under ASGI), so uploads of different clips are decoded and written to disk in parallel
+    while the event loop carries on receiving others.
+    '''
+    try:
+        data, timestamps, keypoints = await sync_to_async(wire.decode_poses, thread_sensitive=False)(request)
+    except wire.UnsupportedEncoding as e:
+        return response(str(e), status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+    except ValueError as e:
+        return response(f"invalid pose data: {e}", status=status.HTTP_400_BAD_REQUEST)
+
+    sid = data.get('sid')
+    try:
+        clip_num = await sync_to_async(sm.get_clip_num)(sid)
+    except Session.DoesNotExist:
+        return response("session with this id does not exist", status=status.HTTP_404_NOT_FOUND)
+
+    await sync_to_async(store_poses, thread_sensitive=False)(sid, clip_num, timestamps, keypoints)
+    return response(status=status.HTTP_200_OK)
+
+
+def store_poses(sid: str, clip_num: int, timestamps, keypoints) -> None:
+    '''
+    Append uploaded pose data to the local copy of a clip and to its live joint angles.
+    Only touches the clip's files, so may run in any thread.
+    '''
+    PoseStore(sid, clip_num).append(timestamps, keypoints)
+    cm.update_live_angles(sid, clip_num, timestamps, keypoints)
+
+
+@csrf_exempt
+def poses_chunk_upload(request):
+    '''
+    Receive a sequence-numbered chunk of pose data for a clip of a session and store it locally.
+
+    Expects the fields sid, clip_num and seq along with the poses, where clip_num is the clip the
+    poses were recorded in and seq numbers the chunks of each clip from 0. The body may be JSON
+    ({"sid": ..., "clip_num": ..., "seq": ..., "poses": [...]}), msgpack or a raw float32 frame
+    block, see data.wire.
+
+    Chunks for a clip that was already closed (its video uploaded) are rejected with 409.
+
+    A chunk that was already received (e.g. a retry) is acknowledged without being stored
+    again. The response reports the next expected sequence number and any gaps, so the
+    client can resend missing chunks: {"seq", "duplicate", "next_seq", "missing"}.
+
+    Clients served through ASGI can stream chunks over a WebSocket instead (see data/posestream.py),
+    and fall back to this endpoint, as chunks are numbered the same way.
+    '''
+    try:
+        data, timestamps, keypoints = wire.decode_poses(request)
+        sid = data['sid']
+        clip_num = int(data['clip_num'])
+        seq = int(data['seq'])
+    except wire.UnsupportedEncoding as e:
+        return response(str(e), status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+    except (ValueError, KeyError, TypeError):
+        return response("expected sid, clip_num, seq and poses", status=status.HTTP_400_BAD_REQUEST)
+    if seq < 0:
+        return response("seq must not be negative", status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        stored = cm.store_chunk(sid, clip_num, seq, timestamps, keypoints)
+    except Session.DoesNotExist:
+        return response("session with this id does not exist", status=status.HTTP_404_NOT_FOUND)
+    except cm.ClipClosed as e:
+        return response(str(e), status=status.HTTP_409_CONFLICT)
+    return JsonResponse({'seq': seq, 'duplicate': not stored, **cm.get_progress(sid, clip_num)})
+
+
 @csrf_exempt
 def video_upload(request):
     '''
-    Receive video data and store it in cloud storage.
+    Receive video data and queue it for upload to cloud storage.
 
     Currently, receiving video data means the end of a clip, so also:
-        - increment clip number for this session
-        - write pose data for this clip to cloud storage
+        - queue pose data for this clip for upload to cloud storage
+        - move the session on to its next clip number
+
+    The upload itself is done by a background worker (see data/uploadqueue.py), so this
+    responds straight away with the id of the upload job, whose progress can be followed
+    at upload_status.
     '''
     video = request.FILES['video']
     sid = request.POST.get('sid', '')
-    clip_num = sm.get_clip_num(sid)
 
-    video_store = VideoStore(sid, clip_num)
-    video_store.write(video)
+    try:
+        clip_num = finish_clip(sid, request.POST.get('clip_num'))
+    except ValueError:
+        return response("clip_num must be a number", status=status.HTTP_400_BAD_REQUEST)
+    except Session.DoesNotExist:
+        return response("session with this id does not exist", status=status.HTTP_404_NOT_FOUND)
 
-    pose_store = PoseStore(sid, clip_num)
-    pose_store.write_to_cloud()
+    job = uploadqueue.enqueue(sid, clip_num, video)
 
-    sm.increment_clip_num(sid)
+    print(f"\nUpload Queued\nsid: {sid}\nclip num: {clip_num}\njob: {job.id}\n")
 
-    print(f"\nUpload Finished\nsid: {sid}\nclip num: {clip_num}\n")
+    uploadlog.log_clip(sid, clip_num)
 
-    # Write message to a file
-    log_file_path = os.path.join(settings.BASE_DIR, 'upload_log.txt')
-    with open(log_file_path, 'a') as f:
-        f.write(f"===== Uploaded Clip: {clip_num} ======")
+    return video_queued(job, clip_num)
+
+
+@async_csrf_exempt
+async def video_upload_async(request):
+    '''
+    Async version of video_upload, for serving under ASGI (see connectedhealth/asgi.py).
+
+    Parsing the upload and spooling the video run in threads of their own, and the database is
+    reached through sync_to_async, so the event loop is never blocked while a video is written to
+    disk. Like video_upload, this makes no storage calls: the upload itself is done by a worker.
+    '''
+    # Reading the form parses the multipart body, writing large videos to a temporary file
+    files = await sync_to_async(lambda: request.FILES, thread_sensitive=False)()
+    video = files['video']
+    sid = request.POST.get('sid', '')
+
+    # The video is spooled before touching the database, whose work is then done in one go, as in
+    # video_upload: each hop to the database is another wait on SQLite's write lock under load
+    job_id, video_path = await sync_to_async(uploadqueue.spool_video, thread_sensitive=False)(video)
+    try:
+        job, clip_num = await sync_to_async(queue_video)(sid, request.POST.get('clip_num'), job_id, video_path)
+    except (ValueError, Session.DoesNotExist) as e:
+        await sync_to_async(os.remove, thread_sensitive=False)(video_path)
+        if isinstance(e, ValueError):
+            return response("clip_num must be a number", status=status.HTTP_400_BAD_REQUEST)
+        return response("session with this id does not exist", status=status.HTTP_404_NOT_FOUND)
+
+    print(f"\nUpload Queued\nsid: {sid}\nclip num: {clip_num}\njob: {job.id}\n")
+    return video_queued(job, clip_num)
+
+
+def queue_video(sid: str, clip_num: str, job_id: str, video_path: str) -> tuple:
+    '''
+    Close the clip a spooled video was uploaded for (see finish_clip), queue it for upload and log it.
+
+    Returns:
+        (job, clip_num), the upload job and the number of the clip.
+    '''
+    clip_num = finish_clip(sid, clip_num)
+    job = uploadqueue.queue_job(sid, clip_num, job_id, video_path)
+    uploadlog.log_clip(sid, clip_num)
+    return job, clip_num
+
+
+def finish_clip(sid: str, clip_num: str = None) -> int:
+    '''
+    Close the clip a video was uploaded for, moving the session on to its next clip.
+
+    Args:
+        sid: the id of the session.
+        clip_num: the clip the video was recorded for, as numbered by the client along with its
+                  pose chunks, or None to take the session's current clip.
+
+    Returns:
+        The number of the clip.
+
+    Raises:
+        ValueError: if clip_num is not a number.
+        Session.DoesNotExist: if there is no session with this id.
+    '''
+    if clip_num is not None:
+        clip_num = int(clip_num)
+        sm.close_clip(sid, clip_num)
+        return clip_num
+    # Taking the clip number and moving on to the next one is a single atomic step, so
+    # overlapping uploads for the same session never get the same clip
+    return sm.allocate_clip_num(sid)
+
+
+def video_queued(job: UploadJob, clip_num: int) -> JsonResponse:
+    '''
+    Respond to a video upload with its upload job, whose progress can be followed at upload_status.
+    '''
+    return JsonResponse(
+        {'job_id': job.id, 'clip_num': clip_num, 'status_url': reverse('data:upload_status', args=[job.id])},
+        status=status.HTTP_202_ACCEPTED
+    )
+
+
+def upload_status(request, job_id):
+    '''
+    Report the progress of a clip upload job.
+    '''
+    try:
+        job = UploadJob.objects.get(id=job_id)
+    except UploadJob.DoesNotExist:
+        return response("upload job with this id does not exist", status=status.HTTP_404_NOT_FOUND)
+
+    return JsonResponse({
+        'job_id': job.id,
+        'sid': job.session_id,
+        'clip_num': job.clip_num,
+        'status': job.status,
+        'progress': job.progress,
+        'attempts': job.attempts,
+        'error': job.error,
+    })
+
+
+def list_clips(request):
+    '''
+    List clips from the clip catalog, newest first, optionally only those of one session (sid)
+    or with one status. Results are paged with offset and limit (at most settings.CLIP_LIST_MAX_LIMIT).
+    '''
+    try:
+        offset = int(request.GET.get('offset', 0))
+        limit = int(request.GET.get('limit', settings.CLIP_LIST_MAX_LIMIT))
+    except ValueError:
+        return response("offset and limit must be integers", status=status.HTTP_400_BAD_REQUEST)
+    if offset < 0 or not 0 < limit <= settings.CLIP_LIST_MAX_LIMIT:
+        return response(
+            f"offset must not be negative and limit must be between 1 and {settings.CLIP_LIST_MAX_LIMIT}",
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    clips = Clip.objects.order_by('-created_at', '-id')
+    if request.GET.get('sid'):
+        clips = clips.filter(session_id=request.GET['sid'])
+    if request.GET.get('status'):
+        clips = clips.filter(status=request.GET['status'])
+
+    # One extra row tells whether there is another page
+    page = list(clips.values(
+        'clip_num', 'status', 'frame_count', 'duration', 'fps',
+        'pose_bytes', 'video_bytes', 'pose_key', 'video_key', 'created_at', sid=F('session_id')
+    )[offset:offset + limit + 1])
+    return JsonResponse({
+        'clips': page[:limit],
+        'next_offset': offset + limit if len(page) > limit else None,
+    })
+
+
+def cache_stats(request):
+    '''
+    Report hit and miss counters and sizes of the clip cache in this process.
+    '''
+    return JsonResponse(get_clip_cache().stats())
+
+
+def pose_pool_stats(request):
+    '''
+    Report wait time and utilisation of the pose estimator pool in this process.
+    '''
+    return JsonResponse({'pool': get_pose_pool_stats()})
 
-    return response(status=status.HTTP_200_OK)
 
 @csrf_exempt
 def show_log(request):
-    # Define the path to the log file
-    log_file_path = os.path.join(settings.BASE_DIR, 'upload_log.txt')
+    '''
+    Show the latest entries of the upload log, newest first.
 
-    # Read the contents of the log file
+    Entries can be filtered by session (sid) or patient name (patient), and are paged
+    (page, from 1) settings.UPLOAD_LOG_PAGE_SIZE entries at a time.
+    '''
+    sid = request.GET.get('sid', '').strip()
+    patient = request.GET.get('patient', '').strip()
     try:
-        with open(log_file_path, 'r') as f:
-            log_lines = f.readlines()
-    except FileNotFoundError:
-        log_lines = []
-    
-    # Process log lines to create entries
-    log_entries = []
-    current_entry = []
-
-    for line in log_lines:
-        line = line.rstrip()  # Remove trailing whitespace
-        if line.startswith('Patient:'):
-            if current_entry:  # Add the previous entry
-                log_entries.append('\n'.join(current_entry).strip())
-            current_entry = [line]  # Start a new entry
-        else:
-            current_entry.append(line)
-    
-    # Append the last entry if there is one
-    if current_entry:
-        log_entries.append('\n'.join(current_entry).strip())
-    
-    # Keep only the latest 5 logs
-    latest_logs = log_entries[-5:]
-    
-    # Write the latest logs back to the file
-    with open(log_file_path, 'w') as f:
-        f.write('\n\n'.join(latest_logs) + '\n')
-    
-    # Prepare the content for rendering
-    log_content = '\n\n'.join(latest_logs)
-    
-    # Pass the log content to the template
-    return render(request, 'show_log.html', {'log_content': log_content})
+        page = max(1, int(request.GET.get('page', 1)))
+    except ValueError:
+        return response("page must be an integer", status=status.HTTP_400_BAD_REQUEST)
+
+    # One extra entry tells whether there is another page
+    page_size = settings.UPLOAD_LOG_PAGE_SIZE
+    events = uploadlog.get_events((page - 1) * page_size, page_size + 1, sid, patient)
+
+    filters = {key: value for key, value in (('sid', sid), ('patient', patient)) if value}
+    return render(request, 'show_log.html', {
+        'events': events[:page_size],
+        'sid': sid,
+        'patient': patient,
+        'page': page,
+        'previous_query': urlencode({**filters, 'page': page - 1}) if page > 1 else None,
+        'next_query': urlencode({**filters, 'page': page + 1}) if len(events) > page_size else None,
+    })
 
 @csrf_exempt
 def visualise_2D(request):
@@ -189,19 +418,80 @@ def visualise_2D(request):
     #           don't expect user id in request currently
     sid = request.GET.get('sid')
     clip_num = request.GET.get('clipNum')
+    # Stored keypoints are drawn by default, mode=mediapipe reruns pose estimation for comparison
+    mode = request.GET.get('mode', STORED_MODE)
+    if mode not in MODES:
+        return response(f"mode must be one of {', '.join(MODES)}", status=status.HTTP_400_BAD_REQUEST)
+
+    # Play the clip's stored overlay if it has one, otherwise the page fetches frames
+    # a window at a time, as they are needed, while they are rendered.
+    query = urlencode({'sid': sid, 'clipNum': clip_num, 'mode': mode})
+    stored = find_2D_visualisation_video(sid, clip_num, mode) is not None
+    if not stored:
+        # Fetch the clip now, so that errors are shown on the page and frame requests are cache hits
+        try:
+            PoseStore.open(sid, clip_num)
+            VideoStore(sid, clip_num).get()
+        except ValueError as e:
+            print(e)
+            return render(request, 'visualise2D.html', {'frames_url': 'null'})
+
+    context = {
+        'frames_url': 'null' if stored else json.dumps(f"{reverse('data:visualise_2D_frames')}?{query}"),
+        'video_url': f"{reverse('data:visualise_2D_video')}?{query}",
+        'stored': stored,
+    }
+    return render(request, 'visualise2D.html', context, content_type='text/html')
+
+
+def visualise_2D_frames(request):
+    '''
+    Return a window of frames of a 2D visualisation (see visualise_2D), as JSON (see data.visualise.render_window).
+
+    Query parameters are sid, clipNum and mode as for visualise_2D, and:
+        start       - number of the first frame, 0 by default.
+        count       - maximum number of frames, up to settings.VISUALISE_MAX_WINDOW_FRAMES (the default).
+        stride      - only every stride-th frame is returned, 1 by default.
+        maxWidth    - frames are scaled down to at most this width, if given.
+    '''
+    sid = request.GET.get('sid')
+    clip_num = request.GET.get('clipNum')
+    mode = request.GET.get('mode', STORED_MODE)
+    if mode not in MODES:
+        return response(f"mode must be one of {', '.join(MODES)}", status=status.HTTP_400_BAD_REQUEST)
+    try:
+        start = int(request.GET.get('start', 0))
+        count = int(request.GET.get('count', settings.VISUALISE_MAX_WINDOW_FRAMES))
+        stride = int(request.GET.get('stride', 1))
+        max_width = int(request.GET['maxWidth']) if request.GET.get('maxWidth') else None
+    except ValueError:
+        return response("start, count, stride and maxWidth must be integers", status=status.HTTP_400_BAD_REQUEST)
+    if start < 0 or stride < 1 or not 1 <= count <= settings.VISUALISE_MAX_WINDOW_FRAMES or (max_width is not None and max_width < 1):
+        return response(
+            f"expected start >= 0, stride >= 1, maxWidth >= 1 and 1 <= count <= {settings.VISUALISE_MAX_WINDOW_FRAMES}",
+            status=status.HTTP_400_BAD_REQUEST
+        )
 
-    pose_store = PoseStore(sid, clip_num)
-    video_store = VideoStore(sid, clip_num)
     try:
-        poses = pose_store.get()
-        cap = cv2.VideoCapture(video_store.get())
+        poses = PoseStore.open(sid, clip_num)
+        video_path = VideoStore(sid, clip_num).get()
     except ValueError as e:
-        print(e)
-        return render(request, 'visualise2D.html', {'frames': None})
+        return response(str(e), status=status.HTTP_404_NOT_FOUND)
+    return JsonResponse(render_window(poses, video_path, start, count, stride, max_width, mode))
+
 
-    if not cap.isOpened():
-        print("Error: Could not open the video file.")
-        return render(request, 'visualise2D.html', {'frames': None})
+def visualise_2D_video(request):
+    '''
+    Stream the video of a 2D visualisation (see visualise_2D), with support for Range requests.
+    '''
+    sid = request.GET.get('sid')
+    clip_num = request.GET.get('clipNum')
+    mode = request.GET.get('mode', STORED_MODE)
+    if mode not in MODES:
+        return response(f"mode must be one of {', '.join(MODES)}", status=status.HTTP_400_BAD_REQUEST)
 
-    frames = json.dumps(create_2D_visualisation(poses, cap))
-    return render(request, 'visualise2D.html', {'frames': frames}, content_type='text/html')
+    try:
+        path, content_type = get_2D_visualisation_video(sid, clip_num, mode)
+    except ValueError as e:
+        return response(str(e), status=status.HTTP_404_NOT_FOUND)
+    return ranged_file_response(request, path, content_type)
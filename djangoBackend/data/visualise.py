@@ -1,57 +1,536 @@
+import os
 import cv2
 import base64
-import mediapipe as mp
+import hashlib
+import tempfile
+import threading
+import functools
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+import django
+from django.conf import settings
 import data.const as const
+import data.datastore.poseformat as poseformat
+from data.datastore.posereader import PoseReader
+from data.datastore.posestore import PoseStore
+from data.datastore.videostore import VideoStore
+from data.datastore.overlaystore import OverlayStore
+from data.datastore.cache import get_clip_cache
+from data.posepool import get_pose_pool
 
-def create_2D_visualisation(poses: list, cap: cv2.VideoCapture) -> list:
+# Rendering modes for create_2D_visualisation.
+STORED_MODE = "stored"
+MEDIAPIPE_MODE = "mediapipe"
+MODES = (STORED_MODE, MEDIAPIPE_MODE)
+
+# Formats visualisations can be written as, in order of preference, as (fourcc, file extension,
+# content type). Not every OpenCV build can encode every format (pip builds can't encode H.264).
+VIDEO_FORMATS = (
+    ('avc1', '.mp4', 'video/mp4'),
+    ('VP80', '.webm', 'video/webm'),
+    ('MJPG', '.avi', 'video/x-msvideo'),
+)
+
+# Version of the renderer, to be increased whenever a change to it changes how visualisations look,
+# so that overlays rendered before the change are no longer used.
+RENDERER_VERSION = 1
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def create_2D_visualisation(poses: PoseReader, video_path: str, mode: str = STORED_MODE, workers: int = None) -> list:
     '''
     Return a list of frames that represent the video data for a clip overlayed with
     the pose data from that clip.
 
+    The clip is split into ranges of frames, which are rendered in parallel by a pool of
+    worker processes, each reading the video from the start of its range.
+
     Args:
-        poses: a list representing the pose data from a clip.
-        cap: the video capture for this clip.
+        poses: a reader over the pose data from a clip.
+        video_path: path to the video file for this clip.
+        mode: where the overlayed keypoints come from:
+            "stored"    - the clip's stored pose data, aligned to video frames by timestamp.
+            "mediapipe" - MediaPipe pose estimation rerun on every frame, to compare against
+                          the stored pose data. Much slower.
+        workers: number of ranges to split the clip into, settings.VISUALISE_WORKERS by default.
+            The clip is rendered in this process if this is 1.
 
     Returns:
         list representing pose data overlayed on video data for this clip.
+
+    Raises:
+        ValueError: if mode is not recognised, or the video file can't be opened.
     '''
-    mp_pose = mp.solutions.pose
     frames = []
-    with mp_pose.Pose(
-        static_image_mode=True,
-        model_complexity=0,
-        enable_segmentation=True,
-        min_detection_confidence=0.5) as pose:
-
-        for _ in poses:
-            ret, frame_image = cap.read()
-            if not ret:
-                # video has reached the end
-                break
-
-            frame_height, frame_width, _ = frame_image.shape
-
-            # Convert the BGR image to RGB before processing.
-            results = pose.process(cv2.cvtColor(frame_image, cv2.COLOR_BGR2RGB))
-
-            # Create a copy of the frame for overlaying keypoints
-            overlay_image = frame_image.copy()
-
-            if results.pose_landmarks:
-                # Overlay each keypoint onto the image for this frame
-                keypoints = [(int(lm.x * frame_width), int(lm.y * frame_height)) for lm in results.pose_landmarks.landmark]
-
-                for kp in keypoints:
-                    cv2.circle(overlay_image, kp, radius=2, color=(0, 255, 0), thickness=-1)
-
-                # Connect the dots - draw lines between joints to form a human stick-figure shape
-                for joint1, joint2 in const.KP_CONNS:
-                    pt1 = keypoints[joint1]
-                    pt2 = keypoints[joint2]
-                    cv2.line(overlay_image, pt1, pt2, (0, 255, 0), 1)
-
-            _, buffer = cv2.imencode('.png', overlay_image)
-            img_base64 = base64.b64encode(buffer).decode('utf-8')
-            frames.append(img_base64)
+    for range_frames in render_ranges(poses, video_path, mode, workers, '.png'):
+        frames.extend(base64.b64encode(frame).decode('utf-8') for frame in range_frames)
     cv2.destroyAllWindows()
     return frames
+
+
+def write_2D_visualisation(poses: PoseReader, video_path: str, out_path: str, mode: str = STORED_MODE, workers: int = None) -> None:
+    '''
+    Write the video for a clip overlayed with the pose data from that clip to a video file,
+    in the format returned by get_video_format(), at the frame rate of the clip's video.
+
+    Args:
+        poses, video_path, mode, workers: see create_2D_visualisation.
+        out_path: path of the video file to write, which should have the format's extension.
+
+    Raises:
+        ValueError: if mode is not recognised, or the video file can't be opened.
+    '''
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30
+    cap.release()
+
+    writer = None
+    fourcc, _, _ = get_video_format()
+    try:
+        for range_frames in render_ranges(poses, video_path, mode, workers, '.jpg'):
+            for frame in range_frames:
+                image = cv2.imdecode(np.frombuffer(frame, dtype=np.uint8), cv2.IMREAD_COLOR)
+                if writer is None:
+                    frame_height, frame_width, _ = image.shape
+                    writer = cv2.VideoWriter(out_path, cv2.VideoWriter_fourcc(*fourcc), fps, (frame_width, frame_height))
+                writer.write(image)
+    finally:
+        if writer is not None:
+            writer.release()
+    if writer is None:
+        raise ValueError(f"the video file '{video_path}' has no frames")
+
+
+@functools.lru_cache(maxsize=None)
+def get_video_format() -> tuple:
+    '''
+    Return the first of VIDEO_FORMATS that this OpenCV build can encode.
+    '''
+    with tempfile.TemporaryDirectory() as directory:
+        for fourcc, extension, content_type in VIDEO_FORMATS:
+            writer = cv2.VideoWriter(os.path.join(directory, f"probe{extension}"), cv2.VideoWriter_fourcc(*fourcc), 30, (64, 64))
+            opened = writer.isOpened()
+            writer.release()
+            if opened:
+                return fourcc, extension, content_type
+    raise RuntimeError("OpenCV can't encode any of the visualisation video formats")
+
+
+def get_video_info(video_path: str) -> tuple:
+    '''
+    Return (number of frames, frame rate) of a video, either of which is None if it can't be read.
+    '''
+    cap = cv2.VideoCapture(video_path)
+    try:
+        return int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) or None, cap.get(cv2.CAP_PROP_FPS) or None
+    finally:
+        cap.release()
+
+
+def get_overlay_tag(mode: str = STORED_MODE) -> str:
+    '''
+    Return the tag identifying overlays rendered in a mode with the current renderer and its settings,
+    for use with OverlayStore. Overlays stored with any other tag are stale.
+    '''
+    fourcc, extension, _ = get_video_format()
+    renderer = (RENDERER_VERSION, mode, fourcc, const.MODEL_INPUT_SIZE, const.NUM_DRAWN_KEYPOINTS, const.MAX_POSE_OFFSET_MS, const.KP_CONNS)
+    version = hashlib.sha1(repr(renderer).encode()).hexdigest()[:8]
+    return f"{mode}_{version}{extension}"
+
+
+def find_2D_visualisation_video(sid: str, clip_num: str, mode: str = STORED_MODE) -> tuple:
+    '''
+    Return the stored overlay of a clip (see store_2D_visualisation), if there is an up to date one.
+
+    Returns:
+        (path, content type) of the video file, or None if there is no up to date overlay.
+    '''
+    _, _, content_type = get_video_format()
+    try:
+        return OverlayStore(sid, clip_num, get_overlay_tag(mode)).get(), content_type
+    except ValueError:
+        return None
+
+
+def get_2D_visualisation_video(sid: str, clip_num: str, mode: str = STORED_MODE) -> tuple:
+    '''
+    Return a video of a clip overlayed with the pose data from that clip (see write_2D_visualisation).
+
+    The clip's stored overlay is used if there is an up to date one. Otherwise the video is rendered
+    now, and stored as the clip's overlay (in stored mode). Videos are kept in the clip cache, so are
+    only downloaded or rendered again if the clip's video or pose data changes.
+
+    Returns:
+        (path, content type) of the video file.
+
+    Raises:
+        ValueError: if mode is not recognised, or video or pose data for this clip is not found.
+    '''
+    stored = find_2D_visualisation_video(sid, clip_num, mode)
+    if stored is not None:
+        return stored
+
+    poses = PoseStore.open(sid, clip_num)
+    video_path = VideoStore(sid, clip_num).get()
+    _, extension, content_type = get_video_format()
+
+    # The cached video's name already changes with the video's ETag
+    pose_hash = hashlib.sha1(poses.timestamps().tobytes())
+    pose_hash.update(poses.keypoints().tobytes())
+    etag = f"{os.path.basename(video_path)}-{pose_hash.hexdigest()}"
+    path = get_clip_cache().get_created_file(
+        f"visualisations/{sid}_{clip_num}_{mode}{extension}",
+        etag,
+        lambda out_path: write_2D_visualisation(poses, video_path, out_path, mode)
+    )
+
+    if mode == STORED_MODE:
+        # Store the overlay for next time, it can always be rendered again if this fails
+        try:
+            with open(path, "rb") as f:
+                OverlayStore(sid, clip_num, get_overlay_tag(mode)).write(f)
+        except Exception as e:
+            print(f"could not store overlay for clip with sid '{sid}' and clip number '{clip_num}': {e}")
+    return path, content_type
+
+
+def store_2D_visualisation(sid: str, clip_num: str, video_path: str = None) -> None:
+    '''
+    Render the overlay of a clip (in stored mode) and store it, so that it doesn't have to be
+    rendered when the clip is viewed. Clips don't change once uploaded, so this is done once,
+    after the upload.
+
+    Args:
+        sid: the id of the session.
+        clip_num: the clip number within this session.
+        video_path: path to a local copy of the clip's video, downloaded from storage if not given.
+
+    Raises:
+        ValueError: if video or pose data for this clip is not found.
+    '''
+    poses = PoseStore.open(sid, clip_num)
+    video_path = video_path or VideoStore(sid, clip_num).get()
+    tag = get_overlay_tag(STORED_MODE)
+
+    with tempfile.TemporaryDirectory() as directory:
+        out_path = os.path.join(directory, f"overlay{os.path.splitext(tag)[1]}")
+        write_2D_visualisation(poses, video_path, out_path, STORED_MODE)
+        with open(out_path, "rb") as f:
+            OverlayStore(sid, clip_num, tag).write(f)
+
+
+def render_window(poses: PoseReader, video_path: str, start: int, count: int, stride: int = 1,
+                  max_width: int = None, mode: str = STORED_MODE) -> dict:
+    '''
+    Render a window of frames of a clip overlayed with the pose data from that clip, so that
+    a clip can be shown as it is rendered, rather than once all of it has been rendered.
+
+    Args:
+        poses, video_path, mode: see create_2D_visualisation.
+        start: number of the first frame in the window.
+        count: (maximum) number of frames in the window.
+        stride: only every stride-th frame from start is rendered, e.g. for previews.
+        max_width: frames wider than this are scaled down to this width.
+
+    Returns:
+        dictionary with the window's frames, as base64 encoded JPEG images, and details of the clip:
+            start, stride   - as given.
+            frames          - the rendered frames, which are frames start, start + stride, ...
+            num_frames      - number of frames in the clip, or None if the video doesn't record it.
+            fps             - frame rate of the clip.
+            next            - number of the first frame after this window, or None at the end of the clip.
+
+    Raises:
+        ValueError: if mode is not recognised, or the video file can't be opened.
+    '''
+    if mode not in MODES:
+        raise ValueError(f"unknown visualisation mode '{mode}', expected one of {MODES}")
+
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise ValueError(f"could not open the video file '{video_path}'")
+    num_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) or None
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30
+    cap.release()
+
+    if mode == STORED_MODE:
+        pose_times, xy = align_poses(poses)
+    else:
+        # As many frames are rendered as there are poses
+        pose_times, xy = None, None
+        num_frames = min(num_frames, len(poses)) if num_frames else len(poses)
+
+    stop = start + count * stride
+    if num_frames is not None:
+        stop = min(stop, num_frames)
+    frames = render_frames(video_path, start, stop, mode, pose_times, xy, '.jpg', stride, max_width)
+
+    next_start = start + len(frames) * stride
+    at_end = len(frames) < count or (num_frames is not None and next_start >= num_frames)
+    return {
+        'start': start,
+        'stride': stride,
+        'frames': [base64.b64encode(frame).decode('utf-8') for frame in frames],
+        'num_frames': num_frames,
+        'fps': fps,
+        'next': None if at_end else next_start,
+    }
+
+
+def render_ranges(poses: PoseReader, video_path: str, mode: str, workers: int, image_format: str):
+    '''
+    Render a clip overlayed with its pose data in ranges of frames, in parallel (see create_2D_visualisation).
+
+    Args:
+        poses, video_path, mode, workers: see create_2D_visualisation.
+        image_format: format frames are encoded in, as an OpenCV image file extension, e.g. '.png'.
+
+    Returns:
+        iterator over the lists of encoded frames for each range, in order.
+
+    Raises:
+        ValueError: if mode is not recognised, or the video file can't be opened.
+    '''
+    if mode not in MODES:
+        raise ValueError(f"unknown visualisation mode '{mode}', expected one of {MODES}")
+
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise ValueError(f"could not open the video file '{video_path}'")
+    # Containers don't always record their frame count, in which case it is 0
+    num_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+
+    if mode == STORED_MODE:
+        pose_times, xy = align_poses(poses)
+        stop = num_frames or None
+    else:
+        # As many frames are rendered as there are poses
+        pose_times, xy = None, None
+        stop = min(num_frames, len(poses)) if num_frames else len(poses)
+
+    workers = workers or settings.VISUALISE_WORKERS
+    ranges = split_frames(stop, workers) if stop is not None and workers > 1 else [(0, stop)]
+    if len(ranges) == 1:
+        return iter([render_frames(video_path, *ranges[0], mode, pose_times, xy, image_format)])
+
+    executor = get_executor()
+    futures = [executor.submit(render_frames, video_path, start, end, mode, pose_times, xy, image_format) for start, end in ranges]
+    return (future.result() for future in futures)
+
+
+def split_frames(num_frames: int, num_ranges: int) -> list:
+    '''
+    Split frames [0, num_frames) into up to num_ranges contiguous (start, stop) ranges of
+    (almost) equal length, none shorter than settings.VISUALISE_MIN_RANGE_FRAMES frames.
+    '''
+    num_ranges = max(1, min(num_ranges, num_frames // settings.VISUALISE_MIN_RANGE_FRAMES))
+    bounds = np.linspace(0, num_frames, num_ranges + 1).astype(int)
+    return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+
+def get_executor() -> ProcessPoolExecutor:
+    '''
+    Return the pool of worker processes that frame ranges are rendered in, shared by the
+    whole process and sized by settings.VISUALISE_WORKERS. Workers live for as long as
+    the pool, so each keeps its own warm pose estimator pool between requests.
+    '''
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ProcessPoolExecutor(max_workers=settings.VISUALISE_WORKERS, initializer=django.setup)
+    return _executor
+
+
+def render_frames(video_path: str, start: int, stop: int, mode: str, pose_times: np.ndarray = None, xy: np.ndarray = None,
+                  image_format: str = '.png', stride: int = 1, max_width: int = None) -> list:
+    '''
+    Render frames [start, stop) of a video, overlayed with keypoints, as encoded images.
+
+    Args:
+        video_path: path to the video file.
+        start: index of the first frame to render.
+        stop: index after the last frame to render, or None to render to the end of the video.
+        mode: see create_2D_visualisation.
+        pose_times, xy: the stored poses, as returned by align_poses. Only used in stored mode.
+        image_format: format to encode frames in, as an OpenCV image file extension, e.g. '.png'.
+        stride, max_width: see read_frames.
+    '''
+    cap = cv2.VideoCapture(video_path)
+    if start:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+
+    frames = read_frames(cap, start, stop, stride, max_width)
+    if mode == STORED_MODE:
+        keypoints = stored_keypoints(pose_times, xy, cap, frames)
+    else:
+        keypoints = mediapipe_keypoints(frames)
+
+    frames = []
+    for frame_image, frame_keypoints in keypoints:
+        # Create a copy of the frame for overlaying keypoints
+        overlay_image = frame_image.copy()
+        if frame_keypoints is not None:
+            draw_keypoints(overlay_image, frame_keypoints)
+
+        _, buffer = cv2.imencode(image_format, overlay_image)
+        frames.append(buffer.tobytes())
+    cap.release()
+    return frames
+
+
+def read_frames(cap: cv2.VideoCapture, start: int, stop: int, stride: int = 1, max_width: int = None):
+    '''
+    Yield (frame number, frame image) for frames [start, stop) of a video capture that has
+    been moved to frame start, or up to the end of the video if stop is None.
+
+    Args:
+        stride: only every stride-th frame is yielded. The frames in between are skipped without decoding them.
+        max_width: frames wider than this are scaled down to this width, keeping their aspect ratio.
+    '''
+    frame_num = start
+    while stop is None or frame_num < stop:
+        ret, frame_image = cap.read()
+        if not ret:
+            # video has reached the end
+            break
+        frame_height, frame_width, _ = frame_image.shape
+        if max_width and frame_width > max_width:
+            size = (max_width, max(1, round(frame_height * max_width / frame_width)))
+            frame_image = cv2.resize(frame_image, size, interpolation=cv2.INTER_AREA)
+        yield frame_num, frame_image
+
+        for _ in range(stride - 1):
+            if not cap.grab():
+                return
+        frame_num += stride
+
+
+def draw_keypoints(image: np.ndarray, keypoints: list) -> None:
+    '''
+    Draw keypoints, and the connections between them, onto an image.
+
+    Args:
+        image: the (BGR) image to draw onto.
+        keypoints: list of (x, y) pixel coordinates, indexed as in the pose estimation model's output,
+            or None for keypoints that should not be drawn.
+    '''
+    for kp in keypoints:
+        if kp is not None:
+            cv2.circle(image, kp, radius=2, color=(0, 255, 0), thickness=-1)
+
+    # Connect the dots - draw lines between joints to form a human stick-figure shape
+    for joint1, joint2 in const.KP_CONNS:
+        pt1 = keypoints[joint1]
+        pt2 = keypoints[joint2]
+        if pt1 is not None and pt2 is not None:
+            cv2.line(image, pt1, pt2, (0, 255, 0), 1)
+
+
+def align_poses(poses: PoseReader) -> tuple:
+    '''
+    Return the stored poses of a clip in the form used to draw them over its video.
+
+    Pose timestamps are wall clock times, so are aligned to the video by assuming the first
+    pose was estimated from the first frame.
+
+    Returns:
+        (pose_times, xy), where pose_times is the sorted times (in milliseconds since the first
+        pose) of the poses that have a timestamp, and xy has shape (poses, keypoints, 2) and holds
+        the x and y values of the keypoints that are drawn, for each of those poses.
+    '''
+    poses = poses.in_capture_order()
+    timestamps = poses.timestamps()
+    valid = np.flatnonzero(timestamps != poseformat.MISSING_TIMESTAMP)
+    pose_times = timestamps[valid] - timestamps[valid[0]] if len(valid) else timestamps[valid]
+    # Only x and y of the keypoints that are drawn are needed
+    xy = poses.keypoints()[valid, :const.NUM_DRAWN_KEYPOINTS, :2]
+    return pose_times, xy
+
+
+def pose_video_times(poses: PoseReader) -> np.ndarray:
+    '''
+    Return the time (in seconds) in the clip's video of each pose, aligned as by align_poses.
+    Poses without a timestamp get a time interpolated from those of the poses around them.
+
+    Poses are taken in the order they were captured (see PoseReader.in_capture_order), as PoseStore
+    readers return them, so the times are sorted.
+    '''
+    poses = poses.in_capture_order()
+    timestamps = poses.timestamps()
+    valid = np.flatnonzero(timestamps != poseformat.MISSING_TIMESTAMP)
+    if len(valid) == 0:
+        # Nothing to align by, assume poses were estimated from every frame at 30 fps
+        return np.arange(len(poses)) / 30
+    times = (timestamps[valid] - timestamps[valid].min()) / 1000
+    return np.interp(np.arange(len(poses)), valid, times)
+
+
+def stored_keypoints(pose_times: np.ndarray, xy: np.ndarray, cap: cv2.VideoCapture, frames):
+    '''
+    Yield (frame image, keypoints) for frames of a video, where keypoints are the pixel
+    coordinates of the stored pose closest in time to the frame (see draw_keypoints), or
+    None if there is no pose within const.MAX_POSE_OFFSET_MS of it.
+
+    Args:
+        pose_times, xy: the stored poses, as returned by align_poses.
+        cap: the video capture the frames are read from.
+        frames: iterator over (frame number, frame image), as returned by read_frames.
+    '''
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30
+    for frame_num, frame_image in frames:
+        frame_time = cap.get(cv2.CAP_PROP_POS_MSEC) or frame_num * 1000 / fps
+
+        index = nearest_index(pose_times, frame_time)
+        if index is None or abs(pose_times[index] - frame_time) > const.MAX_POSE_OFFSET_MS:
+            yield frame_image, None
+            continue
+
+        # Keypoints are in the coordinates of the model input, which is the frame resized to a square
+        frame_height, frame_width, _ = frame_image.shape
+        scale = np.array([frame_width, frame_height]) / const.MODEL_INPUT_SIZE
+        points = xy[index] * scale
+        finite = np.isfinite(points).all(axis=1)
+        points = np.where(finite[:, None], points, 0).astype(int)
+        yield frame_image, [(int(x), int(y)) if ok else None for (x, y), ok in zip(points, finite)]
+
+
+def nearest_index(times: np.ndarray, time: float) -> int:
+    '''
+    Return the index of the value in a sorted array closest to time, or None if the array is empty.
+    '''
+    if len(times) == 0:
+        return None
+    index = int(np.searchsorted(times, time))
+    if index == len(times) or (index > 0 and time - times[index - 1] <= times[index] - time):
+        index -= 1
+    return index
+
+
+def mediapipe_keypoints(frames):
+    '''
+    Yield (frame image, keypoints) for frames of a video, where keypoints are the pixel coordinates
+    (see draw_keypoints) estimated by running MediaPipe on the frame, with an estimator from the
+    process's pose pool, or None if no pose was detected.
+
+    Args:
+        frames: iterator over (frame number, frame image), as returned by read_frames.
+    '''
+    pool = get_pose_pool()
+    for _, frame_image in frames:
+        frame_height, frame_width, _ = frame_image.shape
+
+        # Convert the BGR image to RGB before processing. Estimators are borrowed for
+        # one frame at a time, so concurrent requests share the pool fairly.
+        rgb_image = cv2.cvtColor(frame_image, cv2.COLOR_BGR2RGB)
+        with pool.borrow() as pose:
+            results = pose.process(rgb_image)
+
+        if results.pose_landmarks:
+            keypoints = [(int(lm.x * frame_width), int(lm.y * frame_height)) for lm in results.pose_landmarks.landmark]
+            yield frame_image, keypoints
+        else:
+            yield frame_image, None
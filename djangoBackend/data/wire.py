@@ -0,0 +1,99 @@
+'''
+Decoding of pose data uploaded by the mobile application.
+
+The encoding of a request body is chosen by its Content-Type:
+    application/json            - {"sid": ..., "poses": [...]} where poses is a list (or a JSON string
+                                  of a list) of poses as received from the pose estimation model.
+    application/msgpack         - a map {"sid": ..., "timestamps": [...], "keypoints": <bin>}, where
+                                  keypoints holds little-endian float32 values, 195 per frame, in the
+                                  order they are received from the pose estimation model.
+    application/octet-stream    - a packed pose blob (see data.datastore.poseformat.pack), with other
+                                  fields (e.g. sid) given as query parameters.
+
+Every encoding decodes to the (timestamps, keypoints) arrays used by PoseStore.
+'''
+
+import json
+import msgpack
+import numpy as np
+import data.datastore.poseformat as poseformat
+from data.datastore.posestore import PoseStore
+
+JSON_CONTENT_TYPE = "application/json"
+MSGPACK_CONTENT_TYPES = ("application/msgpack", "application/x-msgpack")
+RAW_CONTENT_TYPE = "application/octet-stream"
+
+
+class UnsupportedEncoding(Exception):
+    '''Raised when a request body is in an encoding that is not supported.'''
+
+
+def decode_poses(request) -> tuple:
+    '''
+    Decode uploaded pose data from a request, according to its Content-Type.
+    Requests without a supported binary Content-Type are decoded as JSON.
+
+    Returns:
+        (fields, timestamps, keypoints), where fields is a dictionary of the other fields of the
+        upload (e.g. sid), and timestamps and keypoints have shape (frames,) and (frames, 39, 5).
+
+    Raises:
+        ValueError: if the body can't be decoded.
+        UnsupportedEncoding: if the Content-Type names a form encoding, which isn't supported.
+    '''
+    content_type = request.content_type
+    if content_type in MSGPACK_CONTENT_TYPES:
+        return decode_msgpack(request.body)
+    if content_type == RAW_CONTENT_TYPE:
+        return request.GET.dict(), *poseformat.unpack(request.body)
+    if content_type in ("multipart/form-data", "application/x-www-form-urlencoded"):
+        raise UnsupportedEncoding(f"pose data can't be uploaded as {content_type}")
+    return decode_json(request.body)
+
+
+def decode_json(body: bytes) -> tuple:
+    '''
+    Decode a JSON upload, see decode_poses.
+    '''
+    fields = json.loads(body)
+    if not isinstance(fields, dict):
+        raise ValueError("expected a JSON object")
+    poses = fields.pop('poses', None)
+
+    # Older clients send poses as a JSON string inside the JSON body
+    if isinstance(poses, str):
+        poses = json.loads(poses)
+    if not isinstance(poses, list):
+        raise ValueError("poses must be a list")
+    return fields, *PoseStore.format_poses_array(poses)
+
+
+def decode_msgpack(body: bytes) -> tuple:
+    '''
+    Decode a msgpack upload, see decode_poses.
+    '''
+    try:
+        fields = msgpack.unpackb(body)
+    except (msgpack.UnpackException, ValueError) as e:
+        raise ValueError(f"invalid msgpack body: {e}") from e
+    if not isinstance(fields, dict):
+        raise ValueError("expected a msgpack map")
+    try:
+        timestamps = np.asarray(fields.pop('timestamps'), dtype=poseformat.TIMESTAMP_DTYPE)
+        keypoints = np.frombuffer(fields.pop('keypoints'), dtype=poseformat.KEYPOINT_DTYPE)
+    except (KeyError, TypeError) as e:
+        raise ValueError("expected timestamps and keypoints") from e
+    if timestamps.ndim != 1 or len(keypoints) != len(timestamps) * poseformat.FRAME_NBYTES // poseformat.KEYPOINT_DTYPE.itemsize:
+        raise ValueError(f"expected {len(timestamps)} frames of keypoint values")
+    return fields, timestamps, keypoints.reshape((len(timestamps),) + poseformat.FRAME_SHAPE)
+
+
+def encode_msgpack(fields: dict, timestamps: np.ndarray, keypoints: np.ndarray) -> bytes:
+    '''
+    Encode an upload as msgpack, the inverse of decode_msgpack.
+    '''
+    return msgpack.packb({
+        **fields,
+        'timestamps': np.asarray(timestamps, dtype=poseformat.TIMESTAMP_DTYPE).tolist(),
+        'keypoints': np.ascontiguousarray(keypoints, dtype=poseformat.KEYPOINT_DTYPE).tobytes(),
+    })
@@ -10,64 +10,145 @@ import { getFullUrl } from './helper.js';
 
 // Navigation Bar
 let tablePopupOpened = false;
-const numFrames = frameData.length;
-const formatedAngles = formatAngleData();
-const tableAngles = formatedAngles.tableAngles;
-const graphAngles = formatedAngles.graphAngles;
-const labels = getGraphLabels();
+const video = document.getElementById("animation");
+const numFrames = poseTimes.length;
+const jointSelect = document.getElementById("joint-select");
+let currentJoint = jointData;
+let graphAngles;
 let leftChart, rightChart;
 
-// Draw table and graph
-draw()
+// Angle series, in the order they are sent by the server
+const seriesNames = ['leftRoll', 'leftPitch', 'leftYaw', 'rightRoll', 'rightPitch', 'rightYaw', 'left3d', 'right3d'];
+const precision = 2;
 
-// Format Angle Data
-function formatAngleData() {
-    let tableAngles = [];
-    let graphAngles = [];
-    for (let i = 0; i < 8; i++) {
-        let currentTableAngles = [];
-        let currentGraphAngles = [];
-        for (let j = 0; j < numFrames; j++) {
-            let rounded = angleData[i][j].toFixed(2);
-            currentTableAngles.push(rounded + '°');
-            currentGraphAngles.push(rounded);
+// The table shows every frame, so the joint's angles are fetched at full resolution when the table is first opened
+const fullAngles = {};
+let tableJoint = null;
+let tableAngles, tableTimes;
+
+// Draw graph
+selectJoint(jointData)
+
+// Every joint's angles are sent with the page, so switching joint only redraws
+jointSelect.addEventListener('change', function() {
+    selectJoint(jointSelect.value);
+    updateAnnotation();
+});
+
+// Show the graph (and table, if it is open) of a joint
+function selectJoint(joint) {
+    currentJoint = joint;
+    jointSelect.value = joint;
+    graphAngles = angleData[joint];
+
+    if (leftChart) {
+        leftChart.destroy();
+        rightChart.destroy();
+    }
+    draw();
+    if (tablePopupOpened) {
+        loadTable();
+    }
+}
+
+// Fetch angles of the current joint, with extra query parameters
+async function fetchAngles(params) {
+    const query = new URLSearchParams({ joints: currentJoint, precision: precision, ...params });
+    const response = await fetch(`${anglesUrl}&${query}`);
+    if (!response.ok) {
+        throw new Error(await response.text());
+    }
+    const series = (await response.json()).angles[currentJoint];
+    return seriesNames.map(name => series[name]);
+}
+
+// Draw the table of the current joint, fetching its angles at full resolution the first time
+async function loadTable() {
+    const joint = currentJoint;
+    if (tableJoint === joint) {
+        return;
+    }
+    if (!(joint in fullAngles)) {
+        try {
+            fullAngles[joint] = await fetchAngles({});
+        } catch (error) {
+            console.log(error);
+            return;
         }
-        tableAngles.push(currentTableAngles);
-        graphAngles.push(currentGraphAngles);
     }
+    if (joint !== currentJoint) {
+        return;
+    }
+
+    tableJoint = joint;
+    tableAngles = formatAngleData(fullAngles[joint]);
+    tableTimes = fullAngles[joint][0].map(point => point.x.toFixed(2));
+    document.getElementById('angle-table-left').replaceChildren();
+    document.getElementById('angle-table-right').replaceChildren();
+    if (dimensionData === '2d') {
+        drawTable2d();
+    } else {
+        drawTable3d();
+    }
+}
 
-    return { tableAngles, graphAngles };
+// Format Angle Data
+function formatAngleData(jointAngles) {
+    // Frames without an angle (e.g. overlapping points) are null
+    return jointAngles.map(series => series.map(point => point.y === null ? '-' : point.y.toFixed(precision) + '°'));
 }
 
-// Get Graph Labels
-function getGraphLabels() {
-    var labels = [];
-    for (let i = 0; i < numFrames; i += 1) {
-        labels.push(i);
+// Show the part of the clip a graph is zoomed in on in full detail, by fetching just that range,
+// downsampled to the width of the graph
+async function loadRange(chart) {
+    const request = chart.rangeRequest = (chart.rangeRequest || 0) + 1;
+    const joint = currentJoint;
+    let series;
+    try {
+        series = await fetchAngles({
+            start: chart.scales.x.min,
+            end: chart.scales.x.max,
+            points: Math.max(3, Math.round(chart.width)),
+        });
+    } catch (error) {
+        console.log(error);
+        return;
+    }
+    // Ignore responses to older requests, or for a joint that is no longer shown
+    if (request !== chart.rangeRequest || joint !== currentJoint) {
+        return;
     }
+    chartSeries(chart).forEach((index, dataset) => {
+        chart.data.datasets[dataset].data = series[index];
+    });
+    chart.update('none');
+}
 
-    return labels;
+// Indexes of the angle series shown in a graph
+function chartSeries(chart) {
+    const left = chart === leftChart;
+    if (dimensionData === '2d') {
+        return left ? [0, 1, 2] : [3, 4, 5];
+    }
+    return left ? [6] : [7];
 }
 
-// Draw table and graph
+// Draw graph
 function draw() {
     let data, leftData, rightData, leftConfig, rightConfig;
     if (dimensionData === '2d') {
-        drawTable2d();
         data = get2dGraphData();
         leftData = data.leftData;
         rightData = data.rightData;
     } else {
-        drawTable3d();
         data = get3dGraphData();
         leftData = data.leftData;
         rightData = data.rightData;
-        console.log(rightData)
     }
 
     // Draw Graph
-    leftConfig = getGraphConfig(leftData, "Left " + jointData);
-    rightConfig = getGraphConfig(rightData, "Right " + jointData);
+    leftConfig = getGraphConfig(leftData, "Left " + currentJoint);
+    rightConfig = getGraphConfig(rightData, "Right " + currentJoint);
     const leftAngleChart = document.getElementById('chart-left');
     const rightAngleChart = document.getElementById('chart-right');
     leftChart = new Chart(leftAngleChart, leftConfig);
@@ -110,6 +191,7 @@ function getGraphConfig(data, title) {
                         enabled: true,
                         mode: 'xy',
                         threshold: 5,
+                        onPanComplete: ({ chart }) => loadRange(chart),
                     },
                     zoom: {
                         wheel: {
@@ -119,11 +201,15 @@ function getGraphConfig(data, title) {
                             enabled: true
                         },
                         mode: 'xy',
+                        onZoomComplete: ({ chart }) => loadRange(chart),
                     },
                 }
             },
             scales: {
                 x: {
+                    type: 'linear',
+                    min: 0,
+                    max: poseTimes[numFrames - 1],
                     title: {
                         display: true,
                         text: 'Time (Seconds)'
@@ -148,7 +234,6 @@ function getGraphConfig(data, title) {
 // Get Graph Data
 function get2dGraphData() {
     const leftData = {
-        labels: labels,
         datasets: [{
             label: 'Roll',
             data: graphAngles[0],
@@ -171,7 +256,6 @@ function get2dGraphData() {
     };
 
     const rightData = {
-        labels: labels,
         datasets: [{
             label: 'Roll',
             data: graphAngles[3],
@@ -198,7 +282,6 @@ function get2dGraphData() {
 
 function get3dGraphData() {
     const leftData = {
-        labels: labels,
         datasets: [{
             label: '3D Angles',
             data: graphAngles[6],
@@ -208,7 +291,6 @@ function get3dGraphData() {
     };
 
     const rightData = {
-        labels: labels,
         datasets: [{
             label: '3D Angles',
             data: graphAngles[7],
@@ -227,7 +309,7 @@ function drawTable2d() {
     for (let i = 0; i < 4; i++) {
         const row = document.createElement("tr");
 
-        for (let j = -1; j < numFrames; j++) {
+        for (let j = -1; j < tableTimes.length; j++) {
             let cell = 0;
             if (j == -1 || i == 0) {
                 cell = document.createElement("th");
@@ -235,7 +317,7 @@ function drawTable2d() {
                 cell = document.createElement("td");
             }
             
-            let celltext = document.createTextNode(String(j));
+            let celltext = document.createTextNode(tableTimes[j]);
 
             if (i == 0) {
                 if (j == -1) {
@@ -276,7 +358,7 @@ function drawTable2d() {
     for (let i = 0; i < 4; i++) {
         const row = document.createElement("tr");
 
-        for (let j = -1; j < numFrames; j++) {
+        for (let j = -1; j < tableTimes.length; j++) {
             let cell = 0;
             if (j == -1 || i == 0) {
                 cell = document.createElement("th");
@@ -284,7 +366,7 @@ function drawTable2d() {
                 cell = document.createElement("td");
             }
             
-            let celltext = document.createTextNode(String(j));
+            let celltext = document.createTextNode(tableTimes[j]);
 
             if (i == 0) {
                 if (j == -1) {
@@ -327,7 +409,7 @@ function drawTable3d() {
     for (let i = 0; i < 2; i++) {
         const row = document.createElement("tr");
 
-        for (let j = -1; j < numFrames; j++) {
+        for (let j = -1; j < tableTimes.length; j++) {
             let cell = 0;
             if (j == -1 || i == 0) {
                 cell = document.createElement("th");
@@ -335,7 +417,7 @@ function drawTable3d() {
                 cell = document.createElement("td");
             }
             
-            let celltext = document.createTextNode(String(j));
+            let celltext = document.createTextNode(tableTimes[j]);
 
             if (i == 0) {
                 if (j == -1) {
@@ -362,7 +444,7 @@ function drawTable3d() {
     for (let i = 0; i < 2; i++) {
         const row = document.createElement("tr");
 
-        for (let j = -1; j < numFrames; j++) {
+        for (let j = -1; j < tableTimes.length; j++) {
             let cell = 0;
             if (j == -1 || i == 0) {
                 cell = document.createElement("th");
@@ -370,7 +452,7 @@ function drawTable3d() {
                 cell = document.createElement("td");
             }
             
-            let celltext = document.createTextNode(String(j));
+            let celltext = document.createTextNode(tableTimes[j]);
 
             if (i == 0) {
                 if (j == -1) {
@@ -405,6 +487,7 @@ document.getElementById('table-button').addEventListener('click', function() {
         tablePopupOpened = true;
         document.getElementById('table-button').style.backgroundColor = "#6693F5";
         window.location.href = `http://127.0.0.1:8000/chart/result/#popup-table`;
+        loadTable();
     } else {
         tablePopupOpened = false;
         document.getElementById('table-button').style.backgroundColor = "white";
@@ -419,6 +502,7 @@ document.getElementById('popup-table-close-button').addEventListener('click', fu
 window.addEventListener('hashchange', function() {
     if (window.location.href.includes('popup-table')) {
         document.getElementById('table-button').style.backgroundColor = "#6693F5";
+        loadTable();
     } else {
         document.getElementById('table-button').style.backgroundColor = "white";
     }
@@ -427,14 +511,25 @@ window.addEventListener('hashchange', function() {
 
 
 // Control Bar
+// The video plays itself, the graph annotation follows the pose nearest to the video's current time.
+// Reverse playback isn't supported by video elements, so is done by stepping back through the poses.
+const speeds = [0.25, 0.5, 1, 2, 4];
 let currentFrame = 0;
-let previousFrame = 0;
-let paused = false;
+let paused = true;
 let loop = false;
 let forward = true;
 let speed = 2;
-let delay = 100;
-updateFrame()
+updateAnnotation()
+
+video.addEventListener('play', function() {
+    requestAnimationFrame(followVideo);
+});
+
+video.addEventListener('seeked', syncAnnotation);
+
+video.addEventListener('ended', function() {
+    updatePlayPause();
+});
 
 document.getElementById('right-control-button').addEventListener('click', function() {
     document.getElementById('right-control-button').hidden = true;
@@ -449,16 +544,11 @@ document.getElementById('left-control-button').addEventListener('click', functio
 });
 
 document.getElementById('rewind-control-button').addEventListener('click', function() {
-    currentFrame = 0;
-    updateFrame();
+    showFrame(0);
 });
 
 document.getElementById('backward-control-button').addEventListener('click', function() {
-    currentFrame--;
-    if (currentFrame < 0) {
-        currentFrame = numFrames - 1
-    }
-    updateFrame();
+    showFrame(currentFrame > 0 ? currentFrame - 1 : numFrames - 1);
 });
 
 document.getElementById('play-control-button').addEventListener('click', function() {
@@ -466,22 +556,23 @@ document.getElementById('play-control-button').addEventListener('click', functio
     document.getElementById('pause-control-button').hidden = false;
     paused = false;
     disableForwardBackward()
-    doGraphVisualisation()
+    if (forward) {
+        video.play();
+    } else {
+        doReverseVisualisation();
+    }
 });
 
 document.getElementById('pause-control-button').addEventListener('click', function() {
     document.getElementById('pause-control-button').hidden = true;
     document.getElementById('play-control-button').hidden = false;
     paused = true;
+    video.pause();
     enableForwardBackward()
 });
 
 document.getElementById('forward-control-button').addEventListener('click', function() {
-    currentFrame++;
-    if (currentFrame >= numFrames) {
-        currentFrame = 0
-    }
-    updateFrame();
+    showFrame(currentFrame < numFrames - 1 ? currentFrame + 1 : 0);
 });
 
 document.getElementById('loop-control-button').addEventListener('click', function() {
@@ -492,87 +583,85 @@ document.getElementById('loop-control-button').addEventListener('click', functio
         loop = true;
         document.getElementById('loop-control-button').style.backgroundColor = "#6693F5";
     }
+    video.loop = loop;
 });
 
 document.getElementById('speed-control-button').addEventListener('click', function() {
     speed++;
-    if (speed > 4) {
+    if (speed >= speeds.length) {
         speed = 0
     }
-
-    switch (speed) {
-        case (0):
-            document.getElementById('speed-control-button').innerHTML = "x0.25";
-            delay = 400;
-            break;
-        case (1):
-            document.getElementById('speed-control-button').innerHTML = "x0.5";
-            delay = 200;
-            break;
-        case (2):
-            document.getElementById('speed-control-button').innerHTML = "x1";
-            delay = 100;
-            break;
-        case (3):
-            document.getElementById('speed-control-button').innerHTML = "x2";
-            delay = 50;
-            break;
-        case (4):
-            document.getElementById('speed-control-button').innerHTML = "x4";
-            delay = 25;
-            break;
-    }
+    document.getElementById('speed-control-button').innerHTML = "x" + speeds[speed];
+    video.playbackRate = speeds[speed];
 });
 
 const sleep = (delay) => {
     return new Promise(resolve => setTimeout(resolve, delay))
 }
 
-const doGraphVisualisation = async() => {
-    while (true) {
-        if (paused) {
-            currentFrame = previousFrame;
-            break;
+const doReverseVisualisation = async() => {
+    while (!paused) {
+        if (currentFrame == 0) {
+            if (!loop) {
+                updatePlayPause();
+                break;
+            }
+            showFrame(numFrames - 1);
+        } else {
+            const delay = (poseTimes[currentFrame] - poseTimes[currentFrame - 1]) * 1000 / speeds[speed];
+            await sleep(delay);
+            if (!paused) {
+                showFrame(currentFrame - 1);
+            }
         }
+    }
+};
 
-        updateFrame()
+// Follow the video while it plays, more often than its timeupdate events
+function followVideo() {
+    syncAnnotation();
+    if (!video.paused && !video.ended) {
+        requestAnimationFrame(followVideo);
+    }
+}
 
-        if (forward) {
-            previousFrame = currentFrame;
-            currentFrame++;
+// Move the annotation to the pose nearest to the video's current time
+function syncAnnotation() {
+    const frame = frameAtTime(video.currentTime);
+    if (frame != currentFrame) {
+        currentFrame = frame;
+        updateAnnotation();
+    }
+}
 
-            if (currentFrame >= numFrames) {
-                currentFrame = 0;
-    
-                if (!loop) {
-                    updatePlayPause();
-                    break;
-                }
-            }
+// Index of the pose nearest to a time (in seconds) in the video, by binary search
+function frameAtTime(time) {
+    let low = 0;
+    let high = numFrames - 1;
+    while (low < high) {
+        const mid = Math.floor((low + high) / 2);
+        if (poseTimes[mid] < time) {
+            low = mid + 1;
         } else {
-            previousFrame = currentFrame;
-            currentFrame--;
-
-            if (currentFrame < 0) {
-                currentFrame = numFrames - 1;
-    
-                if (!loop) {
-                    updatePlayPause();
-                    break;
-                }
-            }
+            high = mid;
         }
-        
-        await sleep(delay);
     }
-};
+    if (low > 0 && time - poseTimes[low - 1] <= poseTimes[low] - time) {
+        low--;
+    }
+    return low;
+}
 
-function updateFrame() {
-    const frameBase64Img = frameData[currentFrame];
-    const image = document.getElementById("animation");
-    image.src = "data:image/png;base64," + frameBase64Img;
-    leftChart.options.plugins.annotation.annotations.line.value = currentFrame;
-    rightChart.options.plugins.annotation.annotations.line.value = currentFrame;
+// Show a pose, and the video at the time of that pose
+function showFrame(frame) {
+    currentFrame = frame;
+    video.currentTime = poseTimes[frame];
+    updateAnnotation();
+}
+
+function updateAnnotation() {
+    leftChart.options.plugins.annotation.annotations.line.value = poseTimes[currentFrame];
+    rightChart.options.plugins.annotation.annotations.line.value = poseTimes[currentFrame];
     leftChart.update();
     rightChart.update();
 }
@@ -603,7 +692,7 @@ function enableForwardBackward() {
 function updatePlayPause() {
     document.getElementById('pause-control-button').hidden = true;
     document.getElementById('play-control-button').hidden = false;
-    paused = false;
+    paused = true;
     enableForwardBackward()
-    updateFrame()
+    syncAnnotation()
 }
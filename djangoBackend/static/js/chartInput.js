@@ -0,0 +1,37 @@
+/*
+    Javascript code for the joint angle graph input page
+    Suggests the stored clips of the entered session, from the clip catalog.
+*/
+
+const sidInput = document.getElementById("sid");
+const clipOptions = document.getElementById("clip-options");
+let clipsRequest = 0;
+
+sidInput.addEventListener('change', loadClips);
+
+// Fill the clip number suggestions with the stored clips of the entered session
+async function loadClips() {
+    const request = ++clipsRequest;
+    const sid = sidInput.value.trim();
+    clipOptions.replaceChildren();
+    if (sid.length == 0) {
+        return;
+    }
+
+    const query = new URLSearchParams({ sid: sid, status: 'stored' });
+    const response = await fetch(`${clipsUrl}?${query}`);
+    // Ignore responses for a session that is no longer entered
+    if (!response.ok || request !== clipsRequest) {
+        return;
+    }
+
+    const clips = (await response.json()).clips;
+    for (const clip of clips) {
+        const option = document.createElement("option");
+        option.value = clip.clip_num;
+        if (clip.duration !== null) {
+            option.label = `clip ${clip.clip_num} (${clip.duration.toFixed(1)} s)`;
+        }
+        clipOptions.appendChild(option);
+    }
+}
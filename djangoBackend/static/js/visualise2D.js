@@ -2,6 +2,8 @@
     Javascript code for the visualisation demo
     Handles session id and clip number input, sending a request to the backend to
     process this input and display a visualisation of the corresponding clip.
+    Frames of the visualisation are fetched from the backend a window at a time, ahead of
+    the frame being shown, so playback starts once the first window has been rendered.
 */
 
 import { getFullUrl } from "./helper.js";
@@ -13,29 +15,92 @@ function requestVisualisation(sessionId, clipNum) {
   window.location.href = url;
 }
 
-export const doVisualisation = (frameData) => {
-  /* Code to display the visualisation (create a video display) */
+// Number of frames fetched in each request, and how many windows are kept either side of the playhead.
+const WINDOW_SIZE = 60;
+const WINDOWS_KEPT = 3;
+
+export const doVisualisation = (framesUrl) => {
+  /* Play the visualisation, fetching windows of frames as they are needed */
+  const img = document.getElementById("animation");
+  const scrubber = document.getElementById("animation-scrubber");
+  const windows = new Map(); // window start -> frames, or null while being fetched
+  let numFrames = null;
   let currentFrame = 0;
+  let timer = null;
 
-  function updateFrame() {
-    const base64Img = frameData[currentFrame];
-    if (!base64Img) {
-      console.error("Invalid base64 image data:", base64Img);
-      console.error("Current frame:", currentFrame);
-      console.error("Frame data:", frameData);
+  async function fetchWindow(start) {
+    if (windows.has(start) || (numFrames !== null && start >= numFrames)) {
       return;
     }
+    windows.set(start, null);
+    const maxWidth = Math.round(img.clientWidth * window.devicePixelRatio) || "";
+    try {
+      const res = await fetch(
+        getFullUrl(`${framesUrl}&start=${start}&count=${WINDOW_SIZE}&maxWidth=${maxWidth}`)
+      );
+      if (!res.ok) {
+        throw new Error(await res.text());
+      }
+      const data = await res.json();
+      windows.set(start, data.frames);
+      if (data.next === null) {
+        numFrames = start + data.frames.length;
+      } else if (data.num_frames !== null) {
+        numFrames = data.num_frames;
+      }
+      scrubber.max = Math.max((numFrames ?? start + data.frames.length) - 1, 0);
+      if (timer === null) {
+        timer = setInterval(updateFrame, 1000 / data.fps);
+      }
+    } catch (error) {
+      console.error("Could not fetch frames from", start, error);
+      windows.delete(start);
+    }
+  }
 
-    const img = document.getElementById("animation");
-    img.src = "data:image/png;base64," + base64Img;
+  function windowStart(frame) {
+    return frame - (frame % WINDOW_SIZE);
+  }
 
+  function updateFrame() {
+    const start = windowStart(currentFrame);
+    const frames = windows.get(start);
+
+    // Prefetch the next window once the playhead is half way through this one
+    if (currentFrame - start >= WINDOW_SIZE / 2) {
+      fetchWindow(start + WINDOW_SIZE);
+    }
+    if (!frames) {
+      // Waiting for this window to arrive
+      fetchWindow(start);
+      return;
+    }
+
+    img.src = "data:image/jpeg;base64," + frames[currentFrame - start];
+    scrubber.value = currentFrame;
     currentFrame++;
-    if (currentFrame >= frameData.length) {
+    if (numFrames !== null && currentFrame >= numFrames) {
       currentFrame = 0;
     }
+    dropWindows();
+  }
+
+  function dropWindows() {
+    // Keep memory use bounded on long clips
+    const start = windowStart(currentFrame);
+    for (const key of windows.keys()) {
+      if (Math.abs(key - start) > WINDOWS_KEPT * WINDOW_SIZE && windows.get(key) !== null) {
+        windows.delete(key);
+      }
+    }
   }
 
-  setInterval(updateFrame, 55); // Adjust the interval (in milliseconds) to control the animation speed
+  scrubber.addEventListener("input", function () {
+    currentFrame = Number(scrubber.value);
+    fetchWindow(windowStart(currentFrame));
+  });
+
+  fetchWindow(0);
 };
 
 document.addEventListener("DOMContentLoaded", function () {
@@ -50,5 +115,7 @@ document.addEventListener("DOMContentLoaded", function () {
     requestVisualisation(sessionId.value, clipNum.value);
   });
 
-  doVisualisation(frameData);
+  if (framesUrl) {
+    doVisualisation(framesUrl);
+  }
 });
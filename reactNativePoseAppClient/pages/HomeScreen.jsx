@@ -168,6 +168,7 @@ const sendUserInit = async (values, navigation) => {
   let code = values.code;
   let uid = "";
   let sid = "";
+  let clipNum = 1;
 
   // Initilize and Retrieve User
   try {
@@ -190,6 +191,7 @@ const sendUserInit = async (values, navigation) => {
     const response = await Axios.post(
       "http://" + code + "/data/session/init/",
       {
+        uid: uid,
         session: {
           name: values.session_name,
           description: values.session_description,
@@ -197,13 +199,19 @@ const sendUserInit = async (values, navigation) => {
       }
     ).then((response) => {
       sid = response.data.sid;
+      clipNum = response.data.clip_num;
     });
     console.log("Sending Session Details");
   } catch (err) {
     console.log(err);
   }
 
-  navigation.navigate("VisionCamera", { code: code, sid: sid, uid: uid });
+  navigation.navigate("VisionCamera", {
+    code: code,
+    sid: sid,
+    uid: uid,
+    clipNum: clipNum,
+  });
 };
 
 const styles = StyleSheet.create({
@@ -39,7 +39,8 @@ export default function VisionCamera({ route, navigation }) {
   const timeStarted = useSharedValue(0);
   const { sid } = route.params;
   const { code } = route.params;
-  const tensorAsArray = [];
+  // Number of the clip being recorded (or the next one), sent with its pose data and video
+  const clipNum = useRef(route.params.clipNum || 1);
 
   // Select tflite model
   const plugin = useTensorflowModel(
@@ -54,38 +55,227 @@ export default function VisionCamera({ route, navigation }) {
   }, [hasPermission]);
   console.log("Vision Camera has permission: ", hasPermission);
 
-  // Asynchronously sends pose data to the backend server and then clears the pose data array.
+  // Sequence number of the next chunk of pose data in this clip, and chunks not yet acknowledged by the backend.
+  const nextSeq = useRef(0);
+  const pendingChunks = useRef([]);
+  const isSending = useRef(false);
+
+  // WebSocket streaming pose data to the backend (when it is served through ASGI), and the number of
+  // chunks the backend will currently accept on it. Without the socket, pose data is posted every second.
+  const socket = useRef(null);
+  const isStreaming = useRef(false);
+  const credit = useRef(0);
+  const lastPosted = useRef(0);
+  const STREAM_INTERVAL = 100;
+  const POST_INTERVAL = 1000;
+  const DRAIN_TIMEOUT = 15000;
+
+  // Opens the WebSocket and identifies the session on it. If the socket can't be opened, or closes,
+  // pose data is posted instead, including any chunks sent on the socket that were not acknowledged.
+  const openStream = () => {
+    const ws = new WebSocket("ws://" + code + "/data/poses/stream/");
+    ws.onopen = () => {
+      ws.send(JSON.stringify({ type: "hello", sid }));
+    };
+    ws.onmessage = (event) => {
+      const message = JSON.parse(event.data);
+      if (message.type === "ready") {
+        credit.current = message.credit;
+        isStreaming.current = true;
+        return;
+      }
+      // Every reply gives back the credit its chunk used
+      credit.current += message.credit;
+      const isChunk = (chunk) =>
+        chunk.clipNum === message.clip_num && chunk.seq === message.seq;
+      if (message.type === "error") {
+        // The chunk was not stored, so it is sent again
+        console.log("backend could not store pose chunk:", message.message);
+        pendingChunks.current
+          .filter(isChunk)
+          .forEach((chunk) => (chunk.streamed = false));
+        return;
+      }
+      if (message.type === "closed") {
+        console.log("dropped pose chunk of closed clip:", message.clip_num, message.seq);
+      }
+      pendingChunks.current = pendingChunks.current.filter(
+        (chunk) => !isChunk(chunk)
+      );
+    };
+    ws.onclose = () => {
+      if (socket.current === ws) {
+        socket.current = null;
+        isStreaming.current = false;
+        credit.current = 0;
+        pendingChunks.current.forEach((chunk) => (chunk.streamed = false));
+      }
+    };
+    socket.current = ws;
+  };
+
+  const closeStream = () => {
+    const ws = socket.current;
+    socket.current = null;
+    isStreaming.current = false;
+    credit.current = 0;
+    if (ws) {
+      ws.close();
+    }
+  };
+
+  // Sends pose data on the WebSocket, one chunk per credit. Without credit the backend is falling behind,
+  // so poses are kept in the current chunk, which is sent (larger) once credit is given back.
+  const streamData = () => {
+    if (credit.current === 0) {
+      return;
+    }
+    if (poses.value.length > 0) {
+      pendingChunks.current.push({
+        clipNum: clipNum.current,
+        seq: nextSeq.current++,
+        poses: poses.value,
+      });
+      poses.value = [];
+    }
+    for (const chunk of pendingChunks.current) {
+      if (credit.current === 0) {
+        break;
+      }
+      if (!chunk.streamed) {
+        socket.current.send(
+          JSON.stringify({
+            clip_num: chunk.clipNum,
+            seq: chunk.seq,
+            poses: chunk.poses,
+          })
+        );
+        chunk.streamed = true;
+        credit.current--;
+      }
+    }
+  };
+
+  // Moves the current pose data into a new sequence-numbered chunk, then posts every unacknowledged chunk
+  // to the backend server in order. Chunks that fail to send are retried on the next call; the backend
+  // ignores chunks it has already received, and reports any it is missing. Chunks of a clip the backend
+  // has already closed are dropped, as it no longer stores them.
   const sendData = async () => {
-    "worklet";
+    if (poses.value.length > 0) {
+      pendingChunks.current.push({
+        clipNum: clipNum.current,
+        seq: nextSeq.current++,
+        poses: poses.value,
+      });
+      poses.value = [];
+    }
+    if (isSending.current) {
+      return;
+    }
+    isSending.current = true;
     try {
-      const response = await Axios.post(
-        "http://" + code + "/data/poses/upload/",
-        {
-          sid,
-          poses: JSON.stringify(poses.value),
-          tensorAsArray,
+      while (pendingChunks.current.length > 0) {
+        const chunk = pendingChunks.current[0];
+        try {
+          const response = await Axios.post(
+            "http://" + code + "/data/poses/chunk/",
+            {
+              sid,
+              clip_num: chunk.clipNum,
+              seq: chunk.seq,
+              poses: chunk.poses,
+            }
+          );
+          if (response.data.missing.length > 0) {
+            console.log("backend is missing pose chunks:", response.data.missing);
+          }
+        } catch (err) {
+          if (err.response?.status !== 409) {
+            throw err;
+          }
+          console.log("dropped pose chunk of closed clip:", chunk.clipNum, chunk.seq);
         }
-      );
-      // Empty Data
-      console.log("sending pose data:");
-      poses.value = [];
+        pendingChunks.current = pendingChunks.current.filter(
+          (pending) => pending !== chunk
+        );
+      }
+      console.log("sent pose data");
     } catch (err) {
       console.log(err);
+    } finally {
+      isSending.current = false;
     }
   };
 
-  // Starts an interval that sends existing pose data to the backend server every 1 second.
+  // Starts an interval that streams pose data to the backend server as it is produced, or posts it
+  // every 1 second while the WebSocket is not available.
   const startSendingData = () => {
+    nextSeq.current = 0;
+    lastPosted.current = Date.now();
+    openStream();
     intervalId = setInterval(() => {
-      if (poses.value.length > 0) {
-        sendData();
+      if (isStreaming.current) {
+        streamData();
+      } else if (Date.now() - lastPosted.current >= POST_INTERVAL) {
+        lastPosted.current = Date.now();
+        if (poses.value.length > 0 || pendingChunks.current.length > 0) {
+          sendData();
+        }
       }
-    }, 1000);
+    }, STREAM_INTERVAL);
   };
 
-  // Stops the interval that sends pose data to the backend server and clears the pose data array for next clip.
+  // Waits (for up to 5 seconds) until every chunk streamed so far has been acknowledged.
+  const flushStream = async () => {
+    const deadline = Date.now() + 5000;
+    while (isStreaming.current && Date.now() < deadline) {
+      streamData();
+      if (poses.value.length === 0 && pendingChunks.current.length === 0) {
+        return;
+      }
+      await new Promise((resolve) => setTimeout(resolve, 50));
+    }
+  };
+
+  // Posts the remaining pose data, waiting for any post already in flight and retrying failed ones
+  // until the backend has every chunk. Throws if that takes longer than DRAIN_TIMEOUT.
+  const drainChunks = async () => {
+    const deadline = Date.now() + DRAIN_TIMEOUT;
+    while (
+      isSending.current ||
+      poses.value.length > 0 ||
+      pendingChunks.current.length > 0
+    ) {
+      if (Date.now() >= deadline) {
+        throw new Error(
+          pendingChunks.current.length +
+            " pose chunks could not be sent to the backend"
+        );
+      }
+      if (!isSending.current) {
+        await sendData();
+        if (pendingChunks.current.length === 0) {
+          return;
+        }
+      }
+      await new Promise((resolve) => setTimeout(resolve, 250));
+    }
+  };
+
+  // Stops the interval that sends pose data to the backend server, sends any remaining pose data
+  // (posting whatever the WebSocket could not) and clears the pose data array for next clip.
+  // Only returns once the backend has all of the clip's pose data (or it could not be sent in time),
+  // so the video, which closes the clip, is uploaded after it.
   const stopSendingData = async () => {
     clearInterval(intervalId);
+    await flushStream();
+    closeStream();
+    try {
+      await drainChunks();
+    } catch (err) {
+      console.error("Error:", err.message);
+    }
+    pendingChunks.current = [];
     poses.value = [];
   };
 
@@ -125,11 +315,13 @@ export default function VisionCamera({ route, navigation }) {
     // If camera was already recording, then stop recording
     if (isRecording) {
       await stopSendingData();
+      clipNum.current++;
       isAlsoRecording.value = 0;
       cameraRef.current.stopRecording();
       return;
     }
     // Otherwise start recording, processing frames, sending data to backend
+    const recordingClipNum = clipNum.current;
     setIsRecording(true);
     isAlsoRecording.value = 1;
     startSendingData();
@@ -160,6 +352,7 @@ export default function VisionCamera({ route, navigation }) {
           });
         }
         data.append("sid", sid);
+        data.append("clip_num", String(recordingClipNum));
 
         try {
           const response = await Axios.post(
@@ -187,6 +380,7 @@ export default function VisionCamera({ route, navigation }) {
         isAlsoRecording.value = 0;
         setIsRecording(false);
         stopSendingData();
+        clipNum.current++;
       },
     });
   };